@@ -0,0 +1,227 @@
+import bisect
+import math
+import threading
+import time
+from collections import deque, namedtuple
+import spool
+
+# Upper edges (seconds) of the lateness histogram buckets, see DeadlineScheduler.stats
+LATENESS_BUCKETS = (0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+DEFAULT_INTERVAL_MS = 1000
+
+# One acquisition cycle as handed to the UI: formatted timestamp, the same time as epoch seconds
+# (see db_functions.to_epoch), temperatures per channel (None = no reading) and how many seconds
+# after its deadline the cycle started
+Sample = namedtuple("Sample", ["data_time", "ts", "temps", "lateness"])
+
+
+class SampleBuffer:
+    """Thread-safe ring buffer between the acquisition worker and the Tk render loop."""
+
+    def __init__(self, maxlen=600):
+        self.samples = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+        self.dropped = 0  # samples overwritten before the UI drained them
+
+    def put(self, sample):
+        with self.lock:
+            if len(self.samples) == self.samples.maxlen:
+                self.dropped += 1
+            self.samples.append(sample)
+
+    def drain(self):
+        with self.lock:
+            samples = list(self.samples)
+            self.samples.clear()
+        return samples
+
+
+class DeadlineScheduler:
+    """
+    Fires on absolute deadlines of a fixed grid instead of sleeping "interval" after the work,
+    so the period does not stretch by the time the work takes.
+
+    Deadlines are kept on the monotonic clock, the grid itself is aligned to multiples of the
+    interval in wall-clock time (whole seconds for a 1000 ms interval), so stored timestamps are
+    predictable. When a cycle overruns, policy decides what happens to the missed deadlines:
+    "skip" drops them and continues on the next future one, "catch_up" runs them back to back
+    (at most max_backlog of them, older ones are skipped).
+
+    How late every cycle started relative to its grid time is counted in a histogram
+    (LATENESS_BUCKETS), summarised by stats().
+    """
+
+    def __init__(self, interval_ms, policy="skip", max_backlog=10):
+        self.policy = policy
+        self.max_backlog = max_backlog
+
+        self.cycles = 0          # deadlines fired
+        self.skipped = 0         # deadlines dropped because of overruns
+        self.late_count = 0      # cycles that started at least one interval late
+        self.max_lateness = 0.0  # seconds
+        self.lateness_counts = [0] * (len(LATENESS_BUCKETS) + 1)  # the last bucket is everything above 1 s
+
+        self.set_interval(interval_ms)
+
+    def set_interval(self, interval_ms):
+        if interval_ms is None or interval_ms <= 0:
+            raise ValueError(f"the sampling interval must be a positive number of milliseconds, not {interval_ms}")
+        self.interval_ms = interval_ms
+        self.interval = interval_ms / 1000.0
+        self.anchor()
+
+    def anchor(self):
+        # Start the grid at the next wall-clock multiple of the interval
+        wall = time.time()
+        monotonic = time.monotonic()
+        first_wall = math.ceil(wall / self.interval) * self.interval
+        self.anchor_wall = first_wall
+        self.anchor_monotonic = monotonic + (first_wall - wall)
+        self.tick = 0
+
+    def wait_next(self, stop_event):
+        """
+        Block until the next deadline. Returns (scheduled wall-clock time, lateness in seconds),
+        or None if stop_event was set while waiting.
+        """
+        deadline = self.anchor_monotonic + self.tick * self.interval
+        remaining = deadline - time.monotonic()
+        if remaining > 0 and stop_event.wait(remaining):
+            return None
+
+        lateness = time.monotonic() - deadline
+        missed = int(lateness // self.interval)
+        if missed > 0:
+            self.late_count += 1
+            overrun = lateness
+            if self.policy == "catch_up":
+                missed = max(missed - self.max_backlog, 0)
+            if missed:
+                self.skipped += missed
+                self.tick += missed
+                lateness -= missed * self.interval
+            print(f"Acquisition cycle started {overrun:.3f} s late ({self.skipped} deadlines skipped so far)")
+        self.record_lateness(lateness)
+
+        scheduled = self.anchor_wall + self.tick * self.interval
+        self.tick += 1
+
+        # Re-anchor if the wall clock was stepped (NTP, manual change) away from our grid
+        if abs(time.time() - lateness - scheduled) > self.interval / 2:
+            print("Wall clock moved, re-aligning the sampling grid")
+            self.anchor()
+        return scheduled, lateness
+
+    def record_lateness(self, lateness):
+        self.cycles += 1
+        self.max_lateness = max(self.max_lateness, lateness)
+        self.lateness_counts[bisect.bisect_left(LATENESS_BUCKETS, lateness)] += 1
+
+    def lateness_percentile(self, percent):
+        # Upper edge of the histogram bucket holding the given percentile, max_lateness above the last edge
+        if not self.cycles:
+            return 0.0
+        rank = math.ceil(self.cycles * percent / 100)
+        seen = 0
+        for edge, count in zip(LATENESS_BUCKETS, self.lateness_counts):
+            seen += count
+            if seen >= rank:
+                return min(edge, self.max_lateness)
+        return self.max_lateness
+
+    def stats(self):
+        return {
+            "cycles": self.cycles,
+            "skipped": self.skipped,
+            "late_cycles": self.late_count,
+            "lateness_p50_ms": self.lateness_percentile(50) * 1000,
+            "lateness_p99_ms": self.lateness_percentile(99) * 1000,
+            "max_lateness_ms": self.max_lateness * 1000,
+            "lateness_histogram": dict(zip([f"<={edge * 1000:g} ms" for edge in LATENESS_BUCKETS] + [">1000 ms"],
+                                           self.lateness_counts)),
+        }
+
+
+class AcquisitionWorker(threading.Thread):
+    """
+    Background thread that reads the sensors, stores the sample when recording is on and
+    publishes it to a SampleBuffer. Runs independently of the Tk main loop, so dragging
+    windows or running an export does not delay sampling. Cycles are paced by a DeadlineScheduler.
+    """
+
+    def __init__(self, config, read_sample, buffer):
+        super().__init__(name="acquisition", daemon=True)
+        self.config = config
+        self.read_sample = read_sample  # callable returning a list of temperatures
+        self.buffer = buffer
+        self.db_path = config.get("db_path")
+        self.table_name = config.get("table_name")
+
+        # Samples are appended to the spool (cheap, never waits for the database) and written to
+        # the database in batches of batch_size samples / every flush_interval seconds by the drainer
+        self.spool, self.drainer = spool.open_spool(config.get("spool_dir"), self.db_path, self.table_name,
+                                                    config.get("batch_size"), config.get("flush_interval"),
+                                                    config.get("spool_fsync"))
+
+        self.scheduler = DeadlineScheduler(DEFAULT_INTERVAL_MS, config.get("overrun_policy"))
+        self.rejected_interval = None
+        self.apply_settings()
+
+        self.recording = threading.Event()
+        self.stop_event = threading.Event()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        if self.is_alive():
+            self.join(timeout)
+        # Write out whatever is still spooled; what fails stays in the spool for the next start
+        self.drainer.stop()
+        self.spool.close()
+        stats = self.scheduler.stats()
+        print(f"Sampling: {stats['cycles']} cycles, lateness p50 {stats['lateness_p50_ms']:.1f} ms, "
+              f"p99 {stats['lateness_p99_ms']:.1f} ms, max {stats['max_lateness_ms']:.1f} ms, "
+              f"{stats['late_cycles']} overruns, {stats['skipped']} deadlines skipped")
+
+    def apply_settings(self):
+        # Pick up interval/policy changes made in the Config window; an invalid interval is reported once and ignored
+        interval = self.config.get("update_interval")
+        if interval not in (self.scheduler.interval_ms, self.rejected_interval):
+            try:
+                self.scheduler.set_interval(interval)
+            except ValueError as e:
+                print(f"Keeping the {self.scheduler.interval_ms} ms sampling interval: {e}")
+                self.rejected_interval = interval
+        self.scheduler.policy = self.config.get("overrun_policy")
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.apply_settings()
+
+            # stop() wakes the wait up immediately
+            deadline = self.scheduler.wait_next(self.stop_event)
+            if deadline is None:
+                break
+            scheduled, lateness = deadline
+            self.acquire_once(scheduled, lateness)
+
+            # Recording was switched off: write out the spool right away instead of waiting for the timer
+            if not self.recording.is_set():
+                self.drainer.flush_soon()
+
+    def acquire_once(self, scheduled, lateness=0.0):
+        # The sample is stamped with its grid time, not with the moment the read finished
+        ts = int(round(scheduled, 3))
+        data_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(ts))
+        try:
+            temps = list(self.read_sample())
+        except Exception as e:
+            print(f"Sensor read failed: {e}")
+            return
+
+        if self.recording.is_set():
+            try:
+                self.drainer.notify(self.spool.append(ts, temps))
+            except OSError as e:
+                print(f"Failed to spool sample: {e}")
+
+        self.buffer.put(Sample(data_time, ts, temps, lateness))
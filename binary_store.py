@@ -0,0 +1,312 @@
+import argparse
+import bisect
+import os
+import struct
+import threading
+import time
+import numpy as np
+import db_manager
+import readings
+
+# Optional fixed-width binary copy of a samples table, read through numpy.memmap.
+#
+# The file is a 64 byte header followed by one record per sample: id and ts (int64, epoch
+# seconds as in db_functions.to_epoch) and one float32 value per registered sensor channel
+# (NaN = no reading), in id order. The header holds the channel count; a new sensor makes the
+# next read rebuild the file with one more column. Samples are recorded in time order, so the ts column is sorted and a range is found
+# with two binary searches (bisect, which reads ~20 records where np.searchsorted would copy
+# the strided column); the result is a view of the mapped file, nothing is copied or
+# converted until it is used. The file is derived data: it is brought up to date from SQLite
+# (rows with a higher id than its last one) before each read, can be deleted at any time and
+# is rebuilt on demand. Comments, rollups and metadata stay in SQLite.
+#
+# A row recorded out of time order (a late spool drain, a clock step) breaks the binary
+# searches. The file is then rewritten in time order by a background thread; until it is
+# swapped in, reads go to SQLite.
+
+MAGIC = b"TSBIN\x00\x00\x02"
+HEADER = struct.Struct("<8sIBBI")  # magic, record size, ts sorted flag, id sorted flag, channel count
+HEADER_SIZE = 64
+SYNC_BATCH_SIZE = 50000
+
+_enabled = False
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def record_type(channels: int):
+    return np.dtype([("id", "<i8"), ("ts", "<i8"), ("values", "<f4", (channels,))])
+
+
+def load_records(conn, database_name: str, table_name: str, where: str, params, order: str, channels):
+    """
+    Up to SYNC_BATCH_SIZE samples matching where, sorted by order, as records with the values of
+    the registered sensors channels [(sensor_id, name)] (see db_functions.pivot_readings).
+    """
+    import db_functions
+
+    rows = conn.execute(f"SELECT id, ts FROM {table_name} WHERE {where} ORDER BY {order} LIMIT {SYNC_BATCH_SIZE}",
+                        params).fetchall()
+    data = np.array(rows, dtype=np.int64).reshape(-1, 2)
+    records = np.empty(len(data), record_type(len(channels)))
+    records["id"], records["ts"] = data[:, 0], data[:, 1]
+    records["values"] = db_functions.pivot_readings(conn, database_name, table_name, data[:, 0], data[:, 1], channels)
+    return records
+
+
+def configure(enabled=None):
+    global _enabled
+    if enabled is not None:
+        _enabled = bool(enabled)
+
+
+def enabled():
+    return _enabled
+
+
+def store_path(database_name: str, table_name: str):
+    # Next to the database: sensor_database.db -> sensor_database.temps.bin
+    return f"{os.path.splitext(database_name)[0]}.{table_name}.bin"
+
+
+def get_store(database_name: str, table_name: str):
+    key = (database_name, table_name)
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = BinaryStore(store_path(database_name, table_name))
+        return _stores[key]
+
+
+def discard(database_name: str, table_name: str):
+    # For changes to existing rows (deletes, rewrites): delete the file if there is one, the next
+    # read rebuilds it. Never creates one, so this costs nothing while the store is disabled
+    path = store_path(database_name, table_name)
+    with _stores_lock:
+        store = _stores.pop((database_name, table_name), None)
+        if store is not None:
+            with store.lock:
+                store.generation += 1  # a rebuild still running must not swap its file in
+                store.mapped = None
+        if os.path.exists(path):
+            os.remove(path)
+
+
+class BinaryStore:
+    """One table's binary file. Thread-safe; appends happen only in sync()."""
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.mapped = None  # memmap of all records, replaced when the file has grown
+        self.count = 0
+        self.channels = 0
+        self.record = record_type(0)
+        self.sorted = True
+        self.ids_sorted = True
+        self.generation = 0  # bumped whenever the file is started over, see rebuild
+        self.rebuilder = None  # background rebuild thread
+        self.open()
+
+    def open(self):
+        if os.path.exists(self.path):
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+            magic, record_size, sorted_flag, ids_sorted_flag, channels = HEADER.unpack(header) if len(header) == HEADER.size else (None,) * 5
+            if magic == MAGIC and record_size == record_type(channels).itemsize:
+                self.sorted, self.ids_sorted = bool(sorted_flag), bool(ids_sorted_flag)
+                self.channels, self.record = channels, record_type(channels)
+                self.mapped = None
+                # An interrupted append may have left part of a record, it is written again
+                size = os.path.getsize(self.path) - HEADER_SIZE
+                self.count = size // self.record.itemsize
+                if size % self.record.itemsize:
+                    with open(self.path, "r+b") as f:
+                        f.truncate(HEADER_SIZE + self.count * self.record.itemsize)
+                return
+            print(f"{self.path} is not a binary store of this version, rebuilding it")
+        self.create(self.channels)
+
+    def write_header(self, f):
+        f.seek(0)
+        f.write(HEADER.pack(MAGIC, self.record.itemsize, int(self.sorted), int(self.ids_sorted), self.channels).ljust(HEADER_SIZE, b"\0"))
+
+    def create(self, channels: int):
+        self.generation += 1
+        self.mapped = None
+        self.count = 0
+        self.channels, self.record = channels, record_type(channels)
+        self.sorted = True
+        self.ids_sorted = True
+        with open(self.path, "wb") as f:
+            self.write_header(f)
+
+    def records(self):
+        # memmap of every record; views handed out earlier stay valid after the file grows
+        if self.mapped is None or len(self.mapped) != self.count:
+            self.mapped = np.memmap(self.path, dtype=self.record, mode="r", offset=HEADER_SIZE, shape=(self.count,)) if self.count else np.empty(0, self.record)
+        return self.mapped
+
+    def sync(self, database_name: str, table_name: str):
+        """
+        Append the rows SQLite has beyond the last record. Returns False if the file cannot
+        answer time range queries because a row arrived out of time order (see rebuild).
+        """
+        with self.lock:
+            with db_manager.reader(database_name) as conn:
+                channels = readings.channels(conn, table_name)
+                if len(channels) != self.channels:
+                    # A sensor was registered: every record needs its column
+                    self.create(len(channels))
+                records = self.records()
+                last_id = int(records["id"][-1] if self.ids_sorted else records["id"].max()) if self.count else 0
+                last_ts = int(records["ts"][-1]) if self.count else None
+                sorted_before = self.sorted
+                with open(self.path, "ab") as f:
+                    while True:
+                        chunk = load_records(conn, database_name, table_name, "id > ?", (last_id,), "id", channels)
+                        if not len(chunk):
+                            break
+                        ts = chunk["ts"]
+                        if (last_ts is not None and ts[0] < last_ts) or np.any(ts[1:] < ts[:-1]):
+                            self.sorted = False
+                        last_id, last_ts = int(chunk["id"][-1]), int(ts[-1])
+                        f.write(chunk.tobytes())
+                        self.count += len(chunk)
+            if sorted_before and not self.sorted:
+                print(f"Samples of {table_name} arrived out of time order, rebuilding {self.path} in the background")
+                with open(self.path, "r+b") as f:
+                    self.write_header(f)
+            if not self.sorted:
+                self.start_rebuild(database_name, table_name)
+            return self.sorted
+
+    def start_rebuild(self, database_name: str, table_name: str):
+        # Called with the lock held; at most one rebuild runs at a time
+        if self.rebuilder is None or not self.rebuilder.is_alive():
+            self.rebuilder = threading.Thread(target=self.rebuild, args=(database_name, table_name),
+                                              name="binary-store-rebuild", daemon=True)
+            self.rebuilder.start()
+
+    def rebuild(self, database_name: str, table_name: str):
+        """
+        Rewrite the file from SQLite in time order; ids of late rows then no longer increase.
+        The new file is written without holding the lock, so reads and syncs go on meanwhile;
+        rows recorded after it started are appended by the next sync. It is not swapped in if
+        the file was started over in the meantime (rows deleted, see discard).
+        """
+        temporary = self.path + ".tmp"
+        with self.lock:
+            generation = self.generation
+        try:
+            ids_sorted = True
+            last_id = 0
+            with db_manager.reader(database_name) as conn:
+                channels = readings.channels(conn, table_name)
+                newest_id = conn.execute(f"SELECT MAX(id) FROM {table_name}").fetchone()[0] or 0
+            record = record_type(len(channels))
+            with open(temporary, "wb") as f:
+                f.write(HEADER_SIZE * b"\0")
+                after = (None, None)
+                while True:
+                    # (ts, id) after the last record written, among the rows that existed at the start
+                    where, params = ("id <= ?", (newest_id,))
+                    if after[0] is not None:
+                        where, params = where + " AND ts >= ? AND (ts > ? OR id > ?)", params + (after[0], after[0], after[1])
+                    with db_manager.reader(database_name) as conn:
+                        chunk = load_records(conn, database_name, table_name, where, params, "ts, id", channels)
+                    if not len(chunk):
+                        break
+                    ids = chunk["id"]
+                    if ids[0] < last_id or np.any(ids[1:] < ids[:-1]):
+                        ids_sorted = False
+                    last_id = max(last_id, int(ids.max()))
+                    after = (int(chunk["ts"][-1]), int(ids[-1]))
+                    f.write(chunk.tobytes())
+                f.seek(0)
+                f.write(HEADER.pack(MAGIC, record.itemsize, 1, int(ids_sorted), len(channels)))
+        except Exception as e:
+            print(f"Failed to rebuild {self.path}, reads use SQLite: {e}")
+            if os.path.exists(temporary):
+                os.remove(temporary)
+            return
+        with self.lock:
+            if generation != self.generation:
+                os.remove(temporary)
+                return
+            self.mapped = None
+            os.replace(temporary, self.path)
+            self.open()
+
+    def time_range(self, start_ts: int, end_ts: int):
+        # Records with start_ts <= ts <= end_ts, as a view of the file
+        records = self.records()
+        ts = records["ts"]
+        return records[bisect.bisect_left(ts, start_ts):bisect.bisect_right(ts, end_ts)]
+
+    def id_range(self, first_id: int, last_id: int):
+        # Records with first_id <= id <= last_id in id order, a view unless a rebuild reordered ids
+        records = self.records()
+        ids = records["id"]
+        if not self.ids_sorted:
+            selected = records[(ids >= first_id) & (ids <= last_id)]
+            return selected[np.argsort(selected["id"], kind="stable")]
+        return records[bisect.bisect_left(ids, first_id):bisect.bisect_right(ids, last_id)]
+
+
+def benchmark(database_name: str, table_name: str, spans=(3600, 86400, 7 * 86400, 30 * 86400), repeat=3):
+    """
+    Time db_functions.load_columns for ranges of the given lengths (seconds) from the start of
+    the table, through SQLite and through the binary store. Returns {span: (sqlite s, binary s)}.
+    """
+    import db_functions
+
+    was_enabled = _enabled
+    first_ts = db_functions.to_epoch(db_functions.get_date_range(database_name, table_name)[0])
+    get_store(database_name, table_name).sync(database_name, table_name)
+    results = {}
+    try:
+        for span in spans:
+            timings = []
+            for backend in (False, True):
+                configure(backend)
+                best = None
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    columns = db_functions.load_columns(database_name, table_name, first_ts, first_ts + span)
+                    # Touch the data, as plotting would; views are only read when used
+                    float(np.nansum(columns.avg))
+                    elapsed = time.perf_counter() - started
+                    best = elapsed if best is None else min(best, elapsed)
+                timings.append(best)
+            results[span] = (len(columns.id), timings[0], timings[1])
+    finally:
+        configure(was_enabled)
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the binary store of a table and compare range reads with SQLite")
+    parser.add_argument("db_path")
+    parser.add_argument("--table", default="temps")
+    parser.add_argument("--rebuild", action="store_true", help="rewrite the file in time order")
+    args = parser.parse_args()
+
+    import db_functions
+    # Run as a script this file is __main__, go through the module db_functions reads from
+    module = db_functions.binary_store
+    try:
+        store = module.get_store(args.db_path, args.table)
+        if args.rebuild:
+            store.rebuild(args.db_path, args.table)
+        started = time.perf_counter()
+        store.sync(args.db_path, args.table)
+        print(f"{store.path}: {store.count} records, synced in {time.perf_counter() - started:.1f} s")
+        for span, (rows, sqlite_seconds, binary_seconds) in module.benchmark(args.db_path, args.table).items():
+            print(f"{span / 3600:7.0f} h, {rows:8d} rows: SQLite {sqlite_seconds * 1000:8.1f} ms, "
+                  f"binary store {binary_seconds * 1000:7.1f} ms ({sqlite_seconds / max(binary_seconds, 1e-9):.0f}x)")
+    finally:
+        db_functions.close_connections()
+
+
+if __name__ == "__main__":
+    main()
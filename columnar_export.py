@@ -0,0 +1,153 @@
+import argparse
+import os
+import tempfile
+import time
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+import db_functions
+
+# Parquet / Feather export of recorded samples, for loading into pandas without parsing text.
+#
+# Files hold typed columns: id int64, time timestamp[s, UTC] (CSV files show local time
+# instead), one float32 column per sensor channel (T1, T2, ...) and comment string. Rows are
+# read and written in chunks, each chunk becoming one Parquet row group / Feather record
+# batch, so memory use does not grow with the table.
+
+COLUMNAR_CHUNK_ROWS = 100000
+
+
+def schema(channels):
+    # File schema for the given channel names
+    return pa.schema([("id", pa.int64()), ("time", pa.timestamp("s", tz="UTC"))]
+                     + [(name, pa.float32()) for name in channels] + [("comment", pa.string())])
+
+
+COLUMNAR_EXTENSIONS = {".parquet": "parquet", ".pq": "parquet", ".feather": "feather", ".arrow": "feather"}
+COLUMNAR_FILETYPES = [("Parquet files", "*.parquet"), ("Feather files", "*.feather")]
+
+
+def columnar_format(output_name: str):
+    # "parquet", "feather" or None for any other file name
+    return COLUMNAR_EXTENSIONS.get(os.path.splitext(output_name)[1].lower())
+
+
+def chunk_to_table(columns, file_schema):
+    # TemperatureColumns (see db_functions.export_batches) -> Arrow table; missing readings become null
+    arrays = [pa.array(columns.id), pa.array(columns.ts, type=pa.timestamp("s", tz="UTC"))]
+    arrays += [pa.array(columns.temps[:, column].astype(np.float32), mask=np.isnan(columns.temps[:, column]))
+               for column in range(columns.temps.shape[1])]
+    arrays.append(pa.array([columns.comments.get(row) for row in range(len(columns.id))], type=pa.string()))
+    return pa.Table.from_arrays(arrays, schema=file_schema)
+
+
+def export_columnar(database_name: str, table_name: str, output_name: str, start_date=None, end_date=None,
+                    id_range=None, progress=None, chunk_rows=COLUMNAR_CHUNK_ROWS, cancel_event=None):
+    """
+    Write the whole table, the rows between start_date and end_date, or the (first id, last id)
+    id_range to a Parquet or Feather file chosen by the extension of output_name.
+    progress(rows, total, rows_per_second) is called after every chunk, cancel_event is checked
+    before each one (db_functions.ExportCancelled is raised). Returns (rows, seconds).
+    """
+    file_format = columnar_format(output_name)
+    if file_format is None:
+        raise ValueError(f"Unknown columnar file type: {output_name}")
+    progress = progress or db_functions.print_progress
+
+    channels = db_functions.export_channels(database_name, table_name)
+    file_schema = schema(channels)
+    total, batches = db_functions.export_batches(database_name, table_name, start_date, end_date, id_range, chunk_rows, channels)
+
+    started = time.perf_counter()
+    rows = 0
+    if file_format == "parquet":
+        writer = pq.ParquetWriter(output_name, file_schema, compression="zstd")
+    else:
+        writer = pa.ipc.new_file(output_name, file_schema, options=pa.ipc.IpcWriteOptions(compression="zstd"))
+    try:
+        for columns in batches:
+            if cancel_event is not None and cancel_event.is_set():
+                raise db_functions.ExportCancelled(output_name)
+            table = chunk_to_table(columns, file_schema)
+            if file_format == "parquet":
+                writer.write_table(table)
+            else:
+                for record_batch in table.to_batches():
+                    writer.write_batch(record_batch)
+            rows += len(columns.id)
+            progress(rows, total, rows / (time.perf_counter() - started))
+    finally:
+        writer.close()
+
+    if rows == 0:
+        # Still a valid file with the right columns
+        progress(rows, total, 0.0)
+    return rows, time.perf_counter() - started
+
+
+def load_columnar(path: str):
+    # Import counterpart of export_columnar: a DataFrame with datetime64 time and float32 temperatures
+    if columnar_format(path) == "parquet":
+        return pd.read_parquet(path)
+    if columnar_format(path) == "feather":
+        return pd.read_feather(path)
+    raise ValueError(f"Unknown columnar file type: {path}")
+
+
+def load_csv(path: str):
+    # How exported CSV files have to be loaded to get the same typed columns
+    # Every column but id, data and comment is a channel
+    header = pd.read_csv(path, nrows=0).columns
+    return pd.read_csv(path, parse_dates=["data"], dtype={name: np.float32 for name in header if name not in ("id", "data", "comment")})
+
+
+def compare_formats(database_name: str, table_name: str, start_date=None, end_date=None):
+    """
+    Export the same rows as CSV, gzipped CSV, Parquet and Feather into a scratch directory.
+    Returns {format: {"bytes", "export_seconds", "load_seconds"}}.
+    """
+    quiet = lambda *args: None
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name in ("data.csv", "data.csv.gz", "data.parquet", "data.feather"):
+            path = os.path.join(tmp_dir, name)
+            if columnar_format(path):
+                _, export_seconds = export_columnar(database_name, table_name, path, start_date, end_date, progress=quiet)
+                loader = load_columnar
+            else:
+                if start_date is not None and end_date is not None:
+                    _, export_seconds = db_functions.export_range_csv(database_name, table_name, start_date, end_date, path, quiet)
+                else:
+                    _, export_seconds = db_functions.export_table_csv(database_name, table_name, path, quiet)
+                loader = load_csv
+            started = time.perf_counter()
+            loader(path)
+            results[name.split(".", 1)[1]] = {"bytes": os.path.getsize(path), "export_seconds": export_seconds,
+                                              "load_seconds": time.perf_counter() - started}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export to Parquet/Feather, or compare file formats")
+    parser.add_argument("db_path")
+    parser.add_argument("--table", default="temps")
+    parser.add_argument("--output", help="*.parquet or *.feather file to write, omit to compare formats")
+    parser.add_argument("--start", help="YYYY-MM-DD HH:MM:SS")
+    parser.add_argument("--end", help="YYYY-MM-DD HH:MM:SS")
+    args = parser.parse_args()
+
+    try:
+        if args.output:
+            rows, seconds = export_columnar(args.db_path, args.table, args.output, args.start, args.end)
+            print(f"Wrote {rows} rows to {args.output} in {seconds:.1f} s")
+        else:
+            for name, result in compare_formats(args.db_path, args.table, args.start, args.end).items():
+                print(f"{name:>8}: {result['bytes'] / 1e6:8.1f} MB, export {result['export_seconds']:6.2f} s, "
+                      f"load into pandas {result['load_seconds']:6.2f} s")
+    finally:
+        db_functions.close_connections()
+
+
+if __name__ == "__main__":
+    main()
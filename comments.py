@@ -0,0 +1,93 @@
+# Comments, kept in their own small table next to the samples table.
+#
+# Almost no sample has a comment, so a text column on every row only made the hot table wider
+# and every edit rewrite one of its pages. A comment row either belongs to one sample
+# (sample_id, start_ts = end_ts = its timestamp) or annotates a time span (sample_id NULL).
+# A full-text index over the text lets the Filter window search comments; it is an FTS5
+# external content table kept in sync by triggers, skipped if SQLite was built without FTS5.
+
+MAX_COMMENT_LENGTH = 250
+
+
+def comment_table(table_name: str):
+    return f"{table_name}_comments"
+
+
+def search_table(table_name: str):
+    return f"{table_name}_comments_fts"
+
+
+def create_comment_tables(conn, table_name: str):
+    comments = comment_table(table_name)
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {comments} (
+        comment_id INTEGER PRIMARY KEY,
+        sample_id INTEGER,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        text TEXT NOT NULL
+    )""")
+    # One comment per sample (NULLs, i.e. spans, do not collide), and span lookups by time
+    conn.execute(f"CREATE UNIQUE INDEX IF NOT EXISTS idx_{comments}_sample ON {comments} (sample_id)")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{comments}_start ON {comments} (start_ts)")
+
+    fts = search_table(table_name)
+    try:
+        conn.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(text, content='{comments}', content_rowid='comment_id')")
+    except Exception as e:
+        print(f"Comment search index not available ({e}), searching comments without it")
+        return
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {comments}_ai AFTER INSERT ON {comments} BEGIN
+        INSERT INTO {fts} (rowid, text) VALUES (new.comment_id, new.text);
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {comments}_ad AFTER DELETE ON {comments} BEGIN
+        INSERT INTO {fts} ({fts}, rowid, text) VALUES ('delete', old.comment_id, old.text);
+    END""")
+    conn.execute(f"""
+    CREATE TRIGGER IF NOT EXISTS {comments}_au AFTER UPDATE OF text ON {comments} BEGIN
+        INSERT INTO {fts} ({fts}, rowid, text) VALUES ('delete', old.comment_id, old.text);
+        INSERT INTO {fts} (rowid, text) VALUES (new.comment_id, new.text);
+    END""")
+
+
+def has_search_index(conn, table_name: str):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (search_table(table_name),)).fetchone() is not None
+
+
+def set_sample_comment(conn, table_name: str, sample_id: int, ts: int, text: str):
+    # Empty text removes the comment
+    if text:
+        conn.execute(f"""
+        INSERT INTO {comment_table(table_name)} (sample_id, start_ts, end_ts, text) VALUES (?, ?, ?, ?)
+        ON CONFLICT(sample_id) DO UPDATE SET text = excluded.text
+        """, (sample_id, ts, ts, text))
+    else:
+        conn.execute(f"DELETE FROM {comment_table(table_name)} WHERE sample_id = ?", (sample_id,))
+
+
+def match_expression(text: str):
+    """
+    FTS5 query for free text typed by the user: every word must occur, as a prefix, so
+    'heat flu' finds 'heater fluctuating'. Words are quoted, so no character is a syntax error.
+    """
+    words = text.split()
+    return " ".join('"' + word.replace('"', '""') + '"*' for word in words)
+
+
+def search_query(conn, table_name: str, text: str, limit: int):
+    # (query, params) returning (sample_id, start_ts, end_ts, text), best matches first
+    comments = comment_table(table_name)
+    if has_search_index(conn, table_name):
+        fts = search_table(table_name)
+        return (f"""
+        SELECT c.sample_id, c.start_ts, c.end_ts, c.text
+        FROM {fts} JOIN {comments} c ON c.comment_id = {fts}.rowid
+        WHERE {fts} MATCH ?
+        ORDER BY {fts}.rank
+        LIMIT ?
+        """, (match_expression(text), limit))
+    # Without FTS5: substring search over the (small) comments table
+    return (f"SELECT sample_id, start_ts, end_ts, text FROM {comments} WHERE text LIKE ? ORDER BY start_ts DESC LIMIT ?",
+            (f"%{text}%", limit))
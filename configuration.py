@@ -5,7 +5,7 @@ from tkinter import ttk
 from tkinter import messagebox
 from tkinter import filedialog
 import db_functions
-import sqlite3
+import db_manager
 
 class Config:
     def __init__(self, master):
@@ -18,9 +18,42 @@ class Config:
             "temperature_range": [0, 50],
             "table_name": "temps",
             "update_interval": 1000,  # in milliseconds
+            "render_interval": 250,  # in milliseconds, how often the UI drains new samples
+            "overrun_policy": "skip",  # "skip" or "catch_up" missed sampling deadlines
             "graph_points": 60,
-            "debug_mode": True # !!! IMPORTANT: Debug mode should be False in a production environment!
+            "debug_mode": True, # !!! IMPORTANT: Debug mode should be False in a production environment!
+            "simulator_sensors": 0,  # debug mode only: >0 reads a simulated 1-Wire bus with this many sensors instead of random values
+            "max_read_workers": 32,  # cap on sensors read concurrently per acquisition cycle, 0 = no cap (one thread per sensor)
+            "acquisition_mode": "parallel",  # "parallel" or "bulk" (therm_bulk_read, falls back to parallel)
+            "sensor_map_path": "sensor_channels.json",  # persistent sensor ROM ID -> channel mapping
+            "sensor_rescan_interval": 60,  # seconds between hot-plug rescans of the 1-Wire bus
+            "read_timeout": 1500,  # in milliseconds, upper bound for one sensor read
+            "read_retries": 3,  # CRC failures tolerated per read before giving up
+            "read_fallback": "last_good",  # on timeout: "last_good" (flagged stale value) or "null"
+            "batch_size": 30,  # samples written per database transaction
+            "flush_interval": 10,  # seconds, longest a recorded sample waits before it is written
+            "spool_dir": "spool",  # append-only files recorded samples go through on their way into the database
+            "spool_fsync": "batch",  # "sample", "batch" or "off": sync the spool to storage after every sample, once per batch or never
+            "db_synchronous": "NORMAL",  # SQLite synchronous level: OFF, NORMAL or FULL
+            "db_cache_size_kb": 8192,  # page cache per connection
+            "db_mmap_size_mb": 64,  # part of the database read through mmap, 0 disables it
+            "db_wal_autocheckpoint": 1000,  # WAL pages before an automatic checkpoint
+            "plot_max_points": 5000,  # longer plot ranges are drawn from minute/hour/day rollups
+            "query_cache_mb": 64,  # memory for cached plot query results, 0 disables the cache
+            "binary_store": False,  # also keep the samples in a memory-mapped file next to the database for faster range reads
+            "shard_period": "off",  # "week", "month" or "year": move each ended period to its own read-only database file
+            "retention_raw_days": 0,  # delete raw samples older than this many days (plots use the rollups), 0 keeps them
+            "retention_rollup_months": 0  # delete minute/hour rollups older than this many months, day rollups are kept; 0 keeps them
         }
+        # Keys shown only under "Show Advanced Settings"
+        self.advanced_keys = [
+            "table_name", "update_interval", "render_interval", "overrun_policy", "graph_points", "debug_mode",
+            "simulator_sensors", "max_read_workers", "acquisition_mode", "sensor_map_path", "sensor_rescan_interval",
+            "read_timeout", "read_retries", "read_fallback", "batch_size", "flush_interval", "spool_dir", "spool_fsync",
+            "db_synchronous", "db_cache_size_kb", "db_mmap_size_mb", "db_wal_autocheckpoint", "plot_max_points",
+            "query_cache_mb", "binary_store", "shard_period",
+            "retention_raw_days", "retention_rollup_months"
+        ]
         self.default_config = self.original_default_config.copy()
         self.load_config()
         self.ensure_database_setup()
@@ -45,16 +78,16 @@ class Config:
                 messagebox.showwarning("Warning", "The application may not function correctly without a valid database.")
         else:
             # Check if the table exists
-            conn = sqlite3.connect(db_path)
-            cursor = conn.cursor()
-            cursor.execute(f"SELECT name FROM sqlite_master WHERE type='table' AND name='{table_name}'")
-            if not cursor.fetchone():
+            if not db_functions.table_exists(db_path, table_name):
                 if messagebox.askyesno("Table Not Found", f"The table '{table_name}' does not exist in the database. Would you like to create it?"):
                     db_functions.create_db(db_path, table_name)
                     messagebox.showinfo("Success", f"Table '{table_name}' created in the database.")
                 else:
                     messagebox.showwarning("Warning", "The application may not function correctly without the required table.")
-            conn.close()
+
+        # WAL mode and connection pragmas, so analysis and exports never block the recorder
+        if os.path.exists(db_path):
+            db_functions.configure_database(db_path, self)
 
     def save_config(self):
         with open(self.config_file, 'w') as f:
@@ -127,6 +160,7 @@ class Config:
                             try:
                                 if os.path.exists(new_db_path):
                                     if messagebox.askyesno("Confirm Overwrite", f"The file {new_db_path} already exists. Do you want to overwrite it?"):
+                                        db_manager.close(new_db_path)  # drop pooled connections to the old file
                                         os.remove(new_db_path)
                                     else:
                                         return
@@ -180,7 +214,7 @@ class Config:
         advanced_row = 0
     
         for key, value in self.default_config.items():
-            if key in ["table_name", "update_interval", "graph_points", "debug_mode"]:
+            if key in self.advanced_keys:
                 advanced_row = create_config_entry(advanced_frame, key, value, advanced_row)
             else:
                 regular_row = create_config_entry(regular_frame, key, value, regular_row)
@@ -213,6 +247,8 @@ class Config:
                     value = entry.get()
                 self.default_config[key] = value  # Update the current config
             self.save_config()  # Save to file
+            if os.path.exists(self.get("db_path")):
+                db_functions.configure_database(self.get("db_path"), self)  # only if a storage setting changed
             root.destroy()
     
         def reset_to_default():
@@ -1,227 +1,993 @@
-import sqlite3
 import csv
+import datetime
+import gzip
 import os
+import sqlite3
+import time
+import uuid
+from collections import namedtuple
 from tkinter import filedialog
-import tkinter as tk
-from configuration import Config
+import numpy as np
+import binary_store
+import comments
+import db_manager
+import query_cache
+import readings
+import rollups
+import shards
+
+# Text form of a timestamp, as shown in the UI and written to CSV files
+TIME_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+# Per (database, table) layout details, see table_layout()
+_layouts = {}
+
+# Config keys applied by configure_database(), and the values last applied per database
+STORAGE_SETTINGS = ("db_synchronous", "db_cache_size_kb", "db_mmap_size_mb", "db_wal_autocheckpoint",
+                    "query_cache_mb", "binary_store")
+_storage_settings = {}
 
-def export_to_csv(database_name:str, table_name:str, default_path:str = None):
-    # Get the default path from config if not provided
-    if default_path is None:
-        config = Config()
-        default_path = config.get("export_filepath", "")
+# Result of the column based range queries (fetch_columns and friends), see there
+TemperatureColumns = namedtuple("TemperatureColumns", ["id", "ts", "time", "names", "temps", "avg", "comments"])
+
+# One sensor's readings from the narrow store: time datetime64[s] (local time) and value float32 arrays
+SensorSeries = namedtuple("SensorSeries", ["time", "values"])
+
+# Streaming CSV export: rows pulled from SQLite per fetchmany() call, and the file write buffer
+EXPORT_BATCH_SIZE = 5000
+EXPORT_BUFFER_SIZE = 1024 * 1024
+# gzip level for *.csv.gz exports, 6 is nearly as small as 9 at a fraction of the CPU time
+EXPORT_COMPRESSLEVEL = 6
+EXPORT_FILETYPES = [("CSV files", "*.csv"), ("Gzipped CSV files", "*.csv.gz"), ("Parquet files", "*.parquet"),
+                    ("Feather files", "*.feather"), ("All files", "*.*")]
+
+def to_epoch(value):
+    """
+    Convert a timestamp to the integer stored in the ts column: UTC seconds since 1970-01-01.
+    Accepts 'YYYY-MM-DD HH:MM:SS' strings and naive datetime objects, both in local wall-clock
+    time like everything the UI shows, aware datetime objects and numbers (already epoch seconds).
+    """
+    if isinstance(value, str):
+        value = datetime.datetime.strptime(value.split('.')[0], TIME_FORMAT)
+    if isinstance(value, datetime.datetime):
+        return int(value.timestamp())
+    return int(value)
 
-    # Create a root window and hide it
-    root = tk.Tk()
-    root.withdraw()
+def epoch_to_text(value):
+    # Local wall-clock text of an epoch second, for display
+    return time.strftime(TIME_FORMAT, time.localtime(value))
 
-    # Open file dialog to choose save path and filename
+def local_datetime64(ts):
+    """
+    Local wall-clock datetime64[s] array of UTC epoch seconds, for plots and tables. The UTC
+    offset is looked up once per hour the values fall into, so DST changes are honoured.
+    """
+    ts = np.asarray(ts, dtype=np.int64)
+    hours, index = np.unique(ts // 3600, return_inverse=True)
+    offsets = np.array([time.localtime(int(hour) * 3600).tm_gmtoff for hour in hours], dtype=np.int64)
+    return (ts + offsets[index].reshape(ts.shape)).astype("datetime64[s]")
+
+class ExportCancelled(Exception):
+    """Raised inside an export when its cancel_event is set."""
+
+def ask_export_path(parent=None, default_path: str = None, initialfile: str = None):
+    # Save dialog for exports, returns None if cancelled. Uses the caller's window instead of a new Tk root
     output_name = filedialog.asksaveasfilename(
+        parent=parent,
+        initialfile=initialfile,
         defaultextension=".csv",
-        filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
+        filetypes=EXPORT_FILETYPES,
         title="Save CSV file as",
-        initialdir=default_path
+        initialdir=default_path or ""
     )
+    if not output_name:
+        print("Export cancelled.")
+        return None
+    return output_name
+
+def export_file_name(start_date, end_date):
+    # Suggested file name for a time range export
+    return f"1wire_{start_date.strftime('%Y%m%d_%H%M%S')}_{end_date.strftime('%Y%m%d_%H%M%S')}.csv"
+
+def export_to_csv(database_name:str, table_name:str, default_path:str = None, parent=None):
+    # Blocking export of the whole table, see export_jobs for the background version used by the UI
+    output_name = ask_export_path(parent, default_path)
 
     # If user cancels the file dialog, exit the function
     if not output_name:
-        print("Export cancelled.")
         return
 
-    # Connect to the database
-    conn = sqlite3.connect(database_name)
-    cursor = conn.cursor()
+    export_file(database_name, table_name, output_name)
+    print(f"Export complete! File saved as: {output_name}")
+
+def export_file(database_name: str, table_name: str, output_name: str, start_date=None, end_date=None, progress=None,
+                cancel_event=None):
+    """
+    Export the whole table, or the rows between start_date and end_date, in the format given by
+    the file name: *.parquet / *.feather through columnar_export, CSV (optionally *.gz) otherwise.
+    Raises ExportCancelled if cancel_event gets set while the export runs.
+    """
+    if os.path.splitext(output_name)[1].lower() in (".parquet", ".pq", ".feather", ".arrow"):
+        # pandas/pyarrow are only loaded when somebody actually asks for a columnar file
+        import columnar_export
+        return columnar_export.export_columnar(database_name, table_name, output_name, start_date, end_date,
+                                               progress=progress, cancel_event=cancel_event)
+    if start_date is not None and end_date is not None:
+        return export_range_csv(database_name, table_name, start_date, end_date, output_name, progress, cancel_event)
+    return export_table_csv(database_name, table_name, output_name, progress, cancel_event)
+
+def export_table_csv(database_name: str, table_name: str, output_name: str, progress=None, cancel_event=None):
+    # Whole table in primary key order, streamed (see write_csv)
+    channels = export_channels(database_name, table_name)
+    total, batches = export_batches(database_name, table_name, names=channels)
+    return write_csv(csv_rows(batches, with_id=True), ["id", "data"] + channels + ["comment"], output_name,
+                     total, progress, cancel_event=cancel_event)
+
+def export_range_csv(database_name: str, table_name: str, start_date, end_date, output_name: str, progress=None,
+                     cancel_event=None):
+    # Rows between two timestamps in time order, streamed (see write_csv)
+    channels = export_channels(database_name, table_name)
+    total, batches = export_batches(database_name, table_name, start_date, end_date, names=channels)
+    return write_csv(csv_rows(batches, with_id=False), ["data"] + channels + ["comment"], output_name,
+                     total, progress, cancel_event=cancel_event)
+
+def export_channels(database_name: str, table_name: str):
+    # Channel names every export has a column for: all registered sensors, or T1-T3 of an old
+    # table whose readings are not copied yet (see load_sample_columns)
+    if not table_layout(database_name, table_name)["readings_built"]:
+        return list(readings.LEGACY_CHANNELS)
+    with db_manager.reader(database_name) as conn:
+        return [name for _, name in readings.channels(conn, table_name)]
+
+def export_batches(database_name: str, table_name: str, start_date=None, end_date=None, id_range=None,
+                   batch_size: int = EXPORT_BATCH_SIZE, names=None):
+    """
+    (total, batches) for an export: the number of samples and an iterator of TemperatureColumns
+    (float64 values, the channels names, by default export_channels) over the whole table in id order, the
+    (first id, last id) id_range in id order, or the samples between start_date and end_date in
+    time order. Each batch is its own short query (keyset pagination), so no cursor stays open
+    between batches and an export that stops asking simply ends.
+    """
+    names = names if names is not None else export_channels(database_name, table_name)
+    _, where_column, to_bound = time_columns(database_name, table_name)
+    by_time = id_range is None and start_date is not None and end_date is not None
+    if by_time:
+        end_ts = to_epoch(end_date)
+        where, params, route = f"{where_column} BETWEEN ? AND ?", (to_bound(start_date), to_bound(end_date)), \
+            {"start_ts": to_epoch(start_date), "end_ts": end_ts}
+    else:
+        first_id, last_id = id_range if id_range is not None else (0, 2 ** 63 - 1)
+        where, params = "id BETWEEN ? AND ?", (first_id, last_id)
+        route = {"first_id": first_id, "last_id": last_id} if id_range is not None else {}
+    with db_manager.reader(database_name) as conn:
+        total = sum(row[0] for row in shards.execute(conn, database_name, table_name, lambda source:
+                                                     f"SELECT COUNT(*) FROM {source} WHERE {where}", params, **route).fetchall())
+
+    def batches():
+        after_ts = to_epoch(start_date) if by_time else None
+        after_id = -1 if by_time else first_id - 1
+        while True:
+            if by_time:
+                # (time, id) after the last row: same second with a higher id, or a later second
+                columns = load_sample_columns(database_name, table_name, f"{where_column} BETWEEN ? AND ? AND ({where_column} > ? OR id > ?)",
+                                              (to_bound(after_ts), params[1], to_bound(after_ts), after_id), f"{where_column}, id",
+                                              {"start_ts": after_ts, "end_ts": end_ts}, names, batch_size, np.float64)
+            else:
+                columns = load_sample_columns(database_name, table_name, "id > ? AND id <= ?", (after_id, last_id), "id",
+                                              {"first_id": after_id + 1, "last_id": last_id}, names, batch_size, np.float64)
+            if not len(columns.id):
+                return
+            yield columns
+            if len(columns.id) < batch_size:
+                return
+            after_ts, after_id = int(columns.ts[-1]), int(columns.id[-1])
+
+    return total, batches()
 
-    # Query to fetch all data from the table
-    query = f"SELECT * FROM {table_name}"
-    cursor.execute(query)
+def csv_rows(batches, with_id: bool):
+    # Lists of CSV rows from export_batches: (id,) local time text, one value per channel (empty
+    # if missing) and the comment
+    for columns in batches:
+        text = np.char.replace(np.datetime_as_string(columns.time, unit="s"), "T", " ").tolist()
+        values = np.where(np.isnan(columns.temps), None, columns.temps).tolist()
+        ids = columns.id.tolist()
+        yield [([ids[row]] if with_id else []) + [text[row]] + values[row] + [columns.comments.get(row)]
+               for row in range(len(ids))]
 
-    # Fetch column names
-    column_names = [description[0] for description in cursor.description]
+def open_export_file(output_name: str):
+    # *.gz names are written gzip-compressed
+    if output_name.endswith(".gz"):
+        return gzip.open(output_name, "wt", newline="", encoding="utf-8", compresslevel=EXPORT_COMPRESSLEVEL)
+    return open(output_name, "w", newline="", encoding="utf-8", buffering=EXPORT_BUFFER_SIZE)
 
-    # Open a CSV file to write data
-    with open(output_name, "w", newline="", encoding="utf-8") as csv_file:
+def print_progress(rows: int, total: int, rows_per_second: float):
+    percent = f" ({rows * 100 / total:.0f}%)" if total else ""
+    print(f"Exported {rows}/{total} rows{percent}, {rows_per_second:.0f} rows/s")
+
+def write_csv(batches, column_names, output_name: str, total: int = None, progress=None, cancel_event=None):
+    """
+    Write batches of rows (lists of row sequences, see csv_rows) to a CSV file under a header of
+    column_names, one batch at a time, so memory use stays the same however many rows there
+    are. progress(rows, total, rows_per_second) is called at most once a second and after the
+    last row (default: print_progress). cancel_event is checked between batches. Returns
+    (rows written, seconds taken).
+    """
+    progress = progress or print_progress
+    started = time.perf_counter()
+    last_report = started
+    rows = 0
+    with open_export_file(output_name) as csv_file:
         csv_writer = csv.writer(csv_file)
 
-        # Write the column names as the first row
+        # Write the column names as the header
         csv_writer.writerow(column_names)
 
-        # Write all rows from the database table
-        csv_writer.writerows(cursor.fetchall())
+        for batch in batches:
+            if cancel_event is not None and cancel_event.is_set():
+                raise ExportCancelled(output_name)
+            csv_writer.writerows(batch)
+            rows += len(batch)
 
-    # Close the database connection
-    conn.close()
+            now = time.perf_counter()
+            if now - last_report >= 1.0:
+                progress(rows, total, rows / (now - started))
+                last_report = now
+    elapsed = time.perf_counter() - started
+    progress(rows, total, rows / elapsed if elapsed > 0 else 0.0)
+    return rows, elapsed
 
-    print(f"Export complete! File saved as: {output_name}")
 
+def wide_columns_written(database_name: str, table_name: str):
+    # Tables from before the readings table get T1-T3 too, until backfill_readings has copied them
+    layout = table_layout(database_name, table_name)
+    return layout["wide_columns"] and not layout["readings_built"]
 
-def insert_data_to_db(database_name:str, table_name:str, date: str, t1: float, t2: float, t3: float):
-    # Connect to the database and insert data (avoids accidental UI variable polluting the DB)
-    conn = sqlite3.connect(database_name)
-    query = f"""
-    INSERT INTO {table_name} (data, t1, t2, t3)
-    VALUES (?, ?, ?, ?)
-    """
-    cursor = conn.cursor()
-    cursor.execute(query, (date, t1, t2, t3))
-    conn.commit()
-    conn.close()
-    print(f"Data inserted into the database: {date, t1, t2, t3}")
-    
-def fetch_last_n_records(database, table_name, n):
-    # Fetch the last n records from the database table order by id.
-    conn = sqlite3.connect(database)
-    cursor = conn.cursor()
-    
-    # Query to get the first and last dates of the last n records
-    query = f"""
-    SELECT MIN(data), MAX(data)
-    FROM (
-        SELECT data
-        FROM {table_name}
-        ORDER BY id DESC
-        LIMIT {n}
-    )
+def insert_query(database_name: str, table_name: str):
+    # Tables created before epoch timestamps still have a local time text column to fill in
+    columns, values = ["ts"], ["?1"]
+    if table_layout(database_name, table_name)["text_time"]:
+        columns, values = columns + ["data"], values + ["datetime(?1, 'unixepoch', 'localtime')"]
+    if wide_columns_written(database_name, table_name):
+        columns, values = columns + list(readings.LEGACY_CHANNELS), values + ["?2", "?3", "?4"]
+    return f"INSERT INTO {table_name} ({', '.join(columns)}) VALUES ({', '.join(values)})"
+
+def insert_data_to_db(database_name:str, table_name:str, date, t1: float, t2: float, t3: float, *more_temps, verbose: bool = True):
+    # Insert through the shared writer connection (avoids accidental UI variable polluting the DB)
+    # date can be an epoch value (see to_epoch), a datetime or a 'YYYY-MM-DD HH:MM:SS' string.
+    # more_temps are the channels after T3
+    insert_many_to_db(database_name, table_name, [(date, t1, t2, t3) + more_temps])
+    if verbose:
+        print(f"Data inserted into the database: {(date, t1, t2, t3) + more_temps}")
+
+def insert_many_to_db(database_name:str, table_name:str, rows: list, meta: dict = None):
     """
+    Insert (date, t1, t2, t3[, t4, ...]) rows with a single transaction, i.e. one commit for the
+    whole batch: a sample row with the time, and one reading per channel in the readings table.
+    meta is {name: value} for schema_meta, committed atomically with the rows (see spool).
+    """
+    rows = [(to_epoch(row[0]),) + tuple(row[1:]) for row in rows]
+    if not rows:
+        return
+    width = 4 if wide_columns_written(database_name, table_name) else 1
+    sample_rows = [(row + (None, None, None))[:width] for row in rows]
+    query = insert_query(database_name, table_name)
+    layout = table_layout(database_name, table_name)
+    with db_manager.writer(database_name) as conn:
+        # The readings are keyed on the sample ids. Nothing else writes while the writer lock is held,
+        # so the rows of one executemany() get consecutive ids ending at last_insert_rowid()
+        conn.executemany(query, sample_rows)
+        last_id = conn.execute("SELECT last_insert_rowid()").fetchone()[0]
+        sample_ids = range(last_id - len(sample_rows) + 1, last_id + 1)
+        readings.insert_readings(conn, table_name, [(sample_id, row[0], row[1:]) for sample_id, row in zip(sample_ids, rows)])
+        # Minute/hour/day aggregates of the buckets this batch touched, in the same transaction.
+        # Samples older than the retention horizons leave the kept summaries alone
+        rollups.refresh_rollups(conn, table_name, min(row[0] for row in rows), max(row[0] for row in rows),
+                                raw_from=layout["raw_from"], rollups_from=layout["rollups_from"])
+        for name, value in (meta or {}).items():
+            conn.execute("INSERT OR REPLACE INTO schema_meta (name, value) VALUES (?, ?)", (name, str(value)))
+    live_start = shards.live_start(database_name, table_name)
+    late = [row[0] for row in rows if live_start is not None and row[0] < live_start]
+    if late:
+        refresh_shard_rollups(database_name, table_name, min(late), max(late))
+
+def refresh_shard_rollups(database_name: str, table_name: str, first_ts: int, last_ts: int):
+    # Samples that arrive after their period was moved to a shard stay in the live database,
+    # but their rollup buckets also cover the shard's rows
+    layout = table_layout(database_name, table_name)
+    with db_manager.writer(database_name) as conn:
+        try:
+            aliases = shards.attach(conn, shards.overlapping(database_name, table_name, first_ts, last_ts)[:shards.MAX_ATTACHED])
+            rollups.refresh_rollups(conn, table_name, first_ts, last_ts,
+                                    shards.source(readings.readings_table(table_name), aliases, shards.READING_COLUMNS),
+                                    layout["raw_from"], layout["rollups_from"])
+            conn.commit()
+        finally:
+            if conn.in_transaction:
+                conn.rollback()
+            shards.detach_all(conn)
     
-    cursor.execute(query)
-    first_date, last_date = cursor.fetchone()
-    
-    conn.close()
+def fetch_last_n_id_range(database, table_name, n):
+    # First and last id of the last n records, walking the rowid b-trees from the end
+    query = lambda source: f"SELECT id FROM {source} WHERE id >= ? ORDER BY id DESC LIMIT ?"
+    with db_manager.reader(database) as conn:
+        ids = [row[0] for row in conn.execute(query(table_name), (0, n))]
+        # Shards whose newest rows are newer than the oldest of these, newest first, until they
+        # and the live rows hold n rows: their smallest id bounds the last n records
+        first_id = ids[-1] if ids else None
+        found = len(ids)
+        newest = sorted((shard for shard in shards.list_shards(database, table_name) if shard.last_id is not None),
+                        key=lambda shard: shard.last_id, reverse=True)
+        for shard in newest:
+            if found >= n and (first_id is None or shard.last_id < first_id):
+                break
+            first_id = shard.first_id if first_id is None else min(first_id, shard.first_id)
+            found += shard.rows
+        if first_id is None:
+            return None, None
+        if len(ids) < n or any(shard.last_id >= ids[-1] for shard in newest):
+            # A routed query returns the top ids of each group of shards, the last n are among them
+            ids = sorted((row[0] for row in shards.execute(conn, database, table_name, query, (first_id, n),
+                                                           first_id=first_id).fetchall()), reverse=True)[:n]
+    return (ids[-1], ids[0]) if ids else (None, None)
+
+def fetch_last_n_records(database, table_name, n, id_range=None):
+    # Fetch the first and last dates of the last n records of the table, ordered by id.
+    # id_range is the result of fetch_last_n_id_range when the caller already has it
+    first_id, last_id = id_range if id_range is not None else fetch_last_n_id_range(database, table_name, n)
+    if first_id is None:
+        return None, None
+
+    # Two primary key lookups instead of sorting the dates of all n rows
+    time_text = time_text_column(database, table_name)
+    query = lambda source: f"SELECT {time_text} FROM {source} WHERE id = ?"
+    with db_manager.reader(database) as conn:
+        first_date = shards.execute(conn, database, table_name, query, (first_id,), first_id=first_id, last_id=first_id).fetchall()[0][0]
+        last_date = shards.execute(conn, database, table_name, query, (last_id,), first_id=last_id, last_id=last_id).fetchall()[0][0]
     
     return first_date, last_date
     
-def records_by_time_csv(database_name, table_name, start_date, end_date, default_path: str = None):
+def records_by_time_csv(database_name, table_name, start_date, end_date, default_path: str = None, parent=None):
+    # Blocking export of a time range, see export_jobs for the background version used by the UI
     try:
-        # Get the default path from config if not provided
-        if default_path is None:
-            config = Config()
-            default_path = config.get("export_filepath", "")
-
-        # Create a root window and hide it
-        root = tk.Tk()
-        root.withdraw()
-
-        # Open file dialog to choose save path and filename
-        output_name = filedialog.asksaveasfilename(
-            initialfile= f"1wire_{start_date.strftime("%Y%m%d_%H%M%S")}_{end_date.strftime("%Y%m%d_%H%M%S")}.csv",
-            defaultextension=".csv",
-            filetypes=[("CSV files", "*.csv"), ("All files", "*.*")],
-            title="Save CSV file as",
-            initialdir=default_path
-        )
+        output_name = ask_export_path(parent, default_path, export_file_name(start_date, end_date))
 
         # If user cancels the file dialog, exit the function
         if not output_name:
-            print("Export cancelled.")
             return
-        # Connect to the database
-        conn = sqlite3.connect(database_name)
-        cursor = conn.cursor()
 
-        # Query to fetch data between the specified dates
-        query = f"""
-        SELECT data, T1, T2, T3, comment 
-        FROM {table_name} 
-        WHERE data BETWEEN ? AND ?
-        ORDER BY data;
-        """
-        cursor.execute(query, (start_date, end_date))
+        export_file(database_name, table_name, output_name, start_date, end_date)
+        print(f"Export complete! File saved as: {output_name}")
+    except Exception as e:
+        print(f"An error occurred: {e}")
+
 
-        # Fetch column names and rows
-        column_names = [description[0] for description in cursor.description]
-        rows = cursor.fetchall()
+def fetch_filtered_data(db_path, table_name, start_time, end_time):
+    # Rows are (id, ts, temperature per channel..., avg, comment), ts in epoch seconds (see to_epoch),
+    # ready for numpy.array(..., dtype='datetime64[s]') without parsing any text. None = no reading
+    _, where_column, to_bound = time_columns(db_path, table_name)
+    return columns_to_rows(load_sample_columns(db_path, table_name, f"{where_column} BETWEEN ? AND ?",
+                                               (to_bound(start_time), to_bound(end_time)), where_column,
+                                               {"start_ts": to_epoch(start_time), "end_ts": to_epoch(end_time)}, dtype=np.float64))
 
-        # Open a CSV file to write data
-        with open(output_name, "w", newline="", encoding="utf-8") as csv_file:
-            csv_writer = csv.writer(csv_file)
+def columns_to_rows(columns):
+    # TemperatureColumns -> (id, ts, temperature per channel..., avg, comment) tuples, NaN becoming None
+    values = np.column_stack((columns.temps, columns.avg))
+    values = np.where(np.isnan(values), None, values).tolist()
+    return [(row_id, ts, *row_values, columns.comments.get(row))
+            for row, (row_id, ts, row_values) in enumerate(zip(columns.id.tolist(), columns.ts.tolist(), values))]
 
-            # Write the column names as the header
-            csv_writer.writerow(column_names)
+def channel_mean(temps):
+    # Mean of the channels that have a reading, per row; NaN where none has
+    counts = np.count_nonzero(~np.isnan(temps), axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return (np.nansum(temps, axis=1) / counts).astype(temps.dtype)
 
-            # Write sanitized rows to the CSV
-            csv_writer.writerows(rows)
+def select_channels(names, temps, wanted=None):
+    """
+    (names, temps) with the columns of the channels wanted, in that order; channels not in
+    names get a NaN column. Without wanted, channels without a single reading are left out.
+    """
+    if wanted is None:
+        keep = ~np.isnan(temps).all(axis=0) if len(temps) else np.ones(len(names), dtype=bool)
+        if keep.all():
+            return tuple(names), temps
+        return tuple(name for name, kept in zip(names, keep) if kept), temps[:, keep]
+    positions = {name: column for column, name in enumerate(names)}
+    selected = np.full((len(temps), len(wanted)), np.nan, dtype=temps.dtype)
+    for column, name in enumerate(wanted):
+        if name in positions:
+            selected[:, column] = temps[:, positions[name]]
+    return tuple(wanted), selected
 
-        # Close the database connection
-        conn.close()
+def make_columns(ids, ts, names, temps):
+    # TemperatureColumns without comments (see attach_comments)
+    return TemperatureColumns(id=ids, ts=ts, time=local_datetime64(ts), names=tuple(names), temps=temps,
+                              avg=channel_mean(temps), comments={})
 
-        print(f"Export complete! File saved as: {output_name}")
-    except Exception as e:
-        print(f"An error occurred: {e}")
+def sensor_positions(sensors):
+    # sensor_id -> column lookup array for [(sensor_id, name)], -1 for sensors not in the list
+    known = [sensor_id for sensor_id, _ in sensors if sensor_id is not None]
+    positions = np.full(max(known, default=0) + 1, -1, dtype=np.int64)
+    for column, (sensor_id, _) in enumerate(sensors):
+        if sensor_id is not None:
+            positions[sensor_id] = column
+    return positions
+
+def pivot_readings(conn, db_path, table_name, ids, ts, sensors):
+    """
+    float64 matrix of the readings of sensors [(sensor_id, name)] for the samples with the given
+    ids and ts arrays: one row per sample, one column per sensor, NaN where it has no reading.
+    One index range per sensor over the time span of the samples, wherever it is stored.
+    """
+    temps = np.full((len(ids), len(sensors)), np.nan)
+    if not len(ids) or not sensors:
+        return temps
+    start_ts, end_ts = int(ts.min()), int(ts.max())
+    positions = sensor_positions(sensors)
+    order = np.argsort(ids, kind="stable")
+    sorted_ids = ids[order]
+    cursor = shards.execute(conn, db_path, table_name, lambda source: readings.pivot_query(table_name, len(sensors), source),
+                            [sensor_id for sensor_id, _ in sensors] + [start_ts, end_ts], start_ts=start_ts, end_ts=end_ts,
+                            source_table=readings.readings_table(table_name), columns=shards.READING_COLUMNS)
+    for batch in iter(lambda: cursor.fetchmany(EXPORT_BATCH_SIZE), []):
+        data = np.array(batch, dtype=np.float64)
+        sample_ids = data[:, 1].astype(np.int64)
+        # Readings of other samples in the same seconds are skipped
+        found = np.minimum(np.searchsorted(sorted_ids, sample_ids), len(sorted_ids) - 1)
+        member = sorted_ids[found] == sample_ids
+        temps[order[found[member]], positions[data[member, 0].astype(np.int64)]] = data[member, 2]
+    return temps
 
+def load_sample_columns(db_path, table_name, where, params, order, route, names=None, limit=None, dtype=np.float32):
+    """
+    TemperatureColumns of the samples matching where (a condition on the samples table, with
+    params) sorted by order, at most limit of them; route gives the range for shards.execute.
+    The values are looked up in the readings table (see pivot_readings); until backfill_readings
+    has copied an old table they come from its T1-T3 columns. names fixes the channels and their
+    order, by default every channel with a reading among the samples.
+    """
+    time_select, _, _ = time_columns(db_path, table_name)
+    wide = not table_layout(db_path, table_name)["readings_built"]
+    selected = f"id, {time_select}" + "".join(f", {name}" for name in readings.LEGACY_CHANNELS if wide)
+    limit_clause = f" LIMIT {int(limit)}" if limit is not None else ""
+    with db_manager.reader(db_path) as conn:
+        cursor = shards.execute(conn, db_path, table_name, lambda source:
+                                f"SELECT {selected} FROM {source} WHERE {where} ORDER BY {order}{limit_clause}", params, **route)
+        # One LIMIT per group of shards, the groups come in order
+        chunks = [np.array(batch, dtype=np.float64) for batch in iter(lambda: cursor.fetchmany(EXPORT_BATCH_SIZE), [])]
+        width = 5 if wide else 2
+        data = (np.concatenate(chunks) if chunks else np.empty((0, width)))[:limit]
+        ids, ts = data[:, 0].astype(np.int64), data[:, 1].astype(np.int64)
+        if wide:
+            channel_names, temps = readings.LEGACY_CHANNELS, data[:, 2:]
+        else:
+            sensors = readings.channels(conn, table_name)
+            channel_names, temps = [name for _, name in sensors], pivot_readings(conn, db_path, table_name, ids, ts, sensors)
+        columns = make_columns(ids, ts, *select_channels(channel_names, temps.astype(dtype), names))
+        return attach_comments(conn, db_path, table_name, columns)
 
-def fetch_filtered_data(db_path, table_name, start_time, end_time):
-    conn = sqlite3.connect(db_path)
-    cursor = conn.cursor()
-    query = f"""
-    SELECT id, data, CAST(T1 AS FLOAT), CAST(T2 AS FLOAT), CAST(T3 AS FLOAT), 
-           CAST((T1 + T2 + T3) / 3.0 AS FLOAT) as avg_temp,
-           comment
-    FROM {table_name}
-    WHERE data BETWEEN ? AND ?
-    ORDER BY data
-    """
-    cursor.execute(query, (start_time.strftime("%Y-%m-%d %H:%M:%S"), end_time.strftime("%Y-%m-%d %H:%M:%S")))
-    data = cursor.fetchall()
-    conn.close()
-    return data
-
-def add_comment(database_name, table_name, timestamp:str, comment:str):
+def attach_comments(conn, database_name: str, table_name: str, columns):
+    """
+    Fill columns.comments {row index: text} from the comments table. Looks up the id span of
+    the rows, then keeps the comments of ids that are actually among them.
+    """
+    if not len(columns.id):
+        return columns
+    id_span = (int(columns.id.min()), int(columns.id.max()))
+    commented = []
+    if not table_layout(database_name, table_name)["comments_moved"]:
+        # Not yet moved by migrations.move_comments; the comments table wins for ids in both
+        commented += conn.execute(f"SELECT id, comment FROM {table_name} WHERE id BETWEEN ? AND ? "
+                                  "AND comment IS NOT NULL AND comment <> ''", id_span).fetchall()
+    commented += conn.execute(f"SELECT sample_id, text FROM {comments.comment_table(table_name)} "
+                              "WHERE sample_id BETWEEN ? AND ?", id_span).fetchall()
+    if commented:
+        order = np.argsort(columns.id, kind="stable")
+        positions = np.searchsorted(columns.id, [row_id for row_id, _ in commented], sorter=order)
+        for (row_id, comment), position in zip(commented, positions):
+            if position < len(order) and columns.id[order[position]] == row_id:
+                columns.comments[int(order[position])] = comment
+    return columns
+
+def binary_columns_store(db_path, table_name, **route):
+    """
+    The table's binary store, brought up to date, if it is enabled and can answer range reads;
+    otherwise None. It mirrors the live database only, route gives the range (see shards.overlapping).
+    """
+    layout = table_layout(db_path, table_name)
+    if not binary_store.enabled() or not layout["ts_complete"] or not layout["readings_built"]:
+        return None
+    if shards.overlapping(db_path, table_name, **route):
+        return None
+    store = binary_store.get_store(db_path, table_name)
+    return store if store.sync(db_path, table_name) else None
+
+def columns_from_records(db_path, table_name, records, names=None):
+    """
+    TemperatureColumns from a slice of the binary store. id, ts and the values are views of
+    the mapped file (unless names picks channels), time (local time, see local_datetime64)
+    and avg are computed.
+    """
+    with db_manager.reader(db_path) as conn:
+        # The store holds the first registered channels, in registration order
+        channel_names = [name for _, name in readings.channels(conn, table_name)][:records["values"].shape[1]]
+        columns = make_columns(records["id"], records["ts"], *select_channels(channel_names, records["values"], names))
+        return attach_comments(conn, db_path, table_name, columns)
+
+def cached_query(db_path, table_name, key, end_ts, uses_comments, loader):
+    """
+    Return loader() through the range query cache (see query_cache). An entry is reused while
+    no row inserted after it was fetched has a timestamp up to end_ts, and, if uses_comments,
+    while no comment of the table was changed. Pass end_ts None for ranges new rows can never
+    fall into (id ranges). Cached arrays are read-only and shared, copy before modifying.
+    """
+    cache = query_cache.get_cache()
+    if cache.max_bytes <= 0:
+        return loader()
+    key = (db_path, table_name) + tuple(key)
+    with db_manager.reader(db_path) as conn:
+        max_id, comment_version = conn.execute(
+            f"SELECT (SELECT MAX(id) FROM {table_name}), (SELECT value FROM schema_meta WHERE name = ?)",
+            (f"{table_name}.comment_version",)).fetchone()
+
+        entry = cache.get(key)
+        if entry is not None and not (uses_comments and entry.comment_version != comment_version):
+            if entry.max_id == max_id or end_ts is None:
+                cache.hits += 1
+                return entry.value
+            # Rows were inserted since: still exact if they all lie after the cached range
+            first_new_ts = conn.execute(f"SELECT MIN(ts) FROM {table_name} WHERE id > ?", (entry.max_id or 0,)).fetchone()[0]
+            if first_new_ts is not None and first_new_ts > end_ts:
+                cache.hits += 1
+                cache.put(key, entry._replace(max_id=max_id))
+                return entry.value
+
+    cache.misses += 1
+    value = loader()
+    arrays = (value.id, value.ts, value.time, value.temps, value.avg)
+    for array in arrays:
+        array.flags.writeable = False
+    nbytes = sum(array.nbytes for array in arrays) + 100 * len(value.comments)
+    cache.put(key, query_cache.CacheEntry(value, max_id, comment_version, end_ts, uses_comments, nbytes))
+    return value
+
+def fetch_columns(db_path, table_name, start_time, end_time):
+    """
+    Column arrays of the samples between two timestamps, in time order: id and ts int64, time
+    datetime64[s] in local time, names of the channels, temps float32 with one column per
+    channel and avg, the mean of the channels with a reading (NaN = no reading), and comments as
+    a sparse {row index: text} dict. No per-row Python objects are kept. Results are cached,
+    see cached_query.
+    """
+    start_ts, end_ts = to_epoch(start_time), to_epoch(end_time)
+    return cached_query(db_path, table_name, ("raw", start_ts, end_ts), end_ts, True,
+                        lambda: load_columns(db_path, table_name, start_ts, end_ts))
+
+def load_columns(db_path, table_name, start_time, end_time):
+    route = {"start_ts": to_epoch(start_time), "end_ts": to_epoch(end_time)}
+    store = binary_columns_store(db_path, table_name, **route)
+    if store is not None:
+        return columns_from_records(db_path, table_name, store.time_range(to_epoch(start_time), to_epoch(end_time)))
+    _, where_column, to_bound = time_columns(db_path, table_name)
+    return load_sample_columns(db_path, table_name, f"{where_column} BETWEEN ? AND ?",
+                               (to_bound(start_time), to_bound(end_time)), where_column, route)
+
+def fetch_columns_by_id(db_path, table_name, first_id, last_id):
+    # Same as fetch_columns, selected by a primary key range. Ids only grow, so only comments invalidate it
+    return cached_query(db_path, table_name, ("id", first_id, last_id), None, True,
+                        lambda: load_columns_by_id(db_path, table_name, first_id, last_id))
+
+def load_columns_by_id(db_path, table_name, first_id, last_id):
+    route = {"first_id": first_id, "last_id": last_id}
+    store = binary_columns_store(db_path, table_name, **route)
+    if store is not None:
+        return columns_from_records(db_path, table_name, store.id_range(first_id, last_id))
+    return load_sample_columns(db_path, table_name, "id BETWEEN ? AND ?", (first_id, last_id), "id", route)
+
+def fetch_columns_after_id(db_path, table_name, last_id, start_time=None, names=None):
+    """
+    Rows recorded after last_id (and not before start_time), in id order: the new part of a plot
+    following live data. names keeps the channels of the plot (see load_sample_columns). Not
+    cached, it is only ever asked for once.
+    """
+    _, where_column, to_bound = time_columns(db_path, table_name)
+    where, params = "id > ?", (int(last_id),)
+    if start_time is not None:
+        where, params = f"id > ? AND {where_column} >= ?", (int(last_id), to_bound(start_time))
+    return load_sample_columns(db_path, table_name, where, params, "id", {"first_id": int(last_id) + 1}, names)
+
+def fetch_plot_columns(db_path, table_name, start_time, end_time, max_points=5000, sample_interval=1.0):
+    """
+    Columns for plotting a time range with at most about max_points points. Returns (resolution, columns):
+    resolution None means raw samples from fetch_columns, otherwise each entry is the mean of one
+    minute/hour/day bucket (id -1, no comments).
+    sample_interval is the recording interval in seconds, used to estimate the raw row count.
+    Ranges reaching back past the retention horizons use the finest resolution still kept.
+    """
+    start_ts, end_ts = to_epoch(start_time), to_epoch(end_time)
+    resolution = rollups.choose_resolution(end_ts - start_ts, max_points, sample_interval)
+    layout = table_layout(db_path, table_name)
+    if layout["rollups_from"] is not None and start_ts < layout["rollups_from"]:
+        resolution = "day"
+    elif layout["raw_from"] is not None and start_ts < layout["raw_from"]:
+        resolution = resolution or "minute"
+    if resolution is None or not layout["rollups_built"]:
+        return None, fetch_columns(db_path, table_name, start_time, end_time)
+    # A bucket starting at end_ts reaches up to the end of that bucket
+    bucket_end = end_ts + dict(rollups.RESOLUTIONS)[resolution] - 1
+    return resolution, cached_query(db_path, table_name, (resolution, start_ts, end_ts), bucket_end, False,
+                                    lambda: load_rollup_columns(db_path, table_name, resolution, start_ts, end_ts))
+
+def load_rollup_columns(db_path, table_name, resolution, start_ts, end_ts):
+    # One row per bucket, one column per sensor with its mean; buckets have no id, hence -1
+    with db_manager.reader(db_path) as conn:
+        sensors = readings.channels(conn, table_name)
+        data = np.array(conn.execute(rollups.rollup_query(table_name, resolution), (start_ts, end_ts)).fetchall(),
+                        dtype=np.float64).reshape(-1, 3)
+    buckets, rows = np.unique(data[:, 0].astype(np.int64), return_inverse=True)
+    temps = np.full((len(buckets), len(sensors)), np.nan, dtype=np.float32)
+    temps[rows, sensor_positions(sensors)[data[:, 1].astype(np.int64)]] = data[:, 2]
+    return make_columns(np.full(len(buckets), -1, dtype=np.int64), buckets, *select_channels([name for _, name in sensors], temps))
+
+def fetch_data_by_id(db_path, table_name, first_id, last_id):
+    # Same rows as fetch_filtered_data, selected by a primary key range
+    return columns_to_rows(load_sample_columns(db_path, table_name, "id BETWEEN ? AND ?", (first_id, last_id), "id",
+                                               {"first_id": first_id, "last_id": last_id}, dtype=np.float64))
+
+def add_comment(database_name, table_name, sample_id, comment:str):
+    # Set (or with an empty text remove) the comment of one sample, by its id
     try:
-        if len(comment)>250:
-            print("Comment is too long. Maximum length is 250 characters.")
-            return
+        if len(comment)>comments.MAX_COMMENT_LENGTH:
+            print(f"Comment is too long. Maximum length is {comments.MAX_COMMENT_LENGTH} characters.")
+            return False
         
-        # Connect to the database
-        conn = sqlite3.connect(database_name)
-        cursor = conn.cursor()
-        # Update the comment in the database
-        query = f"UPDATE {table_name} SET comment = ? WHERE data = ?"
-        cursor.execute(query, (comment, timestamp))
-        conn.commit()
+        time_select, _, _ = time_columns(database_name, table_name)
+        # The sample may be in a shard; its comment always goes into the live database
+        with db_manager.reader(database_name) as conn:
+            found = shards.execute(conn, database_name, table_name, lambda source: f"SELECT {time_select} FROM {source} WHERE id = ?",
+                                   (sample_id,), first_id=sample_id, last_id=sample_id).fetchall()
+        if not found:
+            print(f"No sample with id {sample_id}.")
+            return False
+        row = found[0]
+        with db_manager.writer(database_name) as conn:
+            comments.set_sample_comment(conn, table_name, sample_id, row[0], comment)
+            if not table_layout(database_name, table_name)["comments_moved"]:
+                # Or migrations.move_comments would bring the old text back
+                conn.execute(f"UPDATE {table_name} SET comment = NULL WHERE id = ?", (sample_id,))
+            # Cached ranges with comments compare this counter (see cached_query)
+            conn.execute("INSERT INTO schema_meta (name, value) VALUES (?, 1) "
+                         "ON CONFLICT(name) DO UPDATE SET value = value + 1", (f"{table_name}.comment_version",))
         print("Comment updated successfully.")
-        conn.close()
+        return True
         
     except Exception as e:
         print(f"An error occurred while updating comment: {e}")
-        
+        return False
+
+def add_span_comment(database_name, table_name, start_time, end_time, comment: str):
+    # Annotate a time span rather than one sample. Returns the new comment id, None on failure
+    if not comment or len(comment) > comments.MAX_COMMENT_LENGTH:
+        print(f"Comment must be 1 to {comments.MAX_COMMENT_LENGTH} characters long.")
+        return None
+    start_ts, end_ts = sorted((to_epoch(start_time), to_epoch(end_time)))
+    with db_manager.writer(database_name) as conn:
+        cursor = conn.execute(f"INSERT INTO {comments.comment_table(table_name)} (start_ts, end_ts, text) VALUES (?, ?, ?)",
+                              (start_ts, end_ts, comment))
+    return cursor.lastrowid
+
+def delete_span_comment(database_name, table_name, comment_id):
+    with db_manager.writer(database_name) as conn:
+        conn.execute(f"DELETE FROM {comments.comment_table(table_name)} WHERE comment_id = ? AND sample_id IS NULL", (comment_id,))
+
+def fetch_comment_spans(database_name, table_name, start_time, end_time):
+    # Span comments overlapping a time range, as (comment_id, start_ts, end_ts, text)
+    query = f"""
+    SELECT comment_id, start_ts, end_ts, text
+    FROM {comments.comment_table(table_name)}
+    WHERE sample_id IS NULL AND start_ts <= ? AND end_ts >= ?
+    ORDER BY start_ts
+    """
+    with db_manager.reader(database_name) as conn:
+        return conn.execute(query, (to_epoch(end_time), to_epoch(start_time))).fetchall()
+
+def search_comments(database_name, table_name, text: str, limit: int = 200):
+    """
+    Comments containing every word of text (full-text search, words match as prefixes), best
+    matches first, as (sample_id, start_ts, end_ts, text). sample_id is None for span comments.
+    """
+    if not text.strip():
+        return []
+    with db_manager.reader(database_name) as conn:
+        query, params = comments.search_query(conn, table_name, text, limit)
+        return conn.execute(query, params).fetchall()
+
+def register_sensor(database_name, table_name, name: str, rom_id: str = None, label: str = None):
+    # Add a sensor (e.g. "T4") to the registry or update the probe bound to it. Returns its id
+    with db_manager.writer(database_name) as conn:
+        sensor_id = readings.sensor_ids(conn, table_name, [name])[name]
+        if rom_id is not None:
+            conn.execute(f"UPDATE {readings.sensors_table(table_name)} SET rom_id = ? WHERE sensor_id = ?", (rom_id, sensor_id))
+        if label is not None:
+            conn.execute(f"UPDATE {readings.sensors_table(table_name)} SET label = ? WHERE sensor_id = ?", (label, sensor_id))
+    return sensor_id
+
+def list_sensors(database_name, table_name):
+    # Registered sensors as (sensor_id, name, rom_id, label), in registration order
+    with db_manager.reader(database_name) as conn:
+        return conn.execute(f"SELECT sensor_id, name, rom_id, label FROM {readings.sensors_table(table_name)} ORDER BY sensor_id").fetchall()
+
+def fetch_sensor_series(database_name, table_name, names, start_time, end_time):
+    """
+    {name: SensorSeries} of the given sensors between two timestamps. Each sensor is one
+    index range of the readings table, sensors that were not asked for are never read.
+    Unknown names give empty series. Until migrations.backfill_readings has copied an old
+    table, T1-T3 are read from the wide table instead.
+    """
+    start_ts, end_ts = to_epoch(start_time), to_epoch(end_time)
+    wide_fallback = not table_layout(database_name, table_name)["readings_built"]
+    time_select, where_column, to_bound = time_columns(database_name, table_name)
+    series = {}
+    with db_manager.reader(database_name) as conn:
+        ids = dict(conn.execute(f"SELECT name, sensor_id FROM {readings.sensors_table(table_name)}").fetchall())
+        for name in names:
+            if wide_fallback and name in readings.LEGACY_CHANNELS:
+                cursor = shards.execute(conn, database_name, table_name, lambda source:
+                                        f"SELECT {time_select}, {name} FROM {source} WHERE {where_column} BETWEEN ? AND ? "
+                                        f"AND {name} IS NOT NULL ORDER BY {where_column}", (to_bound(start_ts), to_bound(end_ts)),
+                                        start_ts=start_ts, end_ts=end_ts)
+            elif name in ids:
+                cursor = shards.execute(conn, database_name, table_name, lambda source: readings.series_query(table_name, source),
+                                        (ids[name], start_ts, end_ts), start_ts=start_ts, end_ts=end_ts,
+                                        source_table=readings.readings_table(table_name), columns=shards.READING_COLUMNS)
+            else:
+                cursor = None
+            data = np.array(cursor.fetchall() if cursor is not None else [], dtype=np.float64).reshape(-1, 2)
+            series[name] = SensorSeries(local_datetime64(data[:, 0].astype(np.int64)), data[:, 1].astype(np.float32))
+    return series
+
+def fetch_sensor_matrix(database_name, table_name, names, start_time, end_time):
+    """
+    The same readings on a common time axis: (time datetime64[s] array, float32 matrix with one
+    column per name, in the order given). NaN where a sensor has no reading at that time.
+    """
+    series = fetch_sensor_series(database_name, table_name, names, start_time, end_time)
+    times = np.unique(np.concatenate([s.time for s in series.values()])) if series else np.empty(0, "datetime64[s]")
+    matrix = np.full((len(times), len(names)), np.nan, dtype=np.float32)
+    for column, name in enumerate(names):
+        matrix[np.searchsorted(times, series[name].time), column] = series[name].values
+    return times, matrix
+
+def configure_database(database_name: str, config):
+    # Apply the storage settings from Config. Every window constructs a Config, so this only
+    # does something when a setting changed; it never touches the connections otherwise (the
+    # writer connection checks WAL mode when it is opened, see db_manager)
+    settings = tuple(config.get(key) for key in STORAGE_SETTINGS)
+    if _storage_settings.get(database_name) == settings:
+        return
+    _storage_settings[database_name] = settings
+    db_manager.configure(synchronous=config.get("db_synchronous"),
+                         cache_size_kb=config.get("db_cache_size_kb"),
+                         mmap_size_mb=config.get("db_mmap_size_mb"),
+                         wal_autocheckpoint=config.get("db_wal_autocheckpoint"))
+    query_cache.configure(config.get("query_cache_mb"))
+    binary_store.configure(config.get("binary_store"))
+
+def checkpoint_db(database_name: str, mode: str = "PASSIVE"):
+    # Move committed pages from the WAL into the database file
+    return db_manager.get_manager(database_name).checkpoint(mode)
+
 def create_db(database_name:str, table_name:str):
     try:
-        # Connect to the database
-        conn = sqlite3.connect(database_name)
-        cursor = conn.cursor()
-        
-        # Create the table if it doesn't exist
+        # Create the table if it doesn't exist. ts (UTC epoch seconds) is the only time column;
+        # the local wall-clock text is formatted from it when reading (see time_text_column).
+        # The temperatures are in the readings table, one row per sensor (see readings)
         query = f"""
         CREATE TABLE IF NOT EXISTS {table_name} (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
-            data DATETIME DEFAULT CURRENT_TIMESTAMP,
-            T1 FLOAT(10,2),
-            T2 FLOAT(10,2),
-            T3 FLOAT(10,2),
-            comment VARCHAR(250) DEFAULT ''
+            ts INTEGER NOT NULL
         );
         """
-        cursor.execute(query)
-        conn.commit()
+        with db_manager.writer(database_name) as conn:
+            conn.execute(query)
         print("Table created successfully.")
-        conn.close()
+
+        # Bring older databases up to date (indexes, rollup and comment tables etc.)
+        migrate_db(database_name, table_name)
     
     except Exception as e:
         print(f"An error occurred while creating table: {e}")
         
 def get_date_range(database_name: str, table_name: str):
-    conn = sqlite3.connect(database_name)
-    cursor = conn.cursor()
-    query = f"SELECT MIN(data), MAX(data) FROM {table_name}"
-    cursor.execute(query)
-    min_date, max_date = cursor.fetchone()
-    conn.close()
+    # Two subqueries: SQLite answers a lone MIN() or MAX() from one end of the index,
+    # but MIN(x), MAX(x) in one SELECT walks the whole index
+    query = date_range_query(database_name, table_name)
+    with db_manager.reader(database_name) as conn:
+        min_date, max_date = conn.execute(query).fetchone()
+    # Moved periods: their first and last timestamps are in the catalog, no shard is opened
+    moved = [shard for shard in shards.list_shards(database_name, table_name) if shard.first_ts is not None]
+    if moved:
+        bounds = [(to_epoch(min_date), to_epoch(max_date))] if min_date is not None else []
+        bounds += [(shard.first_ts, shard.last_ts) for shard in moved]
+        min_date, max_date = epoch_to_text(min(b[0] for b in bounds)), epoch_to_text(max(b[1] for b in bounds))
     if min_date is None or max_date is None:
         print("No data found in the table.")
         return None, None
-    min_date = min_date.split('.')[0]
-    max_date = max_date.split('.')[0]
     print(f"Data range: {min_date} to {max_date}")
     return min_date, max_date
 
+def table_exists(database_name: str, table_name: str):
+    with db_manager.reader(database_name) as conn:
+        row = conn.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (table_name,)).fetchone()
+    return row is not None
+
+def close_connections():
+    # Close every pooled connection, called when the application exits
+    db_manager.close_all()
+
+def get_meta(database_name: str, name: str, default=None):
+    with db_manager.reader(database_name) as conn:
+        row = conn.execute("SELECT value FROM schema_meta WHERE name = ?", (name,)).fetchone()
+    return default if row is None else row[0]
+
+def set_meta(database_name: str, name: str, value):
+    with db_manager.writer(database_name) as conn:
+        conn.execute("INSERT OR REPLACE INTO schema_meta (name, value) VALUES (?, ?)", (name, str(value)))
+
+def database_id(database_name: str):
+    # Random id given to the database file once, so a spool (see spool) can tell which database it belongs to
+    with db_manager.writer(database_name) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_meta (name TEXT PRIMARY KEY, value TEXT)")
+        conn.execute("INSERT OR IGNORE INTO schema_meta (name, value) VALUES ('database_id', ?)", (uuid.uuid4().hex,))
+        return conn.execute("SELECT value FROM schema_meta WHERE name = 'database_id'").fetchone()[0]
+
+def table_layout(database_name: str, table_name: str):
+    """
+    Storage details of a table, cached:
+    text_time      - the table has the local time text column data of databases from before epoch
+                     timestamps; it is still written so old and new rows agree, but only read until ts is complete
+    ts_complete    - every row has ts filled in, so queries can use it (see migrations.migrate_timestamps)
+    rollups_built  - the rollup tables cover all readings (see migrations.rebuild_rollups)
+    comments_moved - comments are only in the comments table (see migrations.move_comments),
+                     not also in the comment column of tables created before it
+    wide_columns   - the table has the T1-T3 columns of databases from before the readings table
+    readings_built - the narrow readings table holds every value, T1-T3 of old tables included
+                     (see migrations.backfill_readings); the T1-T3 columns are no longer read
+    raw_from       - raw samples before this epoch second were removed by the retention policy, or None
+    rollups_from   - the same for the minute and hour rollups (day rollups are kept), see retention.py
+    """
+    key = (database_name, table_name)
+    if key not in _layouts:
+        with db_manager.reader(database_name) as conn:
+            hidden = {row[1]: row[6] for row in conn.execute(f"PRAGMA table_xinfo({table_name})")}
+        text_time = hidden.get("data") == 0  # 2 and 3 are the generated columns of tables dropped by migrate_db
+        comments_moved = "comment" not in hidden or get_meta(database_name, f"{table_name}.comments_moved") == "1"
+        ts_complete = not text_time or get_meta(database_name, f"{table_name}.ts_complete") == "1"
+        wide_columns = "T1" in hidden
+        readings_built = ts_complete and (not wide_columns or get_meta(database_name, f"{table_name}.readings_built") == "1")
+        rollups_built = readings_built and get_meta(database_name, f"{table_name}.rollups_built") == "1"
+        raw_from, rollups_from = (get_meta(database_name, f"{table_name}.{name}") for name in ("raw_from", "rollups_from"))
+        _layouts[key] = {"text_time": text_time, "ts_complete": ts_complete, "rollups_built": rollups_built,
+                         "comments_moved": comments_moved, "wide_columns": wide_columns, "readings_built": readings_built,
+                         "raw_from": None if raw_from is None else int(raw_from),
+                         "rollups_from": None if rollups_from is None else int(rollups_from)}
+    return _layouts[key]
+
+def forget_layout(database_name: str, table_name: str):
+    _layouts.pop((database_name, table_name), None)
+
+def time_columns(database_name: str, table_name: str):
+    """
+    (select expression, filter column, bound converter) for time based queries.
+    Uses the integer ts column once it is complete and falls back to the indexed text column
+    while an old database is still being migrated. Either way the selected value is epoch seconds.
+    """
+    if table_layout(database_name, table_name)["ts_complete"]:
+        return "ts", "ts", to_epoch
+    return "CAST(strftime('%s', data, 'utc') AS INTEGER)", "data", lambda value: epoch_to_text(to_epoch(value))
+
+def time_text_column(database_name: str, table_name: str):
+    # Select expression for the local wall-clock text of a row's time (display and CSV export).
+    # ts is UTC; a generated column cannot convert it to local time ('localtime' is not deterministic),
+    # so the conversion happens here. Before the ts column is complete, the old text column already is local.
+    if table_layout(database_name, table_name)["ts_complete"]:
+        return "datetime(ts, 'unixepoch', 'localtime')"
+    return "data"
+
+def date_range_query(database_name: str, table_name: str):
+    _, where_column, _ = time_columns(database_name, table_name)
+    if where_column == "ts":
+        return (f"SELECT datetime((SELECT MIN(ts) FROM {table_name}), 'unixepoch', 'localtime'), "
+                f"datetime((SELECT MAX(ts) FROM {table_name}), 'unixepoch', 'localtime')")
+    return f"SELECT datetime((SELECT MIN(data) FROM {table_name})), datetime((SELECT MAX(data) FROM {table_name}))"
+
+def migrate_db(database_name: str, table_name: str):
+    # Idempotent schema upgrades for existing databases, safe to run on every start
+    with db_manager.writer(database_name) as conn:
+        conn.execute("CREATE TABLE IF NOT EXISTS schema_meta (name TEXT PRIMARY KEY, value TEXT)")
+
+        # Epoch timestamps: old tables get an empty ts column, filled by migrations.migrate_timestamps
+        hidden = {row[1]: row[6] for row in conn.execute(f"PRAGMA table_xinfo({table_name})")}
+        if "ts" not in hidden:
+            conn.execute(f"ALTER TABLE {table_name} ADD COLUMN ts INTEGER")
+        # Tables created with epoch timestamps had data as a generated column, formatted from ts in
+        # UTC while the text column of older tables is local time. Nothing reads it; drop it where
+        # SQLite can (DROP COLUMN needs 3.35) so that ts is the only time a table holds
+        if hidden.get("data") in (2, 3) and sqlite3.sqlite_version_info >= (3, 35, 0):
+            conn.execute(f"ALTER TABLE {table_name} DROP COLUMN data")
+
+        # Range queries, MIN/MAX and comment updates by timestamp all search on ts
+        conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_ts ON {table_name} (ts)")
+
+        # Minute/hour/day aggregates, kept up to date by the insert functions. Rollups with
+        # T1-T3 columns from before the readings table are rebuilt by migrations.rebuild_rollups
+        if rollups.wide_rollup_tables(conn, table_name):
+            rollups.drop_rollup_tables(conn, table_name)
+            conn.execute("DELETE FROM schema_meta WHERE name = ?", (f"{table_name}.rollups_built",))
+        rollups.create_rollup_tables(conn, table_name)
+        # Comments by sample id and time span, with their search index
+        comments.create_comment_tables(conn, table_name)
+        # Sensor registry and narrow per-sensor readings, written by the insert functions.
+        # A readings table keyed without sample ids is rebuilt by migrations.backfill_readings
+        if not readings.keyed_by_sample(conn, table_name):
+            conn.execute(f"DROP TABLE {readings.readings_table(table_name)}")
+            conn.execute("DELETE FROM schema_meta WHERE name = ?", (f"{table_name}.readings_built",))
+        readings.create_readings_tables(conn, table_name)
+        # Catalog of the files closed periods were moved to (see shards, migrations.rotate_shards)
+        shards.create_catalog(conn, table_name)
+        if conn.execute(f"SELECT 1 FROM {table_name} LIMIT 1").fetchone() is None:
+            # Nothing recorded yet, so there is nothing for the migrations to catch up on
+            for name in ("rollups_built", "comments_moved", "readings_built"):
+                conn.execute("INSERT OR IGNORE INTO schema_meta (name, value) VALUES (?, '1')", (f"{table_name}.{name}",))
+    forget_layout(database_name, table_name)
+
+    # The text index serves queries only until the ts column is complete
+    if not table_layout(database_name, table_name)["ts_complete"]:
+        with db_manager.writer(database_name) as conn:
+            conn.execute(f"CREATE INDEX IF NOT EXISTS idx_{table_name}_data ON {table_name} (data)")
+    check_query_plans(database_name, table_name)
+
+def hot_queries(database_name: str, table_name: str):
+    # The queries the UI runs over and over, with sample parameters, for query plan checks
+    time_select, where_column, to_bound = time_columns(database_name, table_name)
+    time_text = time_text_column(database_name, table_name)
+    comment_table = comments.comment_table(table_name)
+    start, end = to_bound("2024-01-01 00:00:00"), to_bound("2024-01-02 00:00:00")
+    return {
+        "fetch_columns": (f"SELECT id, {time_select} FROM {table_name} WHERE {where_column} BETWEEN ? AND ? "
+                          f"ORDER BY {where_column}", (start, end)),
+        "fetch_columns_by_id": (f"SELECT id, {time_select} FROM {table_name} WHERE id BETWEEN ? AND ? ORDER BY id", (1, 2)),
+        "pivot_readings": (readings.pivot_query(table_name, 3), (1, 2, 3, 0, 1)),
+        "export_batches": (f"SELECT id, {time_select} FROM {table_name} WHERE {where_column} BETWEEN ? AND ? "
+                           f"AND ({where_column} > ? OR id > ?) ORDER BY {where_column}, id LIMIT {EXPORT_BATCH_SIZE}",
+                           (start, end, start, 0)),
+        "fetch_plot_columns": (rollups.rollup_query(table_name, "minute"), (0, 1)),
+        "get_date_range": (date_range_query(database_name, table_name), ()),
+        "attach_comments": (f"SELECT sample_id, text FROM {comment_table} WHERE sample_id BETWEEN ? AND ?", (1, 2)),
+        "fetch_comment_spans": (f"SELECT comment_id FROM {comment_table} WHERE sample_id IS NULL AND start_ts <= ? AND end_ts >= ?", (1, 2)),
+        "fetch_sensor_series": (readings.series_query(table_name), (1, 0, 1)),
+        "fetch_last_n_records": (f"SELECT {time_text} FROM {table_name} WHERE id = ?", (1,)),
+    }
+
+def explain_query_plans(database_name: str, table_name: str):
+    # name -> list of EXPLAIN QUERY PLAN detail lines
+    # A throwaway connection: pooled ones cache prepared EXPLAIN statements, which keep
+    # showing the plan from before a migration
+    plans = {}
+    conn = db_manager.get_manager(database_name).connect(read_only=True)
+    try:
+        for name, (query, params) in hot_queries(database_name, table_name).items():
+            plans[name] = [row[3] for row in conn.execute(f"EXPLAIN QUERY PLAN {query}", params)]
+    finally:
+        conn.close()
+    return plans
+
+def check_query_plans(database_name: str, table_name: str):
+    # Returns the names of hot queries that fell back to a full table or index scan (and prints them)
+    full_scans = []
+    for name, details in explain_query_plans(database_name, table_name).items():
+        # A bare "SEARCH table" (no index) is what SQLite prints for MIN()/MAX() without an index
+        if any(detail.startswith(f"SCAN {table_name}") or detail == f"SEARCH {table_name}" for detail in details):
+            full_scans.append(name)
+            print(f"Warning: {name} scans the whole {table_name} table: {'; '.join(details)}")
+    return full_scans
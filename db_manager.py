@@ -0,0 +1,180 @@
+import queue
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Number of reader connections kept open per database
+READER_POOL_SIZE = 3
+
+# Compiled statements cached per connection. sqlite3 reuses a prepared statement whenever the
+# same SQL text runs again on the same connection, so long-lived connections skip re-parsing.
+STATEMENT_CACHE_SIZE = 256
+
+# Pragmas applied to every new connection, see configure()
+PRAGMAS = {
+    "auto_vacuum": "INCREMENTAL",   # only takes effect on a new, empty file (before WAL is set), see retention.py
+    "synchronous": "NORMAL",        # with WAL: no fsync per commit, a power cut may lose the last commits but never corrupts
+    "cache_size": -8192,            # negative = KiB of page cache per connection
+    "mmap_size": 64 * 1024 * 1024,  # bytes of the database file read through mmap
+    "wal_autocheckpoint": 1000,     # pages in the WAL before a passive checkpoint runs
+    "busy_timeout": 5000,           # ms to wait for a lock instead of failing with "database is locked"
+}
+
+
+class ConnectionManager:
+    """
+    Long-lived connections to one SQLite database.
+
+    There is a single writer connection, serialised by a lock, and a small pool of reader
+    connections handed out one caller at a time. Connections are opened lazily and kept for
+    the life of the application, so connection setup and schema parsing happen once instead
+    of on every call.
+    """
+
+    def __init__(self, db_path, reader_pool_size=READER_POOL_SIZE):
+        self.db_path = db_path
+        self.reader_pool_size = reader_pool_size
+
+        self.write_lock = threading.RLock()
+        self.writer_conn = None
+
+        self.readers = queue.LifoQueue()
+        self.readers_created = 0
+        self.pool_lock = threading.Lock()
+        self.closed = False
+
+    def connect(self, read_only=False):
+        # uri=True lets shards.attach open shard files read-only by URI; plain paths work as before
+        conn = sqlite3.connect(self.db_path, check_same_thread=False, cached_statements=STATEMENT_CACHE_SIZE, uri=True)
+        for name, value in PRAGMAS.items():
+            conn.execute(f"PRAGMA {name} = {value}")
+        if read_only:
+            # Readers can never take the write lock by accident
+            conn.execute("PRAGMA query_only = 1")
+        else:
+            # WAL lets readers work on a snapshot while the writer appends, the setting is stored in the file
+            journal_mode = conn.execute("PRAGMA journal_mode = WAL").fetchone()[0]
+            if journal_mode.lower() != "wal":
+                print(f"Warning: {self.db_path} is in {journal_mode} mode, readers may block the recorder")
+        return conn
+
+    @contextmanager
+    def writer(self):
+        # Commits when the block succeeds, rolls back if it raises
+        with self.write_lock:
+            if self.closed:
+                raise sqlite3.ProgrammingError(f"Connection manager for {self.db_path} is closed")
+            if self.writer_conn is None:
+                self.writer_conn = self.connect()
+            try:
+                yield self.writer_conn
+                self.writer_conn.commit()
+            except BaseException:
+                self.writer_conn.rollback()
+                raise
+
+    @contextmanager
+    def reader(self):
+        conn = self.acquire_reader()
+        try:
+            yield conn
+        finally:
+            # End any implicit read transaction so the next user sees fresh data
+            if conn.in_transaction:
+                conn.rollback()
+            self.readers.put(conn)
+
+    def acquire_reader(self):
+        if self.closed:
+            raise sqlite3.ProgrammingError(f"Connection manager for {self.db_path} is closed")
+        try:
+            return self.readers.get_nowait()
+        except queue.Empty:
+            pass
+        with self.pool_lock:
+            if self.readers_created < self.reader_pool_size:
+                self.readers_created += 1
+                return self.connect(read_only=True)
+        return self.readers.get()  # all readers busy, wait for one
+
+    def checkpoint(self, mode="PASSIVE"):
+        # PASSIVE never waits for readers; TRUNCATE also resets the WAL file to zero bytes
+        with self.writer() as conn:
+            return conn.execute(f"PRAGMA wal_checkpoint({mode})").fetchone()
+
+    def close(self):
+        self.closed = True
+        with self.write_lock:
+            if self.writer_conn is not None:
+                try:
+                    self.writer_conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+                except sqlite3.Error as e:
+                    print(f"Checkpoint on close failed: {e}")
+                self.writer_conn.close()
+                self.writer_conn = None
+        while True:
+            try:
+                self.readers.get_nowait().close()
+            except queue.Empty:
+                break
+        self.readers_created = 0
+
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def get_manager(db_path):
+    # One manager per database file for the whole process
+    with _managers_lock:
+        manager = _managers.get(db_path)
+        if manager is None or manager.closed:
+            manager = ConnectionManager(db_path)
+            _managers[db_path] = manager
+        return manager
+
+
+def configure(synchronous=None, cache_size_kb=None, mmap_size_mb=None, wal_autocheckpoint=None):
+    """
+    Change the pragmas used for new connections. Open connections are closed and reopened
+    lazily with the new settings if anything changed.
+    """
+    settings = dict(PRAGMAS)
+    if synchronous is not None:
+        if str(synchronous).upper() in ("OFF", "NORMAL", "FULL", "EXTRA"):
+            settings["synchronous"] = str(synchronous).upper()
+        else:
+            print(f"Ignoring unknown synchronous level: {synchronous}")
+    if cache_size_kb is not None:
+        settings["cache_size"] = -int(cache_size_kb)
+    if mmap_size_mb is not None:
+        settings["mmap_size"] = int(mmap_size_mb) * 1024 * 1024
+    if wal_autocheckpoint is not None:
+        settings["wal_autocheckpoint"] = int(wal_autocheckpoint)
+    if settings != PRAGMAS:
+        PRAGMAS.update(settings)
+        close_all()
+
+
+def writer(db_path):
+    return get_manager(db_path).writer()
+
+
+def reader(db_path):
+    return get_manager(db_path).reader()
+
+
+def close(db_path):
+    with _managers_lock:
+        manager = _managers.pop(db_path, None)
+    if manager is not None:
+        manager.close()
+
+
+def close_all():
+    # Called on application exit
+    with _managers_lock:
+        managers = list(_managers.values())
+        _managers.clear()
+    for manager in managers:
+        manager.close()
@@ -0,0 +1,223 @@
+import os
+import queue
+import threading
+import tkinter as tk
+from tkinter import ttk
+import db_functions
+
+# Exports run one after another on a background thread, so the Tk loop (live graph) and the
+# acquisition thread keep their cadence while a large table is written. Jobs report progress
+# through thread-safe attributes that the ExportJobsWindow polls from the Tk loop.
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class ExportJob:
+    """One export: the whole table, or the rows between start_date and end_date, into output_name."""
+
+    def __init__(self, db_path, table_name, output_name, start_date=None, end_date=None, description=None):
+        self.db_path = db_path
+        self.table_name = table_name
+        self.output_name = output_name
+        self.start_date = start_date
+        self.end_date = end_date
+        self.description = description or os.path.basename(output_name)
+
+        self.state = QUEUED
+        self.rows = 0
+        self.total = None
+        self.rows_per_second = 0.0
+        self.elapsed = 0.0
+        self.error = None
+        self.cancel_event = threading.Event()
+
+    def cancel(self):
+        # A queued job is skipped, a running one stops before its next batch
+        self.cancel_event.set()
+
+    def update_progress(self, rows, total, rows_per_second):
+        self.rows = rows
+        self.total = total
+        self.rows_per_second = rows_per_second
+
+    def fraction(self):
+        if self.state == DONE:
+            return 1.0
+        return self.rows / self.total if self.total else 0.0
+
+    def finished(self):
+        return self.state in (DONE, FAILED, CANCELLED)
+
+    def run(self):
+        if self.cancel_event.is_set():
+            self.state = CANCELLED
+            return
+        self.state = RUNNING
+        try:
+            self.rows, self.elapsed = db_functions.export_file(self.db_path, self.table_name, self.output_name, self.start_date,
+                                                               self.end_date, self.update_progress, self.cancel_event)
+            self.state = DONE
+            print(f"Export complete! {self.rows} rows saved as: {self.output_name}")
+        except db_functions.ExportCancelled:
+            self.state = CANCELLED
+            self.remove_partial_file()
+            print(f"Export to {self.output_name} cancelled")
+        except Exception as e:
+            self.state = FAILED
+            self.error = str(e)
+            self.remove_partial_file()
+            print(f"Export to {self.output_name} failed: {e}")
+
+    def remove_partial_file(self):
+        try:
+            os.remove(self.output_name)
+        except OSError:
+            pass
+
+
+class ExportRunner(threading.Thread):
+    """Background thread running submitted ExportJobs in order."""
+
+    def __init__(self):
+        super().__init__(name="export", daemon=True)
+        self.jobs = queue.Queue()
+        self.history = []  # every submitted job, for the jobs window
+        self.current = None
+        self.lock = threading.Lock()
+
+    def submit(self, job):
+        with self.lock:
+            self.history.append(job)
+        self.jobs.put(job)
+        return job
+
+    def run(self):
+        while True:
+            job = self.jobs.get()
+            if job is None:
+                break
+            self.current = job
+            job.run()
+            self.current = None
+
+    def pending(self):
+        with self.lock:
+            return [job for job in self.history if not job.finished()]
+
+    def stop(self, timeout=5):
+        # Cancel everything, let the running job remove its partial file, then end the thread
+        for job in self.pending():
+            job.cancel()
+        self.jobs.put(None)
+        if self.is_alive():
+            self.join(timeout)
+
+
+_runner = None
+_runner_lock = threading.Lock()
+
+
+def get_runner():
+    # One export thread for the whole application, started on first use
+    global _runner
+    with _runner_lock:
+        if _runner is None or not _runner.is_alive():
+            _runner = ExportRunner()
+            _runner.start()
+        return _runner
+
+
+def shutdown_runner(timeout=5):
+    # Called on application exit, before the database connections are closed
+    global _runner
+    with _runner_lock:
+        runner, _runner = _runner, None
+    if runner is not None:
+        runner.stop(timeout)
+
+
+class ExportJobsWindow:
+    """
+    Lists export jobs with a progress bar and a Cancel button each. One window per application,
+    shown whenever a job is submitted; closing it only hides it, the jobs keep running.
+    """
+
+    POLL_INTERVAL = 250  # ms
+
+    _instance = None
+
+    @classmethod
+    def show(cls, parent):
+        if cls._instance is None or not cls._instance.window.winfo_exists():
+            cls._instance = cls(parent.winfo_toplevel())
+        cls._instance.window.deiconify()
+        cls._instance.window.lift()
+        return cls._instance
+
+    def __init__(self, parent):
+        self.window = tk.Toplevel(parent)
+        self.window.title("Exports")
+        self.window.geometry("520x300")
+        self.window.protocol("WM_DELETE_WINDOW", self.window.withdraw)
+
+        self.rows_frame = tk.Frame(self.window, padx=10, pady=10)
+        self.rows_frame.pack(fill="both", expand=True)
+        self.widgets = {}  # job -> (progress bar, status label, cancel button, state shown last)
+
+        self.poll_job = None
+        self.poll()
+
+    def add_row(self, job):
+        frame = tk.Frame(self.rows_frame, relief=tk.SUNKEN, borderwidth=1)
+        frame.pack(fill="x", pady=3)
+        tk.Label(frame, text=job.description, anchor="w").pack(fill="x", padx=5)
+        bar = ttk.Progressbar(frame, orient="horizontal", mode="determinate", maximum=100)
+        bar.pack(side="left", fill="x", expand=True, padx=5, pady=3)
+        cancel_button = tk.Button(frame, text="Cancel", command=job.cancel)
+        cancel_button.pack(side="right", padx=5)
+        status = tk.Label(frame, width=28, anchor="w")
+        status.pack(side="right", padx=5)
+        self.widgets[job] = (bar, status, cancel_button, QUEUED)
+
+    def poll(self):
+        runner = _runner  # not get_runner(): polling must not restart the thread after shutdown_runner()
+        for job in list(runner.history) if runner is not None else []:
+            if job not in self.widgets:
+                self.add_row(job)
+            bar, status, cancel_button, last_state = self.widgets[job]
+            bar["value"] = job.fraction() * 100
+            if job.state == RUNNING:
+                status.config(text=f"{job.rows}/{job.total or '?'} rows, {job.rows_per_second:.0f} rows/s")
+            elif job.state == FAILED:
+                status.config(text=f"Failed: {job.error}", fg="red")
+            elif job.state == DONE:
+                status.config(text=f"Done: {job.rows} rows in {job.elapsed:.1f} s", fg="green")
+            else:
+                status.config(text=job.state.capitalize())
+
+            if job.finished() and last_state != job.state:
+                # Completion notification without a modal dialog, so the live graph keeps updating
+                cancel_button.config(state="disabled")
+                self.window.bell()
+                self.window.deiconify()
+                self.window.lift()
+            self.widgets[job] = (bar, status, cancel_button, job.state)
+        self.poll_job = self.window.after(self.POLL_INTERVAL, self.poll)
+
+
+def export_in_background(parent, db_path, table_name, default_path=None, start_date=None, end_date=None):
+    """
+    Ask for a file name and queue the export: the whole table, or the rows between start_date and
+    end_date. Returns the ExportJob, or None if the dialog was cancelled.
+    """
+    initialfile = db_functions.export_file_name(start_date, end_date) if start_date is not None else None
+    output_name = db_functions.ask_export_path(parent, default_path, initialfile)
+    if not output_name:
+        return None
+    if start_date is not None:
+        description = f"{os.path.basename(output_name)} ({start_date} to {end_date})"
+    else:
+        description = f"{os.path.basename(output_name)} (whole database)"
+    job = get_runner().submit(ExportJob(db_path, table_name, output_name, start_date, end_date, description))
+    ExportJobsWindow.show(parent)
+    return job
@@ -2,16 +2,25 @@ import matplotlib.pyplot as plt
 import matplotlib.dates as mdates
 from datetime import datetime
 import db_functions
+import export_jobs
 import tkinter as tk
 from tkinter import ttk
 from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
 import tkinter.simpledialog
+import tkinter.messagebox
 import numpy as np
 from matplotlib.lines import Line2D
 from configuration import Config
 
+# Line colours of the channels in order, the first three as they always were; more channels cycle through them
+CHANNEL_COLORS = ('blue', 'red', 'green', 'orange', 'brown', 'teal', 'magenta', 'olive', 'gray', 'navy')
+
+def channel_label(name):
+    # "T2" -> "Temp 2", the text the plot has always used; other sensor names are shown as they are
+    return f"Temp {name[1:]}" if name[:1] == "T" and name[1:].isdigit() else name
+
 class InteractiveTemperaturePlot:
-    def __init__(self, parent, start_time, end_time):
+    def __init__(self, parent, start_time, end_time, id_range=None, focus_id=None):
         self.igraph = tk.Toplevel(parent)
         self.igraph.title(f"Temperature Plot {start_time} to {end_time}")
         self.igraph.geometry("1200x600")
@@ -24,6 +33,11 @@ class InteractiveTemperaturePlot:
         
         self.start_time = start_time
         self.end_time = end_time
+        # (first id, last id) when the plot shows the last n records, queried by primary key
+        self.id_range = id_range
+        # Sample to select once the window is up, e.g. a comment found by the Filter window's search
+        self.focus_id = focus_id
+        self.focus_index = None
         
 
         # Create main frame
@@ -41,21 +55,16 @@ class InteractiveTemperaturePlot:
 
 
         # Fetch and prepare data
-        self.dataset = db_functions.fetch_filtered_data(self.db_path, self.table_name, self.start_time, self.end_time)
-        self.timestamps = [datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S') for row in self.dataset]
-        self.temperatures = [float(row[2]) for row in self.dataset]
-        self.temperatures2 = [float(row[3]) for row in self.dataset]
-        self.temperatures3 = [float(row[4]) for row in self.dataset]
-        self.avg_temp = [float(row[5]) for row in self.dataset]
-        self.comments = [row[6] if len(row) > 6 else '' for row in self.dataset]
-
-
-        # Initialize checkbox variables
-        self.temp1_var = tk.BooleanVar(value=True)
-        self.temp2_var = tk.BooleanVar(value=True)
-        self.temp3_var = tk.BooleanVar(value=True)
+        self.table_fill_job = None
+        self.follow_job = None
+        self.load_dataset()
+
+
+        # Initialize checkbox variables, one per channel
+        self.channel_vars = [tk.BooleanVar(value=True) for _ in self.names]
         self.avg_temp_var = tk.BooleanVar(value=True)
         self.show_comments_var = tk.BooleanVar()
+        self.follow_var = tk.BooleanVar()
 
         # Initialize the plot
         self.fig, self.ax = plt.subplots(figsize=(10, 4))
@@ -81,6 +90,38 @@ class InteractiveTemperaturePlot:
         # Create Treeview for data table
         self.create_data_table()
 
+        if self.focus_id is not None:
+            self.focus_sample(self.focus_id)
+
+    def fetch_dataset(self):
+        # Long ranges come from the minute/hour/day rollups, self.resolution is None for raw samples
+        self.resolution = None
+        if self.id_range is not None:
+            return db_functions.fetch_columns_by_id(self.db_path, self.table_name, *self.id_range)
+        self.resolution, columns = db_functions.fetch_plot_columns(self.db_path, self.table_name, self.start_time, self.end_time,
+                                                                   self.config.get("plot_max_points"), self.config.get("update_interval") / 1000.0)
+        return columns
+
+    def load_dataset(self):
+        # Column arrays (see db_functions.TemperatureColumns), used as they are by the plot and the table
+        self.dataset = self.fetch_dataset()
+        self.ids = self.dataset.id
+        self.timestamps = self.dataset.time
+        # Channel names and a matrix with one column per channel
+        self.names = self.dataset.names
+        self.temperatures = self.dataset.temps
+        self.avg_temp = self.dataset.avg
+        # {row index: text}, only commented rows. A copy: the dataset is shared through the query cache
+        self.comments = dict(self.dataset.comments)
+        self.xdata = mdates.date2num(self.timestamps)
+        # Highest id shown, following live data appends the rows after it
+        self.last_id = int(self.dataset.id.max()) if len(self.dataset.id) else 0
+        # Comments on time spans rather than single samples, (comment_id, start_ts, end_ts, text)
+        self.spans = db_functions.fetch_comment_spans(self.db_path, self.table_name, self.start_time, self.end_time)
+
+    def time_text(self, index):
+        return str(self.timestamps[index]).replace('T', ' ')
+
     def create_control_frame(self):
         # Frame for buttons and controls
         self.control_frame = tk.Frame(self.main_frame)
@@ -96,31 +137,35 @@ class InteractiveTemperaturePlot:
                                                      command=self.toggle_comments)
         self.show_comments_checkbox.pack(side=tk.LEFT, padx=10, pady=10)
         
-        # Add checkboxes for showing/hiding temperature lines
-        self.temp1_checkbox = tk.Checkbutton(self.control_frame, text="Show Temp 1", 
-                                             variable=self.temp1_var, 
-                                             command=self.toggle_temp_lines)
-        self.temp1_checkbox.pack(side=tk.LEFT, padx=10, pady=10)
-        
-        self.temp2_checkbox = tk.Checkbutton(self.control_frame, text="Show Temp 2", 
-                                             variable=self.temp2_var, 
-                                             command=self.toggle_temp_lines)
-        self.temp2_checkbox.pack(side=tk.LEFT, padx=10, pady=10)
-        
-        self.temp3_checkbox = tk.Checkbutton(self.control_frame, text="Show Temp 3", 
-                                             variable=self.temp3_var, 
-                                             command=self.toggle_temp_lines)
-        self.temp3_checkbox.pack(side=tk.LEFT, padx=10, pady=10)
+        # Showing/hiding temperature lines: a menu of checkboxes, one per channel however many there are
+        self.channels_button = tk.Menubutton(self.control_frame, text="Show Channels", relief=tk.RAISED)
+        self.channels_menu = tk.Menu(self.channels_button, tearoff=0)
+        for name, variable in zip(self.names, self.channel_vars):
+            self.channels_menu.add_checkbutton(label=channel_label(name), variable=variable, command=self.toggle_temp_lines)
+        self.channels_button.config(menu=self.channels_menu)
+        self.channels_button.pack(side=tk.LEFT, padx=10, pady=10)
         
         self.avg_temp_checkbox = tk.Checkbutton(self.control_frame, text="Show Avg Temp", 
                                             variable=self.avg_temp_var, 
                                             command=self.toggle_temp_lines)
         self.avg_temp_checkbox.pack(side=tk.LEFT, padx=10, pady=10)
+
+        # Append newly recorded samples while the window is open (raw samples only, not rollup means)
+        self.follow_checkbox = tk.Checkbutton(self.control_frame, text="Follow live data",
+                                              variable=self.follow_var,
+                                              command=self.toggle_follow)
+        self.follow_checkbox.pack(side=tk.LEFT, padx=10, pady=10)
+        if self.resolution:
+            self.follow_checkbox.config(state="disabled")
     
 
         # Add button to update comments
         self.update_comment_button = tk.Button(self.control_frame, text="Update Comment", font=('Arial', '12'), command=self.update_comment)
         self.update_comment_button.pack(side=tk.LEFT, padx=10, pady=10)
+
+        # Comment on the visible time span instead of one sample
+        self.annotate_range_button = tk.Button(self.control_frame, text="Annotate Range", font=('Arial', '12'), command=self.annotate_range)
+        self.annotate_range_button.pack(side=tk.LEFT, padx=10, pady=10)
         
         self.exitbutton = tk.Button(self.control_frame, text="Exit", font=('Arial', '12'), command=self.close_window)
         self.exitbutton.pack(side=tk.RIGHT, padx=10, pady=10)
@@ -146,39 +191,31 @@ class InteractiveTemperaturePlot:
         self.table_scrollbar = tk.Scrollbar(self.table_frame)
         self.table_scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
 
+        # One column per channel, named by the channel's position
+        channel_columns = [f'Temp{column}' for column in range(len(self.names))]
         self.data_table = ttk.Treeview(
             self.table_frame, 
-            columns=('Timestamp', 'Temp1', 'Temp2', 'Temp3', 'AvgTemp', 'Comment'), 
+            columns=['Timestamp'] + channel_columns + ['AvgTemp', 'Comment'], 
             show='headings', 
             yscrollcommand=self.table_scrollbar.set
         )
 
         # Define headings
         self.data_table.heading('Timestamp', text='Timestamp')
-        self.data_table.heading('Temp1', text='Temp 1')
-        self.data_table.heading('Temp2', text='Temp 2')
-        self.data_table.heading('Temp3', text='Temp 3')
+        for column, name in zip(channel_columns, self.names):
+            self.data_table.heading(column, text=channel_label(name))
         self.data_table.heading('AvgTemp', text='Avg Temp')
         self.data_table.heading('Comment', text='Comment')
 
         # Define column widths
         self.data_table.column('Timestamp', width=200, anchor='center')
-        self.data_table.column('Temp1', width=100, anchor='center')
-        self.data_table.column('Temp2', width=100, anchor='center')
-        self.data_table.column('Temp3', width=100, anchor='center')
+        for column in channel_columns:
+            self.data_table.column(column, width=100, anchor='center')
         self.data_table.column('AvgTemp', width=100, anchor='center')
         self.data_table.column('Comment', width=300, anchor='w')
 
         # Populate the table
-        for i in range(len(self.timestamps)):
-            self.data_table.insert('', 'end', values=(
-                self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S'),
-                f'{float(self.temperatures[i]):.2f}',
-                f'{float(self.temperatures2[i]):.2f}', 
-                f'{float(self.temperatures3[i]):.2f}',
-                f'{float(self.avg_temp[i]):.2f}',
-                self.comments[i]
-            ))
+        self.populate_table()
 
         # Configure scrollbar
         self.table_scrollbar.config(command=self.data_table.yview)
@@ -189,15 +226,49 @@ class InteractiveTemperaturePlot:
         # Bind selection event:
         self.data_table.bind("<ButtonRelease-1>", self.on_table_select)
     
+    def populate_table(self):
+        # Rows go in TABLE_CHUNK at a time from the Tk loop, so the window shows up right away even
+        # for 100k rows. The item id of a row is its index in the column arrays.
+        if self.table_fill_job is not None:
+            self.igraph.after_cancel(self.table_fill_job)
+            self.table_fill_job = None
+        self.data_table.delete(*self.data_table.get_children())
+        self.fill_table(0)
+
+    TABLE_CHUNK = 2000
+    MARKER_LIMIT = 2000
+
+    def fill_table(self, start):
+        if not self.data_table.winfo_exists():
+            return  # window closed while the table was still loading
+        end = min(start + self.TABLE_CHUNK, len(self.timestamps))
+        # Cell texts are formatted per chunk straight from the arrays
+        times = np.datetime_as_string(self.timestamps[start:end], unit='s').tolist()
+        temps = np.column_stack((self.temperatures[start:end], self.avg_temp[start:end])).tolist()
+        for offset, i in enumerate(range(start, end)):
+            self.data_table.insert('', 'end', iid=str(i), values=(
+                times[offset].replace('T', ' '),
+                *(f'{value:.2f}' for value in temps[offset]),
+                self.comments.get(i, '')
+            ))
+        if self.focus_index is not None and start <= self.focus_index < end:
+            self.select_table_row(self.focus_index)
+        if end < len(self.timestamps):
+            self.table_fill_job = self.igraph.after(1, self.fill_table, end)
+        else:
+            self.table_fill_job = None
+
     def init_plot(self):
-        self.line1, = self.ax.plot(self.timestamps, self.temperatures, c='blue', label="Temp 1", marker='o', linestyle='-', picker=5, markersize=4)
-        self.line2, = self.ax.plot(self.timestamps, self.temperatures2, c='red', label="Temp 2", marker='o', linestyle='-', picker=5, markersize=4)
-        self.line3, = self.ax.plot(self.timestamps, self.temperatures3, c='green', label="Temp 3", marker='o', linestyle='-', picker=5, markersize=4)
+        # Point markers only while individual points can be told apart, they dominate drawing time for long ranges
+        marker = 'o' if len(self.timestamps) <= self.MARKER_LIMIT else None
+        self.lines = [self.ax.plot(self.timestamps, self.temperatures[:, column], c=CHANNEL_COLORS[column % len(CHANNEL_COLORS)],
+                                   label=channel_label(name), marker=marker, linestyle='-', picker=5, markersize=4)[0]
+                      for column, name in enumerate(self.names)]
         self.line_avg, = self.ax.plot(self.timestamps, self.avg_temp, c='purple', label="Avg Temp", linestyle='--', linewidth=2)
 
         self.ax.set_xlabel("Time")
         self.ax.set_ylabel("Temperature")
-        self.ax.set_title(f"Temperature Plot {self.start_time} to {self.end_time}")
+        self.set_title()
         self.ax.legend()
 
         # Set y-range to temp_range
@@ -212,15 +283,21 @@ class InteractiveTemperaturePlot:
         
         plt.gcf().autofmt_xdate()  # Auto-rotate date labels for readability
 
-        # Initialize comment annotations (hidden by default)
-        self.comment_annotations = []
+        # Initialize comment annotations (hidden by default), {row index: annotation}, and span shading
+        self.comment_annotations = {}
+        self.span_artists = []
+
+        # Create scatter plots for selected points (initially empty), one per channel
+        self.selected_scatters = [self.ax.scatter([], [], c='yellow', s=100, zorder=5, label=f"Selected {channel_label(name)}")
+                                  for name in self.names]
 
-        # Create scatter plots for selected points (initially empty)
-        self.selected_scatter1 = self.ax.scatter([], [], c='yellow', s=100, zorder=5, label="Selected Temp1")
-        self.selected_scatter2 = self.ax.scatter([], [], c='yellow', s=100, zorder=5, label="Selected Temp2")
-        self.selected_scatter3 = self.ax.scatter([], [], c='yellow', s=100, zorder=5, label="Selected Temp3")
 
 
+    def set_title(self):
+        if self.resolution:
+            self.ax.set_title(f"Temperature Plot {self.start_time} to {self.end_time} (per {self.resolution} means)")
+        else:
+            self.ax.set_title(f"Temperature Plot {self.start_time} to {self.end_time}")
 
     def init_pick_event(self):
         self.fig.canvas.mpl_connect('pick_event', self.onpick)
@@ -235,9 +312,8 @@ class InteractiveTemperaturePlot:
     def highlight_graph_point(self, index):
         """Highlight only the selected points for a specific timestamp."""
         # Update scatter plots for selected points
-        self.selected_scatter1.set_offsets(np.array([[self.timestamps[index], self.temperatures[index]]]))
-        self.selected_scatter2.set_offsets(np.array([[self.timestamps[index], self.temperatures2[index]]]))
-        self.selected_scatter3.set_offsets(np.array([[self.timestamps[index], self.temperatures3[index]]]))
+        for scatter, temp in zip(self.selected_scatters, self.temperatures[index]):
+            scatter.set_offsets(np.array([[self.xdata[index], temp]]))
 
         # Update the canvas to show the changes
         self.canvas.draw_idle()
@@ -259,63 +335,59 @@ class InteractiveTemperaturePlot:
                 # Highlight the selected point in the graph
                 self.highlight_graph_point(i)
 
-                # Get the timestamp of the selected point
-                selected_timestamp = self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S')
-
-                # Find the corresponding row in the table
-                for item in self.data_table.get_children():
-                    item_values = self.data_table.item(item)['values']
-                    if item_values[0] == selected_timestamp:
-                        # Select the corresponding row
-                        self.data_table.selection_set(item)
-                        self.data_table.focus(item)
-                        # Scroll to the selected row
-                        self.data_table.yview_moveto(self.data_table.index(item) / len(self.data_table.get_children()))
-                        break
+                # The table row of point i has item id i (it may still be loading)
+                self.select_table_row(i)
 
                 # Update the annotation
                 self.annotation.xy = (x, y)
-                text = f"Time: {selected_timestamp}\n"
-                text += f"Temp 1: {self.temperatures[i]:.2f}\n"
-                text += f"Temp 2: {self.temperatures2[i]:.2f}\n"
-                text += f"Temp 3: {self.temperatures3[i]:.2f}\n"
-                text += f"Avg Temp: {self.avg_temp[i]:.2f}\n"
-                if self.comments[i]:
-                    text += f"Comment: {self.comments[i]}"
-                self.annotation.set_text(text)
+                self.annotation.set_text(self.point_text(i))
                 self.annotation.set_visible(True)
                 self.fig.canvas.draw_idle()
 
 
+    def point_text(self, i):
+        # Annotation text of sample i: time, every channel, average and comment
+        text = f"Time: {self.time_text(i)}\n"
+        for name, temp in zip(self.names, self.temperatures[i]):
+            text += f"{channel_label(name)}: {temp:.2f}\n"
+        text += f"Avg Temp: {self.avg_temp[i]:.2f}\n"
+        if i in self.comments:
+            text += f"Comment: {self.comments[i]}"
+        return text
+
+    def select_table_row(self, i):
+        if self.data_table.exists(str(i)):
+            self.data_table.selection_set(str(i))
+            self.data_table.focus(str(i))
+            self.data_table.see(str(i))
+
+    def focus_sample(self, sample_id):
+        # Select and highlight one sample by id, with the comments shown; the table row is
+        # selected by fill_table if it is not loaded yet
+        matches = np.flatnonzero(self.ids == sample_id)
+        if not len(matches):
+            return
+        self.focus_index = int(matches[0])
+        self.highlight_graph_point(self.focus_index)
+        self.select_table_row(self.focus_index)
+        self.show_comments_var.set(True)
+        self.toggle_comments()
+
     def on_table_select(self, event):
         selected_item = self.data_table.selection()
         if selected_item:
-            item = self.data_table.item(selected_item)
-            timestamp_str = item['values'][0]
-            timestamp = datetime.strptime(timestamp_str, '%Y-%m-%d %H:%M:%S')
-            index = self.timestamps.index(timestamp)
-            self.highlight_graph_point(index)
+            self.highlight_graph_point(int(selected_item[0]))
 
     # Setting up on hover
     def on_hover(self, event):
         if event.inaxes == self.ax:
-            for line, temps in [(self.line1, self.temperatures),
-                                (self.line2, self.temperatures2),
-                                (self.line3, self.temperatures3),
-                                (self.line_avg, self.avg_temp)]:
+            for line in self.lines + [self.line_avg]:
                 cont, ind = line.contains(event)
                 if cont:
                     i = ind["ind"][0]  # Get the index of the nearest point
-                    x, y = self.timestamps[i], temps[i]
+                    x, y = self.xdata[i], line.get_ydata()[i]
                     self.annotation.xy = (x, y)
-                    text = f"Time: {self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S')}\n"
-                    text += f"Temp 1: {self.temperatures[i]:.2f}\n"
-                    text += f"Temp 2: {self.temperatures2[i]:.2f}\n"
-                    text += f"Temp 3: {self.temperatures3[i]:.2f}\n"
-                    text += f"Avg Temp: {self.avg_temp[i]:.2f}\n"
-                    if self.comments[i]:
-                        text += f"Comment: {self.comments[i]}"
-                    self.annotation.set_text(text)
+                    self.annotation.set_text(self.point_text(i))
                     self.annotation.set_visible(True)
                     self.fig.canvas.draw_idle()
                     return
@@ -330,73 +402,25 @@ class InteractiveTemperaturePlot:
     def on_background_click(self, event):
         if event.inaxes == self.ax:
             # Check if the click is not on any of the lines
-            if not any(line.contains(event)[0] for line in [self.line1, self.line2, self.line3, self.line_avg]):
+            if not any(line.contains(event)[0] for line in self.lines + [self.line_avg]):
                 self.clear_selections()
                 # Clear table selection
                 self.data_table.selection_remove(self.data_table.selection())
-    def clear_selections(self):
-        """Clear all selected points on the graph."""
-        self.selected_scatter1.set_offsets(np.empty((0, 2)))
-        self.selected_scatter2.set_offsets(np.empty((0, 2)))
-        self.selected_scatter3.set_offsets(np.empty((0, 2)))
-        self.selected_scatter_avg.set_offsets(np.empty((0, 2)))
-        self.annotation.set_visible(False)
-        self.canvas.draw_idle()
-                
+
     def find_nearest_point(self, x, y, line):
-        xdata = mdates.date2num(self.timestamps)
+        xdata = self.xdata
         ydata = line.get_ydata()
         distances = np.sqrt((xdata - x)**2 + (ydata - y)**2)
         return np.argmin(distances)
     
     def clear_selections(self):
         """Clear all selected points on the graph."""
-        self.selected_scatter1.set_offsets(np.empty((0, 2)))
-        self.selected_scatter2.set_offsets(np.empty((0, 2)))
-        self.selected_scatter3.set_offsets(np.empty((0, 2)))
+        for scatter in self.selected_scatters:
+            scatter.set_offsets(np.empty((0, 2)))
         self.annotation.set_visible(False)
         self.canvas.draw_idle()
     
     
-    def refresh_data(self):
-        # Re-fetch data and update plot and table
-        self.dataset = db_functions.fetch_filtered_data(self.db_path, self.table_name, self.start_time, self.end_time)
-        self.timestamps = [datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S') for row in self.dataset]
-        self.temperatures = [row[2] for row in self.dataset]
-        self.temperatures2 = [row[3] for row in self.dataset]
-        self.temperatures3 = [row[4] for row in self.dataset]
-        self.avg_temperatures = [row[5] for row in self.dataset]  # Assuming avg_temp is the 6th column
-        self.comments = [row[6] if len(row) > 6 else '' for row in self.dataset]
-
-        # Clear and repopulate the table
-        for item in self.data_table.get_children():
-            self.data_table.delete(item)
-        for i in range(len(self.timestamps)):
-            self.data_table.insert('', 'end', values=(
-                self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S'),
-                f'{self.temperatures[i]:.2f}',
-                f'{self.temperatures2[i]:.2f}', 
-                f'{self.temperatures3[i]:.2f}',
-                f'{self.avg_temperatures[i]:.2f}',
-                self.comments[i]
-            ))
-
-        # Redraw the plot
-        self.ax.clear()
-        self.init_plot()
-        
-        self.ax.set_ylim(self.temp_range)
-
-        # Recreate the annotation object
-        self.init_annotation()
-
-        # Disconnect previous events
-        if hasattr(self, 'hover_connection'):
-            self.fig.canvas.mpl_disconnect(self.hover_connection)
-
-        # Reconnect hover event
-        self.init_hover_event()
-    
     # Comment checkbox logic
     def toggle_comments(self):
         show_comments = self.show_comments_var.get()
@@ -407,9 +431,8 @@ class InteractiveTemperaturePlot:
         self.fig.canvas.draw_idle()
         
     def toggle_temp_lines(self):
-        self.line1.set_visible(self.temp1_var.get())
-        self.line2.set_visible(self.temp2_var.get())
-        self.line3.set_visible(self.temp3_var.get())
+        for line, variable in zip(self.lines, self.channel_vars):
+            line.set_visible(variable.get())
         self.line_avg.set_visible(self.avg_temp_var.get())
         self.canvas.draw_idle()
 
@@ -417,92 +440,158 @@ class InteractiveTemperaturePlot:
     def display_comments(self):
         print("Displaying comments...")  # Debug print
         self.remove_comments()  # Clear existing annotations
-        for i, (timestamp, temp1, temp2, temp3, comment) in enumerate(zip(self.timestamps, self.temperatures, self.temperatures2, self.temperatures3, self.comments)):
-            if comment:
-                print(f"Adding comment: {comment} at time {timestamp}")  # Debug print
-                # Find the highest temperature for this timestamp
-                max_temp = max(temp1, temp2, temp3)
-                ann = self.ax.annotate(
-                    comment,
-                    (timestamp, max_temp),
-                    xytext=(10, 10),
-                    textcoords='offset points',
-                    fontsize=8,
-                    color='black',
-                    bbox=dict(boxstyle='round,pad=0.5', facecolor='white', edgecolor='purple', alpha=0.7),
-                    arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=0', color='purple', alpha=0.7)
-                )
-                self.comment_annotations.append(ann)
+        for i in sorted(self.comments):
+            self.add_comment_annotation(i)
+        for span in self.spans:
+            self.add_span_annotation(span)
         print(f"Total comments added: {len(self.comment_annotations)}")  # Debug print
 
+    def add_comment_annotation(self, i):
+        comment = self.comments.get(i)
+        if not comment:
+            return
+        print(f"Adding comment: {comment} at time {self.time_text(i)}")  # Debug print
+        # Find the highest temperature for this timestamp
+        max_temp = np.nanmax(self.temperatures[i]) if not np.isnan(self.temperatures[i]).all() else self.temp_range[1]
+        self.comment_annotations[i] = self.ax.annotate(
+            comment,
+            (self.xdata[i], max_temp),
+            xytext=(10, 10),
+            textcoords='offset points',
+            fontsize=8,
+            color='black',
+            bbox=dict(boxstyle='round,pad=0.5', facecolor='white', edgecolor='purple', alpha=0.7),
+            arrowprops=dict(arrowstyle='->', connectionstyle='arc3,rad=0', color='purple', alpha=0.7)
+        )
+
+    def add_span_annotation(self, span):
+        _, start_ts, end_ts, text = span
+        start, end = mdates.date2num(db_functions.local_datetime64([start_ts, end_ts]))
+        shade = self.ax.axvspan(start, end, color='orange', alpha=0.15)
+        label = self.ax.annotate(text, (start, 1), xycoords=('data', 'axes fraction'), xytext=(3, -3),
+                                 textcoords='offset points', va='top', fontsize=8, color='darkorange')
+        self.span_artists += [shade, label]
+
+    def remove_comment_annotation(self, i):
+        ann = self.comment_annotations.pop(i, None)
+        if ann is not None:
+            ann.remove()
+
     def remove_comments(self):
         if hasattr(self, 'comment_annotations'):
-            for ann in self.comment_annotations:
+            for ann in self.comment_annotations.values():
                 ann.remove()
-            self.comment_annotations = []
+            self.comment_annotations = {}
+        for artist in getattr(self, 'span_artists', []):
+            artist.remove()
+        self.span_artists = []
 
 
     def update_comment(self):
+        if self.resolution:
+            tk.messagebox.showinfo("Update Comment", f"Rows are {self.resolution} means, select a shorter range to comment on single samples.")
+            return
         selected_item = self.data_table.selection()
         if selected_item:
-            item = self.data_table.item(selected_item)
-            timestamp = item['values'][0]
-            comment = item['values'][5]
+            index = int(selected_item[0])
+            comment = self.comments.get(index, '')
             new_comment = tk.simpledialog.askstring("Update Comment", "Enter new comment:", initialvalue=comment)
             if new_comment is not None:
-                db_functions.add_comment(self.db_path, self.table_name, timestamp, new_comment)
-
-                # Refresh data and reinitialize plot
-                self.refresh_data()
-
-    def refresh_data(self):
-        # Re-fetch data and update plot and table
-        self.dataset = db_functions.fetch_filtered_data(self.db_path, self.table_name, self.start_time, self.end_time)
-        self.timestamps = [datetime.strptime(row[1], '%Y-%m-%d %H:%M:%S') for row in self.dataset]
-        self.temperatures = [float(row[2]) for row in self.dataset]
-        self.temperatures2 = [float(row[3]) for row in self.dataset]
-        self.temperatures3 = [float(row[4]) for row in self.dataset]
-        self.avg_temperatures = [float(row[5]) for row in self.dataset]  # Assuming avg_temp is the 6th column
-        self.comments = [row[6] if len(row) > 6 else '' for row in self.dataset]
-    
-        # Clear and repopulate the table
-        for item in self.data_table.get_children():
-            self.data_table.delete(item)
-        for i in range(len(self.timestamps)):
-            self.data_table.insert('', 'end', values=(
-                self.timestamps[i].strftime('%Y-%m-%d %H:%M:%S'),
-                f'{self.temperatures[i]:.2f}',
-                f'{self.temperatures2[i]:.2f}', 
-                f'{self.temperatures3[i]:.2f}',
-                self.comments[i]
-            ))
-        
-        # Redraw the plot
-        self.ax.clear()
-        self.init_plot()
-        
-    
-        # Recreate the annotation object
-        self.init_annotation()
-    
-        # Disconnect previous events
-        if hasattr(self, 'hover_connection'):
-            self.fig.canvas.mpl_disconnect(self.hover_connection)
-    
-        # Reconnect the hover and pick events
-        self.init_pick_event()
-        self.hover_connection = self.fig.canvas.mpl_connect('motion_notify_event', self.on_hover)
-    
-        # Redraw the canvas
-        self.canvas.draw()
-    
-        print("Data refreshed and hover event reconnected")  # Debug print
-        
-        # Restore visibility state
-        self.toggle_temp_lines()
-        
-        
+                if db_functions.add_comment(self.db_path, self.table_name, int(self.ids[index]), new_comment):
+                    self.apply_comment(index, new_comment)
+
+    def apply_comment(self, index, comment):
+        # Only the edited row changes: comments dict, table cell and its annotation, no re-query
+        if comment:
+            self.comments[index] = comment
+        else:
+            self.comments.pop(index, None)
+        if self.data_table.exists(str(index)):
+            self.data_table.set(str(index), 'Comment', comment)
+        if self.show_comments_var.get():
+            self.remove_comment_annotation(index)
+            self.add_comment_annotation(index)
+        self.canvas.draw_idle()
+
+    def annotate_range(self):
+        start_time, end_time = self.visible_range()
+        text = tk.simpledialog.askstring("Annotate Range", f"Comment for {start_time} to {end_time}:", parent=self.igraph)
+        if not text:
+            return
+        comment_id = db_functions.add_span_comment(self.db_path, self.table_name, start_time, end_time, text)
+        if comment_id is None:
+            return
+        span = (comment_id, db_functions.to_epoch(start_time), db_functions.to_epoch(end_time), text)
+        self.spans.append(span)
+        if self.show_comments_var.get():
+            self.add_span_annotation(span)
+            self.canvas.draw_idle()
+        else:
+            self.show_comments_var.set(True)
+            self.toggle_comments()
+
+    # Follow live data
+    def toggle_follow(self):
+        if self.follow_var.get():
+            self.follow_live()
+        elif self.follow_job is not None:
+            self.igraph.after_cancel(self.follow_job)
+            self.follow_job = None
+
+    def follow_live(self):
+        self.follow_job = None
+        if not self.follow_var.get() or not self.igraph.winfo_exists():
+            return
+        new = db_functions.fetch_columns_after_id(self.db_path, self.table_name, self.last_id, self.start_time, self.names)
+        if len(new.id):
+            self.append_dataset(new)
+        self.follow_job = self.igraph.after(self.config.get("render_interval"), self.follow_live)
+
+    def append_dataset(self, new):
+        """Append rows from db_functions.fetch_columns_after_id (same channels) to the arrays, lines and table."""
+        old_count = len(self.timestamps)
+        old_last_x = self.xdata[-1] if old_count else None
+
+        self.ids = np.concatenate((self.ids, new.id))
+        self.timestamps = np.concatenate((self.timestamps, new.time))
+        self.temperatures = np.concatenate((self.temperatures, new.temps))
+        self.avg_temp = np.concatenate((self.avg_temp, new.avg))
+        self.xdata = np.concatenate((self.xdata, mdates.date2num(new.time)))
+        for i, comment in new.comments.items():
+            self.comments[old_count + i] = comment
+        self.last_id = int(new.id.max())
+        if self.id_range is not None:
+            self.id_range = (self.id_range[0], self.last_id)
+        self.end_time = max(self.end_time, new.time.max().item())
+
+        for column, line in enumerate(self.lines):
+            line.set_data(self.xdata, self.temperatures[:, column])
+        self.line_avg.set_data(self.xdata, self.avg_temp)
+        if len(self.timestamps) > self.MARKER_LIMIT:
+            for line in self.lines:
+                line.set_marker('None')
+        if self.show_comments_var.get():
+            for i in new.comments:
+                self.add_comment_annotation(old_count + i)
+        self.set_title()
+
+        # Keep the newest sample in view if it was in view, leave the x range alone after zooming/panning back
+        left, right = self.ax.get_xlim()
+        if old_last_x is None:
+            self.ax.relim()
+            self.ax.autoscale_view(scaley=False)
+        elif right >= old_last_x:
+            self.ax.set_xlim(left, right + self.xdata[-1] - old_last_x)
+        self.canvas.draw_idle()
+
+        # The table only needs the new rows; a fill still in progress picks them up by itself
+        if self.table_fill_job is None:
+            self.fill_table(old_count)
+
     def close_window(self):
+        if self.follow_job is not None:
+            self.igraph.after_cancel(self.follow_job)
+            self.follow_job = None
         self.igraph.destroy()
 
     # Button functions
@@ -511,7 +600,14 @@ class InteractiveTemperaturePlot:
         
         default_path = self.config.get("export_path")
         
-        db_functions.records_by_time_csv(self.db_path, self.table_name, self.start_time, self.end_time, default_path)
+        # Export what the plot currently shows, i.e. the zoomed/panned part of the range
+        start_time, end_time = self.visible_range()
+        export_jobs.export_in_background(self.igraph, self.db_path, self.table_name, default_path, start_time, end_time)
+
+    def visible_range(self):
+        # Current x limits of the plot, clamped to the range the window was opened with
+        left, right = (mdates.num2date(x).replace(tzinfo=None) for x in self.ax.get_xlim())
+        return max(self.start_time, left).replace(microsecond=0), min(self.end_time, right).replace(microsecond=0)
 
         
     
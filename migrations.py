@@ -0,0 +1,404 @@
+import argparse
+import os
+import threading
+import time
+import db_functions
+import binary_store
+import comments
+import db_manager
+import query_cache
+import readings
+import rollups
+import shards
+
+# Online data migrations. Each one works through the table in small id or time ranges, every chunk in
+# its own short write transaction, so the recorder (which shares the writer lock) is never
+# held up for more than one chunk and a migration can be interrupted and resumed at any time.
+
+MIGRATION_CHUNK_SIZE = 5000
+MIGRATION_PAUSE = 0.05  # seconds between chunks, leaves the writer lock free for recorded samples
+ROLLUP_CHUNK_SECONDS = 86400  # one day of raw samples per rollup rebuild transaction
+SHARD_CHUNK_SECONDS = 3600  # one hour of samples per transaction when moving a period to its shard
+SHARD_GRACE_SECONDS = 86400  # a period is moved this long after it ended, so late spool drains still land in it
+SHARD_CHECK_INTERVAL = 3600  # seconds between checks for periods to move, see start_shard_rotation
+
+
+def timestamps_pending(database_name: str, table_name: str):
+    return not db_functions.table_layout(database_name, table_name)["ts_complete"]
+
+
+def migrate_timestamps(database_name: str, table_name: str, chunk_size=MIGRATION_CHUNK_SIZE,
+                       pause=MIGRATION_PAUSE, stop_event=None, verbose=True):
+    """
+    Fill the integer ts column of a table created before epoch timestamps from its text
+    data column. Rows recorded while this runs already carry ts. Once every row has a value
+    the table is marked complete, queries switch to ts and the old text index is dropped.
+    Returns the number of rows converted, or None if stop_event interrupted the migration.
+    """
+    db_functions.migrate_db(database_name, table_name)
+    if not timestamps_pending(database_name, table_name):
+        return 0
+
+    with db_manager.reader(database_name) as conn:
+        first_id, last_id = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table_name} WHERE ts IS NULL").fetchone()
+
+    converted = 0
+    if first_id is not None:
+        started = time.perf_counter()
+        for chunk_start in range(first_id, last_id + 1, chunk_size):
+            if stop_event is not None and stop_event.is_set():
+                print(f"Timestamp migration of {table_name} interrupted after {converted} rows, it resumes on the next start")
+                return None
+            # The text is local wall-clock time, ts is UTC.
+            # Unparseable text becomes 0 (1970-01-01) so the row is not left behind forever
+            query = f"""
+            UPDATE {table_name}
+            SET ts = COALESCE(CAST(strftime('%s', data, 'utc') AS INTEGER), 0)
+            WHERE id BETWEEN ? AND ? AND ts IS NULL
+            """
+            with db_manager.writer(database_name) as conn:
+                converted += conn.execute(query, (chunk_start, chunk_start + chunk_size - 1)).rowcount
+            if verbose:
+                print(f"Timestamp migration of {table_name}: {converted} rows converted, up to id {min(chunk_start + chunk_size - 1, last_id)} of {last_id}")
+            time.sleep(pause)
+        if verbose:
+            print(f"Converted {converted} timestamps in {time.perf_counter() - started:.1f} s")
+
+    with db_manager.writer(database_name) as conn:
+        remaining = conn.execute(f"SELECT COUNT(*) FROM {table_name} WHERE ts IS NULL").fetchone()[0]
+        if remaining:
+            # Only rows inserted by something that bypasses insert_data_to_db, pick them up next time
+            print(f"{remaining} rows still without ts, the migration will run again on the next start")
+            return converted
+        conn.execute(f"DROP INDEX IF EXISTS idx_{table_name}_data")
+        conn.execute("INSERT OR REPLACE INTO schema_meta (name, value) VALUES (?, '1')", (f"{table_name}.ts_complete",))
+    db_functions.forget_layout(database_name, table_name)
+    db_functions.check_query_plans(database_name, table_name)
+    return converted
+
+
+def rebuild_rollups(database_name: str, table_name: str, chunk_seconds=ROLLUP_CHUNK_SECONDS,
+                    pause=MIGRATION_PAUSE, stop_event=None, verbose=True):
+    """
+    Recompute the minute/hour/day rollups of all existing rows, one chunk_seconds slice per
+    transaction. Needs the readings table filled (run backfill_readings first). New samples keep
+    their buckets up to date themselves, so this is only needed once per old database.
+    Returns the number of slices processed, or None if stop_event interrupted the rebuild.
+    """
+    db_functions.migrate_db(database_name, table_name)
+    layout = db_functions.table_layout(database_name, table_name)
+    if not layout["readings_built"]:
+        print(f"Readings of {table_name} are not copied yet, cannot build rollups")
+        return 0
+
+    with db_manager.reader(database_name) as conn:
+        first_ts, last_ts = conn.execute(f"SELECT (SELECT MIN(ts) FROM {table_name}), (SELECT MAX(ts) FROM {table_name})").fetchone()
+
+    slices = 0
+    if first_ts is not None:
+        started = time.perf_counter()
+        # Slices start on day boundaries, so no bucket is split between two transactions
+        first_slice = first_ts // ROLLUP_CHUNK_SECONDS * ROLLUP_CHUNK_SECONDS
+        for slice_start in range(first_slice, last_ts + 1, chunk_seconds):
+            if stop_event is not None and stop_event.is_set():
+                print(f"Rollup rebuild of {table_name} interrupted, it restarts on the next start")
+                return None
+            with db_manager.writer(database_name) as conn:
+                rollups.refresh_rollups(conn, table_name, slice_start, slice_start + chunk_seconds - 1,
+                                        raw_from=layout["raw_from"], rollups_from=layout["rollups_from"])
+            slices += 1
+            if verbose:
+                print(f"Rollup rebuild of {table_name}: up to {db_functions.epoch_to_text(min(slice_start + chunk_seconds - 1, last_ts))}")
+            time.sleep(pause)
+        if verbose:
+            print(f"Rebuilt rollups of {table_name} in {time.perf_counter() - started:.1f} s")
+
+    db_functions.set_meta(database_name, f"{table_name}.rollups_built", 1)
+    db_functions.forget_layout(database_name, table_name)
+    query_cache.invalidate(database_name, table_name)
+    return slices
+
+
+def move_comments(database_name: str, table_name: str, chunk_size=MIGRATION_CHUNK_SIZE,
+                  pause=MIGRATION_PAUSE, stop_event=None, verbose=True):
+    """
+    Copy the comments of a table created before the comments table out of its comment column,
+    one id range per transaction. Comments already set through add_comment are kept. The old
+    column is left as it is (dropping it would rewrite the whole table) and no longer read.
+    Needs complete ts values. Returns the number of comments moved, or None if interrupted.
+    """
+    db_functions.migrate_db(database_name, table_name)
+    if db_functions.table_layout(database_name, table_name)["comments_moved"]:
+        return 0
+    if not db_functions.table_layout(database_name, table_name)["ts_complete"]:
+        print(f"Timestamps of {table_name} are not migrated yet, cannot move comments")
+        return 0
+
+    with db_manager.reader(database_name) as conn:
+        first_id, last_id = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table_name}").fetchone()
+
+    moved = 0
+    query = f"""
+    INSERT OR IGNORE INTO {comments.comment_table(table_name)} (sample_id, start_ts, end_ts, text)
+    SELECT id, ts, ts, comment FROM {table_name}
+    WHERE id BETWEEN ? AND ? AND comment IS NOT NULL AND comment <> ''
+    """
+    if first_id is not None:
+        for chunk_start in range(first_id, last_id + 1, chunk_size):
+            if stop_event is not None and stop_event.is_set():
+                print(f"Moving comments of {table_name} interrupted after {moved} comments, it resumes on the next start")
+                return None
+            with db_manager.writer(database_name) as conn:
+                moved += conn.execute(query, (chunk_start, chunk_start + chunk_size - 1)).rowcount
+            time.sleep(pause)
+    if verbose:
+        print(f"Moved {moved} comments of {table_name} into {comments.comment_table(table_name)}")
+
+    db_functions.set_meta(database_name, f"{table_name}.comments_moved", 1)
+    db_functions.forget_layout(database_name, table_name)
+    query_cache.invalidate(database_name, table_name)
+    return moved
+
+
+def backfill_readings(database_name: str, table_name: str, chunk_size=MIGRATION_CHUNK_SIZE,
+                      pause=MIGRATION_PAUSE, stop_event=None, verbose=True):
+    """
+    Copy T1-T3 of a table recorded before the narrow readings table into it, one id range
+    per transaction. Samples recorded since are already there and are left alone. Afterwards
+    every read uses the readings and new samples no longer fill T1-T3 (the columns stay, dropping
+    them would rewrite the whole table). Needs complete ts values. Returns the number of
+    readings copied, or None if interrupted.
+    """
+    db_functions.migrate_db(database_name, table_name)
+    if db_functions.table_layout(database_name, table_name)["readings_built"]:
+        return 0
+    if not db_functions.table_layout(database_name, table_name)["ts_complete"]:
+        print(f"Timestamps of {table_name} are not migrated yet, cannot copy readings")
+        return 0
+
+    with db_manager.writer(database_name) as conn:
+        ids = readings.sensor_ids(conn, table_name, readings.LEGACY_CHANNELS)
+        first_id, last_id = conn.execute(f"SELECT MIN(id), MAX(id) FROM {table_name}").fetchone()
+
+    copied = 0
+    if first_id is not None:
+        started = time.perf_counter()
+        for chunk_start in range(first_id, last_id + 1, chunk_size):
+            if stop_event is not None and stop_event.is_set():
+                print(f"Copying readings of {table_name} interrupted after {copied} readings, it resumes on the next start")
+                return None
+            with db_manager.writer(database_name) as conn:
+                for sensor in readings.LEGACY_CHANNELS:
+                    copied += conn.execute(f"""
+                    INSERT OR IGNORE INTO {readings.readings_table(table_name)} (sensor_id, ts, sample_id, value)
+                    SELECT ?, ts, id, {sensor} FROM {table_name}
+                    WHERE id BETWEEN ? AND ? AND {sensor} IS NOT NULL
+                    """, (ids[sensor], chunk_start, chunk_start + chunk_size - 1)).rowcount
+            if verbose and (chunk_start - first_id) // chunk_size % 20 == 0:
+                print(f"Copying readings of {table_name}: up to id {min(chunk_start + chunk_size - 1, last_id)} of {last_id}")
+            time.sleep(pause)
+        if verbose:
+            print(f"Copied {copied} readings of {table_name} in {time.perf_counter() - started:.1f} s")
+
+    db_functions.set_meta(database_name, f"{table_name}.readings_built", 1)
+    db_functions.forget_layout(database_name, table_name)
+    return copied
+
+
+def pending_migrations(database_name: str, table_name: str):
+    layout = db_functions.table_layout(database_name, table_name)
+    return not all(layout[name] for name in ("ts_complete", "rollups_built", "comments_moved", "readings_built"))
+
+
+def run_migrations(database_name: str, table_name: str, stop_event=None):
+    if migrate_timestamps(database_name, table_name, stop_event=stop_event) is None:
+        return
+    if not db_functions.table_layout(database_name, table_name)["ts_complete"]:
+        return
+    if not db_functions.table_layout(database_name, table_name)["comments_moved"]:
+        if move_comments(database_name, table_name, stop_event=stop_event) is None:
+            return
+    if not db_functions.table_layout(database_name, table_name)["readings_built"]:
+        if backfill_readings(database_name, table_name, stop_event=stop_event) is None:
+            return
+    # Rollups are computed from the readings
+    if not db_functions.table_layout(database_name, table_name)["rollups_built"]:
+        rebuild_rollups(database_name, table_name, stop_event=stop_event)
+
+
+def rotate_shards(database_name: str, table_name: str, period: str, now: int = None, chunk_seconds=SHARD_CHUNK_SECONDS,
+                  pause=MIGRATION_PAUSE, stop_event=None, verbose=True):
+    """
+    Move every period ("week", "month" or "year", see shards) that ended before now (epoch
+    seconds, default the current time) minus a day out of the live database: its samples
+    and readings are copied to the period's shard file and deleted from the live tables, one
+    chunk_seconds slice at a time, then the shard is sealed. Each slice is copied in one
+    transaction and deleted in a second, so an interruption can leave a slice in both files
+    (never in neither); the next run finishes it. Comments and rollups stay in the live database.
+    The period is fixed by the first rotation of a table. Needs all other migrations done.
+    Returns the number of periods sealed, or None if stop_event interrupted the rotation.
+    """
+    if period not in shards.PERIODS:
+        return 0
+    if pending_migrations(database_name, table_name):
+        print(f"{table_name} is still being migrated, periods are moved to shards afterwards")
+        return 0
+    stored_period = db_functions.get_meta(database_name, f"{table_name}.shard_period")
+    if stored_period is not None and stored_period != period:
+        print(f"{table_name} is sharded by {stored_period}, not {period}; keeping {stored_period}")
+        period = stored_period
+    db_functions.set_meta(database_name, f"{table_name}.shard_period", period)
+
+    if now is None:
+        now = int(time.time())
+    boundary = shards.period_start(now - SHARD_GRACE_SECONDS, period)
+    sealed = 0
+    with db_manager.reader(database_name) as conn:
+        next_ts = conn.execute(f"SELECT MIN(ts) FROM {table_name}").fetchone()[0]
+    while next_ts is not None and next_ts < boundary:
+        start_ts = shards.period_start(next_ts, period)
+        end_ts = shards.period_end(start_ts, period)
+        label = shards.period_label(start_ts, period)
+        done = {shard.period: shard.sealed for shard in shards.list_shards(database_name, table_name)}
+        if done.get(label):
+            # Recorded after the period was sealed: stays in the live database, the router reads it there
+            with db_manager.reader(database_name) as conn:
+                late = conn.execute(f"SELECT COUNT(*) FROM {table_name} WHERE ts >= ? AND ts < ?", (start_ts, end_ts)).fetchone()[0]
+            if verbose:
+                print(f"{late} samples of {label} arrived after its shard was sealed, they stay in {database_name}")
+        else:
+            if move_period(database_name, table_name, label, start_ts, end_ts, chunk_seconds, pause, stop_event, verbose) is None:
+                return None
+            sealed += 1
+        with db_manager.reader(database_name) as conn:
+            next_ts = conn.execute(f"SELECT MIN(ts) FROM {table_name} WHERE ts >= ?", (end_ts,)).fetchone()[0]
+    return sealed
+
+
+def move_period(database_name: str, table_name: str, label: str, start_ts: int, end_ts: int,
+                chunk_seconds=SHARD_CHUNK_SECONDS, pause=MIGRATION_PAUSE, stop_event=None, verbose=True):
+    # One period of rotate_shards: copy, delete, seal. Returns the rows moved, None if interrupted
+    file_name = shards.shard_file(database_name, table_name, label)
+    path = shards.shard_path(database_name, file_name)
+    catalog = shards.catalog_table(table_name)
+    sample_columns = "id, ts"
+    with db_manager.writer(database_name) as conn:
+        conn.execute(f"INSERT OR IGNORE INTO {catalog} (period, file, start_ts, end_ts) VALUES (?, ?, ?, ?)",
+                     (label, file_name, start_ts, end_ts))
+    shards.forget_catalog(database_name, table_name)
+
+    started = time.perf_counter()
+    if os.path.exists(path) and not os.access(path, os.W_OK):
+        # Sealed, but the catalog was not updated before an interruption: finish it again
+        os.chmod(path, 0o644)
+    # Attached to the shared writer connection under an alias the router never uses
+    with db_manager.writer(database_name) as conn:
+        conn.execute("ATTACH DATABASE ? AS moving", (path,))
+    try:
+        with db_manager.writer(database_name) as conn:
+            shards.create_shard_tables(conn, "moving", table_name)
+            # The registry travels along, so a shard file can be read on its own
+            conn.execute(f"INSERT OR REPLACE INTO moving.{readings.sensors_table(table_name)} "
+                         f"SELECT * FROM main.{readings.sensors_table(table_name)}")
+            sensor_ids = [row[0] for row in conn.execute(f"SELECT sensor_id FROM main.{readings.sensors_table(table_name)}")]
+        readings_table = readings.readings_table(table_name)
+        for slice_start in range(start_ts, end_ts, chunk_seconds):
+            if stop_event is not None and stop_event.is_set():
+                print(f"Moving {label} of {table_name} to its shard interrupted, it resumes on the next start")
+                return None
+            bounds = (slice_start, min(slice_start + chunk_seconds, end_ts))
+            with db_manager.writer(database_name) as conn:
+                conn.execute(f"INSERT OR IGNORE INTO moving.{table_name} ({sample_columns}) "
+                             f"SELECT {sample_columns} FROM main.{table_name} WHERE ts >= ? AND ts < ?", bounds)
+                for sensor_id in sensor_ids:
+                    conn.execute(f"INSERT OR IGNORE INTO moving.{readings_table} ({shards.READING_COLUMNS}) "
+                                 f"SELECT {shards.READING_COLUMNS} FROM main.{readings_table} WHERE sensor_id = ? AND ts >= ? AND ts < ?",
+                                 (sensor_id,) + bounds)
+            # Only what the shard has committed is deleted
+            with db_manager.writer(database_name) as conn:
+                conn.execute(f"DELETE FROM main.{table_name} WHERE ts >= ? AND ts < ? "
+                             f"AND id IN (SELECT id FROM moving.{table_name} WHERE ts >= ? AND ts < ?)", bounds + bounds)
+                for sensor_id in sensor_ids:
+                    conn.execute(f"DELETE FROM main.{readings_table} WHERE sensor_id = ? AND ts >= ? AND ts < ? "
+                                 f"AND sample_id IN (SELECT sample_id FROM moving.{readings_table} WHERE sensor_id = ? AND ts >= ? AND ts < ?)",
+                                 (sensor_id,) + bounds + (sensor_id,) + bounds)
+                conn.execute(f"""
+                UPDATE {catalog} SET
+                    first_ts = (SELECT MIN(ts) FROM moving.{table_name}), last_ts = (SELECT MAX(ts) FROM moving.{table_name}),
+                    first_id = (SELECT MIN(id) FROM moving.{table_name}), last_id = (SELECT MAX(id) FROM moving.{table_name})
+                WHERE period = ?""", (label,))
+            shards.forget_catalog(database_name, table_name)
+            time.sleep(pause)
+        with db_manager.writer(database_name) as conn:
+            conn.execute(f"UPDATE {catalog} SET rows = (SELECT COUNT(*) FROM moving.{table_name}) WHERE period = ?", (label,))
+    finally:
+        with db_manager.writer(database_name) as conn:
+            conn.execute("DETACH DATABASE moving")
+
+    shards.seal(path)
+    with db_manager.writer(database_name) as conn:
+        conn.execute(f"UPDATE {catalog} SET sealed = 1 WHERE period = ?", (label,))
+        rows = conn.execute(f"SELECT rows FROM {catalog} WHERE period = ?", (label,)).fetchone()[0]
+    shards.forget_catalog(database_name, table_name)
+    query_cache.invalidate(database_name, table_name)
+    binary_store.discard(database_name, table_name)
+    if verbose:
+        print(f"Moved {rows} samples of {label} to {file_name} and sealed it in {time.perf_counter() - started:.1f} s")
+    return rows
+
+
+def start_shard_rotation(database_name: str, table_name: str, period: str, stop_event=None, interval=SHARD_CHECK_INTERVAL):
+    # Used by the app: move ended periods to shards now and then every interval seconds, in the background
+    if period not in shards.PERIODS:
+        return None
+    stop_event = stop_event or threading.Event()
+
+    def rotate():
+        while not stop_event.is_set():
+            try:
+                if rotate_shards(database_name, table_name, period, stop_event=stop_event) is None:
+                    return
+            except Exception as e:
+                print(f"Moving old periods of {table_name} to shards failed, retrying later: {e}")
+            if stop_event.wait(interval):
+                return
+
+    thread = threading.Thread(target=rotate, name="shard-rotation", daemon=True)
+    thread.start()
+    return thread
+
+
+def start_background_migration(database_name: str, table_name: str, stop_event=None):
+    # Used by the app at startup: nothing to do for new databases, otherwise convert while recording
+    if not pending_migrations(database_name, table_name):
+        return None
+    thread = threading.Thread(target=run_migrations, name="migration", daemon=True,
+                              args=(database_name, table_name), kwargs={"stop_event": stop_event})
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Bring an existing database up to date: epoch timestamps, rollup, comment and readings tables")
+    parser.add_argument("db_path")
+    parser.add_argument("--table", default="temps")
+    parser.add_argument("--chunk-size", type=int, default=MIGRATION_CHUNK_SIZE)
+    parser.add_argument("--pause", type=float, default=MIGRATION_PAUSE)
+    parser.add_argument("--rebuild-rollups", action="store_true", help="recompute the rollups even if they are marked as built")
+    parser.add_argument("--shard-period", choices=shards.PERIODS, help="then move ended periods to their own shard files")
+    args = parser.parse_args()
+
+    try:
+        migrate_timestamps(args.db_path, args.table, args.chunk_size, args.pause)
+        move_comments(args.db_path, args.table, args.chunk_size, args.pause)
+        backfill_readings(args.db_path, args.table, args.chunk_size, args.pause)
+        if args.rebuild_rollups or not db_functions.table_layout(args.db_path, args.table)["rollups_built"]:
+            rebuild_rollups(args.db_path, args.table, pause=args.pause)
+        if args.shard_period:
+            rotate_shards(args.db_path, args.table, args.shard_period, pause=args.pause)
+    finally:
+        db_functions.close_connections()
+
+
+if __name__ == "__main__":
+    main()
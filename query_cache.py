@@ -0,0 +1,94 @@
+import threading
+from collections import OrderedDict, namedtuple
+
+# Least recently used cache of range query results (see db_functions.cached_query).
+#
+# Every entry remembers the highest row id and the comment counter of its table at the time it
+# was fetched. A range that ends before the timestamps of all rows inserted since then is still
+# exact and stays cached, so historical ranges are free to reopen and only ranges reaching into
+# live data are fetched again.
+
+DEFAULT_BUDGET_MB = 64
+
+# value, table max(id) and comment counter when fetched, last timestamp the range covers,
+# whether comments are part of the value, size in bytes
+CacheEntry = namedtuple("CacheEntry", ["value", "max_id", "comment_version", "end_ts", "uses_comments", "nbytes"])
+
+
+class RangeCache:
+    """Thread-safe LRU mapping of query keys to CacheEntry, bounded by the total size of the values."""
+
+    def __init__(self, max_bytes=DEFAULT_BUDGET_MB * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self.entries = OrderedDict()
+        self.bytes = 0
+        self.lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is not None:
+                self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        with self.lock:
+            self.discard_locked(key)
+            if entry.nbytes > self.max_bytes:
+                return  # would evict everything else and still not fit
+            self.entries[key] = entry
+            self.bytes += entry.nbytes
+            while self.bytes > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def discard(self, key):
+        with self.lock:
+            self.discard_locked(key)
+
+    def discard_locked(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.bytes -= entry.nbytes
+
+    def clear(self, prefix=None):
+        # Drop every entry, or those whose key starts with prefix, e.g. (db_path, table_name)
+        with self.lock:
+            for key in [key for key in self.entries if prefix is None or key[:len(prefix)] == prefix]:
+                self.discard_locked(key)
+
+    def resize(self, max_bytes):
+        with self.lock:
+            self.max_bytes = max_bytes
+            while self.bytes > self.max_bytes and self.entries:
+                _, evicted = self.entries.popitem(last=False)
+                self.bytes -= evicted.nbytes
+                self.evictions += 1
+
+    def stats(self):
+        with self.lock:
+            return {"entries": len(self.entries), "bytes": self.bytes, "max_bytes": self.max_bytes,
+                    "hits": self.hits, "misses": self.misses, "evictions": self.evictions}
+
+
+_cache = RangeCache()
+
+
+def get_cache():
+    return _cache
+
+
+def configure(budget_mb=None):
+    # 0 disables caching
+    if budget_mb is not None:
+        _cache.resize(int(float(budget_mb) * 1024 * 1024))
+
+
+def invalidate(db_path, table_name=None):
+    # For changes the watermarks cannot see, e.g. rows deleted or rewritten in bulk
+    _cache.clear((db_path, table_name) if table_name is not None else (db_path,))
@@ -0,0 +1,100 @@
+# Narrow per-sensor storage: one row per (sensor, timestamp) instead of one column per sensor.
+#
+# {table}_sensors is the registry (name such as "T4", the ROM ID of the probe bound to it, a free
+# label), {table}_readings holds (sensor_id, ts, sample_id, value) in a WITHOUT ROWID table
+# clustered by sensor and time, so a range of one sensor is one contiguous b-tree walk and never
+# touches the other sensors' data. sample_id is the id of the sample row the reading belongs to:
+# two samples in the same second (sub-second intervals, clock steps) each keep their readings. Any number of channels fits; missing readings are simply not stored.
+# The samples table holds only id and ts; plots, averages, rollups and exports all read the
+# values from here (see db_functions.load_sample_columns). Tables recorded before this keep
+# their T1-T3 columns, which are read only until migrations.backfill_readings has copied them.
+
+# The channels of the wide table of old databases
+LEGACY_CHANNELS = ("T1", "T2", "T3")
+
+
+def sensors_table(table_name: str):
+    return f"{table_name}_sensors"
+
+
+def readings_table(table_name: str):
+    return f"{table_name}_readings"
+
+
+def channel_name(channel: int):
+    # Channel 1 is T1, like the columns of the wide table and SensorRegistry channels
+    return f"T{channel}"
+
+
+def create_readings_tables(conn, table_name: str):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {sensors_table(table_name)} (
+        sensor_id INTEGER PRIMARY KEY,
+        name TEXT NOT NULL UNIQUE,
+        rom_id TEXT,
+        label TEXT
+    )""")
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {readings_table(table_name)} (
+        sensor_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,
+        sample_id INTEGER NOT NULL,
+        value REAL NOT NULL,
+        PRIMARY KEY (sensor_id, ts, sample_id)
+    ) WITHOUT ROWID""")
+
+
+def keyed_by_sample(conn, table_name: str):
+    # False for a readings table from before sample_id, keyed on (sensor_id, ts) only
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({readings_table(table_name)})")]
+    return not columns or "sample_id" in columns
+
+
+def channels(conn, table_name: str):
+    # Registered sensors as [(sensor_id, name)], in registration (= channel) order
+    return conn.execute(f"SELECT sensor_id, name FROM {sensors_table(table_name)} ORDER BY sensor_id").fetchall()
+
+
+def sensor_ids(conn, table_name: str, names):
+    # {name: sensor_id}, registering names seen for the first time
+    conn.executemany(f"INSERT OR IGNORE INTO {sensors_table(table_name)} (name) VALUES (?)", [(name,) for name in names])
+    placeholders = ", ".join("?" * len(names))
+    return dict(conn.execute(f"SELECT name, sensor_id FROM {sensors_table(table_name)} WHERE name IN ({placeholders})",
+                             list(names)).fetchall())
+
+
+def insert_readings(conn, table_name: str, rows):
+    """
+    Store (sample id, ts, temperatures by channel) rows on the caller's connection, so they
+    commit with their sample rows. None temperatures are skipped. Every sample id is new, so
+    nothing is ever overwritten.
+    """
+    channels = max((len(temps) for _, _, temps in rows), default=0)
+    if not channels:
+        return 0
+    ids = sensor_ids(conn, table_name, [channel_name(channel) for channel in range(1, channels + 1)])
+    values = [(ids[channel_name(channel)], ts, sample_id, value)
+              for sample_id, ts, temps in rows
+              for channel, value in enumerate(temps, start=1) if value is not None]
+    conn.executemany(f"INSERT INTO {readings_table(table_name)} (sensor_id, ts, sample_id, value) VALUES (?, ?, ?, ?)", values)
+    return len(values)
+
+
+def series_query(table_name: str, source: str = None):
+    # One sensor between two epoch values, in time order: a single index range.
+    # source replaces the readings table as FROM item (see shards.source)
+    return f"""
+    SELECT ts, value FROM {source or readings_table(table_name)}
+    WHERE sensor_id = ? AND ts BETWEEN ? AND ?
+    ORDER BY ts
+    """
+
+
+def pivot_query(table_name: str, sensor_count: int, source: str = None):
+    # The readings of some sensors between two epoch values, for placing into per-sample rows:
+    # one index range per sensor. Parameters: the sensor ids, then the two bounds
+    placeholders = ", ".join("?" * sensor_count)
+    return f"""
+    SELECT sensor_id, sample_id, value FROM {source or readings_table(table_name)}
+    WHERE sensor_id IN ({placeholders}) AND ts BETWEEN ? AND ?
+    """
@@ -0,0 +1,340 @@
+import argparse
+import calendar
+import datetime
+import os
+import threading
+import time
+from collections import namedtuple
+import db_functions
+import binary_store
+import comments
+import db_manager
+import migrations
+import query_cache
+import readings
+import rollups
+import shards
+
+# Retention: raw samples are kept for retention_raw_days, minute and hour rollups for
+# retention_rollup_months, day rollups forever. Older data is removed by a background job
+# in small steps, like the migrations: one slice of time per transaction with a pause in
+# between, so the recorder (and its spool drainer) never waits long for the writer lock.
+# Shards whose whole period has aged out are deleted as files. A sealed shard only partly
+# past the cutoff is kept whole until its period has aged out (rewriting the read-only file
+# for a few days of rows is not worth it): plots of its older part already come from the
+# rollups, exports and table views still find the rows until the file goes. plan() lists such
+# shards as "kept" steps. Comments of removed samples are kept as point span comments. Plots
+# of aged-out ranges are drawn from the finest rollup that is still kept
+# (db_functions.fetch_plot_columns).
+#
+# Rollup buckets past a horizon summarise data that is gone. A sample recorded late into such
+# a bucket (a spool replayed after a long outage) is stored, but does not refresh it, see
+# rollups.refresh_rollups; the next run deletes the sample again.
+#
+# Deleted rows leave free pages in the database file. With auto_vacuum=INCREMENTAL (new
+# databases, or after --convert) they are handed back to the file system a few at a time with
+# PRAGMA incremental_vacuum; otherwise SQLite reuses them for new rows.
+
+RETENTION_CHUNK_SECONDS = 3600  # raw samples deleted per transaction
+ROLLUP_CHUNK_SECONDS = 7 * 86400  # rollup buckets deleted per transaction
+VACUUM_STEP_PAGES = 1024  # pages returned per incremental_vacuum transaction, 4 MiB with 4 KiB pages
+RETENTION_CHECK_INTERVAL = 3600  # seconds between runs of the background job
+AGED_ROLLUPS = ("minute", "hour")  # day buckets are kept forever
+
+# One step of a retention run: kind is "shard", "kept" (a partly aged shard, nothing to do),
+# "raw", "rollup" or "vacuum", target the shard period or rollup resolution, bytes the
+# estimated space given back (None if unknown)
+Step = namedtuple("Step", ["kind", "target", "cutoff", "rows", "bytes", "description"])
+
+
+def raw_cutoff(now: int, raw_days):
+    # Raw samples before this (day aligned) epoch second are removed, None keeps them forever
+    if not raw_days:
+        return None
+    return (now - int(raw_days) * 86400) // 86400 * 86400
+
+
+def rollup_cutoff(now: int, rollup_months):
+    # Minute/hour buckets before this are removed: the same day of the month, rollup_months back
+    if not rollup_months:
+        return None
+    date = datetime.date(1970, 1, 1) + datetime.timedelta(days=now // 86400)
+    year, month = divmod(date.year * 12 + date.month - 1 - int(rollup_months), 12)
+    day = min(date.day, calendar.monthrange(year, month + 1)[1])
+    return calendar.timegm((year, month + 1, day, 0, 0, 0))
+
+
+def object_sizes(conn, names):
+    # Bytes used by tables/indexes by name (dbstat), or None if SQLite was built without dbstat
+    placeholders = ", ".join("?" * len(names))
+    try:
+        return conn.execute(f"SELECT COALESCE(SUM(pgsize), 0) FROM dbstat WHERE name IN ({placeholders})", list(names)).fetchone()[0]
+    except Exception:
+        return None
+
+
+def table_objects(conn, table_name: str):
+    # A table and its indexes, as dbstat names them
+    return [row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE tbl_name = ? AND type IN ('table', 'index')",
+                                           (table_name,))]
+
+
+def share_of(size, rows, total):
+    return None if size is None or not total else int(size * rows / total)
+
+
+def plan(database_name: str, table_name: str, raw_days, rollup_months, now: int = None):
+    """
+    The steps a retention run would take, with the rows each one removes and the space it
+    gives back (estimated from the table sizes for partial deletes). Reads only.
+    """
+    if now is None:
+        now = int(time.time())
+    raw_before, rollups_before = raw_cutoff(now, raw_days), rollup_cutoff(now, rollup_months)
+    steps = []
+    if raw_before is not None:
+        for shard in shards.list_shards(database_name, table_name):
+            if shard.sealed and shard.end_ts <= raw_before:
+                steps.append(Step("shard", shard.period, raw_before, shard.rows, os.path.getsize(shard.path),
+                                  f"delete shard {os.path.basename(shard.path)}"))
+            elif shard.sealed and shard.start_ts < raw_before:
+                steps.append(Step("kept", shard.period, raw_before, None, 0,
+                                  f"keep shard {os.path.basename(shard.path)}, partly past the cutoff, until "
+                                  f"{db_functions.epoch_to_text(shard.end_ts + int(raw_days) * 86400)}"))
+    with db_manager.reader(database_name) as conn:
+        if raw_before is not None:
+            samples = conn.execute(f"SELECT COUNT(*) FROM {table_name} WHERE ts < ?", (raw_before,)).fetchone()[0]
+            if samples:
+                total = conn.execute(f"SELECT COUNT(*) FROM {table_name}").fetchone()[0]
+                size = object_sizes(conn, table_objects(conn, table_name))
+                old_readings = all_readings = 0
+                for (sensor_id,) in conn.execute(f"SELECT sensor_id FROM {readings.sensors_table(table_name)}").fetchall():
+                    old_readings += conn.execute(f"SELECT COUNT(*) FROM {readings.readings_table(table_name)} WHERE sensor_id = ? AND ts < ?",
+                                                 (sensor_id, raw_before)).fetchone()[0]
+                    all_readings += conn.execute(f"SELECT COUNT(*) FROM {readings.readings_table(table_name)} WHERE sensor_id = ?",
+                                                 (sensor_id,)).fetchone()[0]
+                readings_size = object_sizes(conn, table_objects(conn, readings.readings_table(table_name)))
+                estimate = share_of(size, samples, total)
+                if estimate is not None and readings_size is not None:
+                    estimate += share_of(readings_size, old_readings, all_readings) or 0
+                steps.append(Step("raw", table_name, raw_before, samples, estimate,
+                                  f"delete raw samples before {db_functions.epoch_to_text(raw_before)}"))
+        if rollups_before is not None:
+            for resolution in AGED_ROLLUPS:
+                target = rollups.rollup_table(table_name, resolution)
+                buckets = conn.execute(f"SELECT COUNT(*) FROM {target} WHERE bucket < ?", (rollups_before,)).fetchone()[0]
+                if buckets:
+                    total = conn.execute(f"SELECT COUNT(*) FROM {target}").fetchone()[0]
+                    steps.append(Step("rollup", resolution, rollups_before, buckets,
+                                      share_of(object_sizes(conn, table_objects(conn, target)), buckets, total),
+                                      f"delete {resolution} rollups before {db_functions.epoch_to_text(rollups_before)}"))
+        incremental = conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+        free = conn.execute("PRAGMA freelist_count").fetchone()[0] * page_size
+    freed = free + sum(step.bytes or 0 for step in steps if step.kind in ("raw", "rollup"))
+    if incremental:
+        steps.append(Step("vacuum", None, None, None, freed, "return free pages to the file system (incremental vacuum)"))
+    elif freed:
+        steps.append(Step("vacuum", None, None, None, 0,
+                          f"{freed / 1e6:.1f} MB of free pages stay in the file for new rows (auto_vacuum is off, see --convert)"))
+    return steps
+
+
+def report(steps):
+    # Dry run output: one line per step and the total
+    lines = []
+    for step in steps:
+        rows = f"{step.rows:>10} rows" if step.rows is not None else " " * 15
+        size = f"{step.bytes / 1e6:8.1f} MB" if step.bytes is not None else "       ? MB"
+        lines.append(f"{rows}  {size}  {step.description}")
+    reclaimed = sum(step.bytes or 0 for step in steps if step.kind in ("shard", "vacuum"))
+    lines.append(f"Space given back to the file system: {reclaimed / 1e6:.1f} MB" if steps else "Nothing to remove")
+    return "\n".join(lines)
+
+
+def drop_shard(database_name: str, table_name: str, period: str):
+    # Remove an aged-out shard from the catalog, keep its sample comments as span comments, delete the file
+    shard = next(shard for shard in shards.list_shards(database_name, table_name) if shard.period == period)
+    with db_manager.writer(database_name) as conn:
+        conn.execute(f"UPDATE {comments.comment_table(table_name)} SET sample_id = NULL "
+                     "WHERE sample_id IS NOT NULL AND start_ts >= ? AND start_ts < ?", (shard.start_ts, shard.end_ts))
+        conn.execute(f"DELETE FROM {shards.catalog_table(table_name)} WHERE period = ?", (period,))
+    shards.forget_catalog(database_name, table_name)
+    try:
+        os.chmod(shard.path, 0o644)
+        os.remove(shard.path)
+    except OSError as e:
+        print(f"Could not delete {shard.path}, it is no longer used and can be deleted by hand: {e}")
+
+
+def delete_raw(database_name: str, table_name: str, cutoff: int, chunk_seconds=RETENTION_CHUNK_SECONDS,
+               pause=migrations.MIGRATION_PAUSE, stop_event=None):
+    # Samples and readings before cutoff, one slice per transaction. Returns False if interrupted
+    db_functions.set_meta(database_name, f"{table_name}.raw_from", cutoff)
+    db_functions.forget_layout(database_name, table_name)
+    with db_manager.reader(database_name) as conn:
+        first_ts = conn.execute(f"SELECT MIN(ts) FROM {table_name}").fetchone()[0]
+        sensor_ids = [row[0] for row in conn.execute(f"SELECT sensor_id FROM {readings.sensors_table(table_name)}")]
+    if first_ts is None:
+        return True
+    for slice_start in range(first_ts // chunk_seconds * chunk_seconds, cutoff, chunk_seconds):
+        if stop_event is not None and stop_event.is_set():
+            return False
+        bounds = (slice_start, min(slice_start + chunk_seconds, cutoff))
+        with db_manager.writer(database_name) as conn:
+            conn.execute(f"UPDATE {comments.comment_table(table_name)} SET sample_id = NULL "
+                         "WHERE sample_id IS NOT NULL AND start_ts >= ? AND start_ts < ?", bounds)
+            for sensor_id in sensor_ids:
+                conn.execute(f"DELETE FROM {readings.readings_table(table_name)} WHERE sensor_id = ? AND ts >= ? AND ts < ?",
+                             (sensor_id,) + bounds)
+            conn.execute(f"DELETE FROM {table_name} WHERE ts >= ? AND ts < ?", bounds)
+        time.sleep(pause)
+    return True
+
+
+def delete_rollups(database_name: str, table_name: str, resolution: str, cutoff: int, chunk_seconds=ROLLUP_CHUNK_SECONDS,
+                   pause=migrations.MIGRATION_PAUSE, stop_event=None):
+    # Buckets of one resolution before cutoff, one slice per transaction. Returns False if interrupted
+    db_functions.set_meta(database_name, f"{table_name}.rollups_from", cutoff)
+    db_functions.forget_layout(database_name, table_name)
+    target = rollups.rollup_table(table_name, resolution)
+    with db_manager.reader(database_name) as conn:
+        first_bucket = conn.execute(f"SELECT MIN(bucket) FROM {target}").fetchone()[0]
+    if first_bucket is None:
+        return True
+    for slice_start in range(first_bucket, cutoff, chunk_seconds):
+        if stop_event is not None and stop_event.is_set():
+            return False
+        with db_manager.writer(database_name) as conn:
+            conn.execute(f"DELETE FROM {target} WHERE bucket >= ? AND bucket < ?", (slice_start, min(slice_start + chunk_seconds, cutoff)))
+        time.sleep(pause)
+    return True
+
+
+def incremental_vacuum(database_name: str, step_pages=VACUUM_STEP_PAGES, pause=migrations.MIGRATION_PAUSE, stop_event=None):
+    # Hand free pages back step_pages at a time; returns the bytes released, None if auto_vacuum is not incremental
+    with db_manager.reader(database_name) as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] != 2:
+            return None
+        page_size = conn.execute("PRAGMA page_size").fetchone()[0]
+    released = 0
+    while stop_event is None or not stop_event.is_set():
+        with db_manager.writer(database_name) as conn:
+            free = conn.execute("PRAGMA freelist_count").fetchone()[0]
+            if not free:
+                break
+            # sqlite3's execute() steps a statement once, which frees a single page; executescript runs it to the end
+            conn.executescript(f"PRAGMA incremental_vacuum({int(step_pages)})")
+            released += (free - conn.execute("PRAGMA freelist_count").fetchone()[0]) * page_size
+        time.sleep(pause)
+    # The file shrinks when the WAL is checkpointed
+    db_functions.checkpoint_db(database_name, "TRUNCATE")
+    return released
+
+
+def apply_retention(database_name: str, table_name: str, raw_days, rollup_months, now: int = None,
+                    pause=migrations.MIGRATION_PAUSE, stop_event=None, verbose=True):
+    """
+    Run every step of plan(). Needs the migrations done (aged-out samples must be in the
+    rollups first). Returns the executed steps, or None if stop_event interrupted the run;
+    the next run picks up where it stopped.
+    """
+    if not raw_days and not rollup_months:
+        return []
+    if migrations.pending_migrations(database_name, table_name):
+        print(f"{table_name} is still being migrated, retention runs afterwards")
+        return []
+    steps = plan(database_name, table_name, raw_days, rollup_months, now)
+    done = []
+    for step in steps:
+        started = time.perf_counter()
+        if step.kind == "shard":
+            drop_shard(database_name, table_name, step.target)
+        elif step.kind == "raw":
+            if not delete_raw(database_name, table_name, step.cutoff, pause=pause, stop_event=stop_event):
+                return None
+        elif step.kind == "rollup":
+            if not delete_rollups(database_name, table_name, step.target, step.cutoff, pause=pause, stop_event=stop_event):
+                return None
+        elif step.kind == "vacuum":
+            if incremental_vacuum(database_name, pause=pause, stop_event=stop_event) is None:
+                continue
+        elif step.kind == "kept":
+            continue
+        if stop_event is not None and stop_event.is_set():
+            return None
+        done.append(step)
+        if verbose:
+            print(f"Retention: {step.description} ({time.perf_counter() - started:.1f} s)")
+        if step.kind in ("shard", "raw", "rollup"):
+            query_cache.invalidate(database_name, table_name)
+        if step.kind == "raw":
+            # The binary store mirrors the live table, which just lost rows
+            binary_store.discard(database_name, table_name)
+    return done
+
+
+def enable_incremental_vacuum(database_name: str):
+    """
+    Switch an existing database to auto_vacuum=INCREMENTAL. That takes one full VACUUM, which
+    rewrites the file and holds the writer lock until done (samples wait in the spool). New
+    databases are created with it (db_manager.PRAGMAS).
+    """
+    with db_manager.writer(database_name) as conn:
+        if conn.execute("PRAGMA auto_vacuum").fetchone()[0] == 2:
+            return False
+        conn.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    with db_manager.writer(database_name) as conn:
+        conn.execute("VACUUM")
+    return True
+
+
+def start_background_retention(database_name: str, table_name: str, raw_days, rollup_months, stop_event=None,
+                               interval=RETENTION_CHECK_INTERVAL):
+    # Used by the app: apply the retention policy now and then every interval seconds
+    if not raw_days and not rollup_months:
+        return None
+    stop_event = stop_event or threading.Event()
+
+    def run():
+        while not stop_event.is_set():
+            try:
+                apply_retention(database_name, table_name, raw_days, rollup_months, stop_event=stop_event)
+            except Exception as e:
+                print(f"Retention run on {table_name} failed, retrying later: {e}")
+            if stop_event.wait(interval):
+                return
+
+    thread = threading.Thread(target=run, name="retention", daemon=True)
+    thread.start()
+    return thread
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply the retention policy, or show what it would remove")
+    parser.add_argument("db_path")
+    parser.add_argument("--table", default="temps")
+    parser.add_argument("--raw-days", type=int, default=0, help="keep raw samples this many days, 0 = forever")
+    parser.add_argument("--rollup-months", type=int, default=0, help="keep minute/hour rollups this many months, 0 = forever")
+    parser.add_argument("--now", help="YYYY-MM-DD HH:MM:SS to compute the cutoffs from, default the current time")
+    parser.add_argument("--dry-run", action="store_true", help="only report the steps and the space they give back")
+    parser.add_argument("--convert", action="store_true", help="first switch the database to incremental vacuum (one full VACUUM)")
+    args = parser.parse_args()
+
+    now = db_functions.to_epoch(args.now) if args.now else None
+    try:
+        if args.convert and not args.dry_run:
+            started = time.perf_counter()
+            if enable_incremental_vacuum(args.db_path):
+                print(f"Switched {args.db_path} to incremental vacuum in {time.perf_counter() - started:.1f} s")
+        print(report(plan(args.db_path, args.table, args.raw_days, args.rollup_months, now)))
+        if not args.dry_run:
+            size = os.path.getsize(args.db_path)
+            apply_retention(args.db_path, args.table, args.raw_days, args.rollup_months, now)
+            print(f"{args.db_path}: {size / 1e6:.1f} MB -> {os.path.getsize(args.db_path) / 1e6:.1f} MB")
+    finally:
+        db_functions.close_connections()
+
+
+if __name__ == "__main__":
+    main()
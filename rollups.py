@@ -0,0 +1,104 @@
+# Pre-aggregated minute/hour/day tables next to the readings table.
+#
+# Every rollup row covers one bucket of time (start in epoch seconds, see db_functions.to_epoch)
+# of one sensor and keeps count, sum, min and max, so means stay exact when buckets are combined.
+# Like the readings, the rows are narrow, (bucket, sensor_id), so any number of sensors fits.
+# Minutes are computed from the readings, hours from minutes and days from hours; refreshing a
+# range recomputes its buckets from the level below, which makes it idempotent and cheap
+# enough to run inside every batch insert.
+import readings
+
+# (name, bucket length in seconds), finest first
+RESOLUTIONS = (("minute", 60), ("hour", 3600), ("day", 86400))
+
+
+def rollup_table(table_name: str, resolution: str):
+    return f"{table_name}_{resolution}"
+
+
+def create_rollup_tables(conn, table_name: str):
+    for resolution, _ in RESOLUTIONS:
+        conn.execute(f"""
+        CREATE TABLE IF NOT EXISTS {rollup_table(table_name, resolution)} (
+            bucket INTEGER NOT NULL,
+            sensor_id INTEGER NOT NULL,
+            readings INTEGER NOT NULL,
+            total REAL,
+            minimum REAL,
+            maximum REAL,
+            PRIMARY KEY (bucket, sensor_id)
+        ) WITHOUT ROWID""")
+
+
+def wide_rollup_tables(conn, table_name: str):
+    # True for rollup tables from before the readings table, with T1-T3 columns per bucket
+    columns = [row[1] for row in conn.execute(f"PRAGMA table_info({rollup_table(table_name, RESOLUTIONS[0][0])})")]
+    return "samples" in columns
+
+
+def drop_rollup_tables(conn, table_name: str):
+    for resolution, _ in RESOLUTIONS:
+        conn.execute(f"DROP TABLE IF EXISTS {rollup_table(table_name, resolution)}")
+
+
+def refresh_rollups(conn, table_name: str, first_ts: int, last_ts: int, raw_source: str = None,
+                    raw_from: int = None, rollups_from: int = None):
+    """
+    Recompute every bucket touching [first_ts, last_ts] at all resolutions. Runs on the
+    caller's connection, so it commits (or rolls back) together with the rows it summarises.
+    raw_source replaces the readings table as the FROM item of the raw values (see shards.source).
+    raw_from/rollups_from are the retention horizons (see db_functions.table_layout): buckets
+    before the horizon of the data they are computed from are left as they are, recomputing
+    them from what is left of it would replace the kept summary by one of a few late samples.
+    """
+    source = raw_source or readings.readings_table(table_name)
+    horizons = (raw_from,) + (rollups_from,) * (len(RESOLUTIONS) - 1)
+    for level, ((resolution, bucket_seconds), horizon) in enumerate(zip(RESOLUTIONS, horizons)):
+        start = first_ts // bucket_seconds * bucket_seconds
+        end = last_ts // bucket_seconds * bucket_seconds + bucket_seconds
+        if horizon is not None:
+            start = max(start, -(-horizon // bucket_seconds) * bucket_seconds)
+        target = rollup_table(table_name, resolution)
+        if level == 0:
+            # From the readings, one index range per sensor
+            time_column = "ts"
+            aggregates = "COUNT(*), SUM(value), MIN(value), MAX(value)"
+            sensors = f"sensor_id IN (SELECT sensor_id FROM {readings.sensors_table(table_name)}) AND "
+        else:
+            # From the next finer rollup
+            time_column = "bucket"
+            aggregates = "SUM(readings), SUM(total), MIN(minimum), MAX(maximum)"
+            sensors = ""
+        conn.execute(f"DELETE FROM {target} WHERE bucket >= ? AND bucket < ?", (start, end))
+        conn.execute(f"""
+        INSERT INTO {target} (bucket, sensor_id, readings, total, minimum, maximum)
+        SELECT {time_column} / {bucket_seconds} * {bucket_seconds} AS b, sensor_id, {aggregates}
+        FROM {source}
+        WHERE {sensors}{time_column} >= ? AND {time_column} < ?
+        GROUP BY b, sensor_id
+        """, (start, end))
+        source = target
+
+
+def choose_resolution(span_seconds: float, max_points: int, sample_interval: float = 1.0):
+    """
+    Coarsest resolution that still gives enough points: raw samples (None) if the span holds
+    at most max_points of them, otherwise the finest rollup that fits in max_points.
+    """
+    if span_seconds / max(sample_interval, 1e-3) <= max_points:
+        return None
+    for resolution, bucket_seconds in RESOLUTIONS:
+        if span_seconds / bucket_seconds <= max_points:
+            return resolution
+    return RESOLUTIONS[-1][0]
+
+
+def rollup_query(table_name: str, resolution: str):
+    # Buckets starting between two epoch values, as (bucket start, sensor_id, mean) rows
+    # in bucket order (see db_functions.load_rollup_columns)
+    return f"""
+    SELECT bucket, sensor_id, total / readings
+    FROM {rollup_table(table_name, resolution)}
+    WHERE bucket BETWEEN ? AND ?
+    ORDER BY bucket
+    """
@@ -0,0 +1,173 @@
+import errno
+import glob
+import json
+import os
+import threading
+import time
+import wire_reader
+from wire_reader import SampleSet
+
+
+class SensorRegistry:
+    """
+    Cached view of the DS18B20 sensors on the 1-Wire bus.
+
+    Devices and the bus masters' therm_bulk_read attributes are discovered once and rescanned
+    only every rescan_interval seconds, or right away when a sensor's files are gone (a read
+    failing with ENOENT/ENODEV, or no value at all). A stale read (CRC failure, timeout) waits
+    for the periodic rescan. Each sensor ROM ID (e.g. 28-0123456789ab) is bound to a channel (1 = T1, 2 = T2, ...)
+    and the binding is saved to mapping_file, so re-enumeration or hot-plugging never swaps columns.
+    """
+
+    def __init__(self, base_dir=wire_reader.BASE_DIR, mapping_file="sensor_channels.json", rescan_interval=60):
+        self.base_dir = base_dir
+        self.mapping_file = mapping_file
+        self.rescan_interval = rescan_interval
+
+        self.channels = {}  # ROM ID -> channel, persisted
+        self.paths = {}     # ROM ID -> device directory, only sensors currently present
+        self.bulk_attributes = []  # therm_bulk_read files, see wire_reader.find_bulk_read_attributes
+        self.handles = {}   # attribute path -> open file object, shared with the read workers under lock
+        self.lock = threading.Lock()
+
+        self.last_scan = 0.0
+        self.rescan_requested = True
+
+        self.load_mapping()
+
+    def load_mapping(self):
+        if os.path.exists(self.mapping_file):
+            try:
+                with open(self.mapping_file, 'r') as f:
+                    self.channels = {rom_id: int(channel) for rom_id, channel in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                print(f"Could not load sensor channel mapping: {e}")
+
+    def save_mapping(self):
+        try:
+            with open(self.mapping_file, 'w') as f:
+                json.dump(self.channels, f, indent=4, sort_keys=True)
+        except OSError as e:
+            print(f"Could not save sensor channel mapping: {e}")
+
+    def rescan(self):
+        found = {os.path.basename(path): path for path in sorted(glob.glob(os.path.join(self.base_dir, '28*')))}
+        bulk_attributes = wire_reader.find_bulk_read_attributes(self.base_dir)
+        changed = False
+        with self.lock:
+            # New sensors get the first free channel, known sensors keep theirs
+            for rom_id in found:
+                if rom_id not in self.channels:
+                    used = set(self.channels.values())
+                    channel = 1
+                    while channel in used:
+                        channel += 1
+                    self.channels[rom_id] = channel
+                    changed = True
+                    print(f"New sensor {rom_id} mapped to channel T{channel}")
+
+            # Drop cached handles of sensors that disappeared
+            for rom_id in set(self.paths) - set(found):
+                print(f"Sensor {rom_id} (T{self.channels[rom_id]}) is no longer on the bus")
+                for name in ('w1_slave', 'temperature'):
+                    self.close_handle(os.path.join(self.paths[rom_id], name))
+
+            self.paths = found
+            self.bulk_attributes = bulk_attributes
+            self.last_scan = time.monotonic()
+            self.rescan_requested = False
+        if changed:
+            self.save_mapping()
+
+    def maybe_rescan(self):
+        if self.rescan_requested or time.monotonic() - self.last_scan >= self.rescan_interval:
+            self.rescan()
+
+    def request_rescan(self):
+        self.rescan_requested = True
+
+    def channel_count(self):
+        return max(self.channels.values(), default=0)
+
+    def present_sensors(self):
+        # (channel, ROM ID, path) of the sensors on the bus, ordered by channel
+        with self.lock:
+            return sorted((self.channels[rom_id], rom_id, path) for rom_id, path in self.paths.items())
+
+    def close_handle(self, device_file):
+        # Caller must hold self.lock
+        handle = self.handles.pop(device_file, None)
+        if handle is not None:
+            try:
+                handle.close()
+            except OSError:
+                pass
+
+    def close(self):
+        with self.lock:
+            for device_file in list(self.handles):
+                self.close_handle(device_file)
+
+    def read_raw(self, device_file):
+        # Re-reading a sysfs attribute from offset 0 triggers a new conversion, so the handle can be kept open.
+        # Runs on the read workers, one read per sensor at a time; only the dict access needs the lock
+        with self.lock:
+            handle = self.handles.get(device_file)
+        if handle is not None:
+            try:
+                handle.seek(0)
+                return handle.readlines()
+            except (OSError, ValueError):  # ValueError: closed by close() or a rescan meanwhile
+                with self.lock:
+                    if self.handles.get(device_file) is handle:
+                        self.close_handle(device_file)
+        try:
+            handle = open(device_file, 'r')
+        except OSError as e:
+            if e.errno in (errno.ENOENT, errno.ENODEV):
+                self.request_rescan()  # the device is gone
+            raise
+        lines = handle.readlines()
+        try:
+            handle.seek(0)
+        except OSError:
+            handle.close()  # not seekable (e.g. a pipe), reopen on every read
+            return lines
+        with self.lock:
+            previous = self.handles.get(device_file)
+            self.handles[device_file] = handle
+        if previous is not None:
+            previous.close()
+        return lines
+
+    def read(self, mode="parallel", max_workers=wire_reader.MAX_READ_WORKERS, timeout=wire_reader.READ_TIMEOUT,
+             retries=wire_reader.READ_RETRIES, fallback="last_good"):
+        """
+        Read all present sensors and return a SampleSet aligned to channels: index 0 is T1,
+        index 1 is T2 and so on. Channels whose sensor is missing hold None, failed reads are
+        replaced according to fallback and flagged.
+        """
+        self.maybe_rescan()
+        present = self.present_sensors()
+        paths = [path for _, _, path in present]
+
+        if mode == "bulk":
+            sample = wire_reader.read_1wire_sensors_bulk(paths, self.base_dir, max_workers=max_workers, read_raw=self.read_raw,
+                                                         timeout=timeout, retries=retries, fallback=fallback,
+                                                         attributes=self.bulk_attributes)
+        else:
+            sample = wire_reader.read_1wire_sensors_parallel(paths, max_workers, self.read_raw, timeout, retries, fallback)
+
+        count = self.channel_count()
+        sensors = [None] * count
+        temps = [None] * count
+        read_times = [None] * count
+        flags = [wire_reader.FLAG_MISSING] * count
+        for (channel, rom_id, _), temp, read_time, flag in zip(present, sample.temps, sample.read_times, sample.flags):
+            sensors[channel - 1] = rom_id
+            temps[channel - 1] = temp
+            read_times[channel - 1] = read_time
+            flags[channel - 1] = flag
+            if flag == wire_reader.FLAG_MISSING:
+                self.request_rescan()
+        return SampleSet(sample.timestamp, sensors, temps, read_times, sample.cycle_time, flags)
@@ -0,0 +1,283 @@
+import calendar
+import datetime
+import os
+import pathlib
+import sqlite3
+import threading
+from collections import namedtuple
+import db_manager
+import readings
+
+# Time-partitioned storage: the samples of closed periods (a week, month or year) in their own
+# database files next to the live one, e.g. sensor_database.temps.2024-01.db.
+#
+# The live database keeps recording as before and holds everything else: the current period,
+# comments, rollups, the sensor registry and schema_meta. migrations.rotate_shards moves a
+# period's samples and readings out once it has ended, then seals the file: compacted once
+# with VACUUM and made read-only, so it never changes again, is backed up once and is read
+# with locking off (immutable). {table}_shards in the live database lists the shards.
+#
+# The router below runs a query over exactly the shards that can hold matching rows: they are
+# ATTACHed to the reader connection and joined to the live table with UNION ALL under the
+# table's own name, so queries keep their WHERE, ORDER BY and comment joins unchanged. SQLite
+# pushes the WHERE into every part (each uses its ts index) and merges the parts in order.
+
+PERIODS = ("week", "month", "year")
+# Shards attached to one connection at a time; SQLite allows 10 databases besides main
+MAX_ATTACHED = 8
+ALIAS_PREFIX = "shard_"
+
+SAMPLE_COLUMNS = "id, ts"
+READING_COLUMNS = "sensor_id, ts, sample_id, value"
+
+# Catalog rows, see list_shards(). start_ts/end_ts are the period [start, end), first_/last_
+# the ids and timestamps actually stored (NULL until the first rows are moved)
+Shard = namedtuple(
+    "Shard", ["period", "path", "start_ts", "end_ts", "first_ts", "last_ts", "first_id", "last_id", "rows", "sealed"])
+
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+def catalog_table(table_name: str):
+    return f"{table_name}_shards"
+
+
+def create_catalog(conn, table_name: str):
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {catalog_table(table_name)} (
+        period TEXT PRIMARY KEY,
+        file TEXT NOT NULL,
+        start_ts INTEGER NOT NULL,
+        end_ts INTEGER NOT NULL,
+        first_ts INTEGER,
+        last_ts INTEGER,
+        first_id INTEGER,
+        last_id INTEGER,
+        rows INTEGER,
+        sealed INTEGER NOT NULL DEFAULT 0
+    )""")
+
+
+def create_shard_tables(conn, alias: str, table_name: str):
+    # Tables of a shard attached as alias: the samples (always the epoch timestamp layout) and readings.
+    # Shards moved before the readings table held every value also have T1-T3, older ones a generated
+    # data column (UTC text, see db_functions.migrate_db); neither is read
+    conn.execute(f"""
+    CREATE TABLE IF NOT EXISTS {alias}.{table_name} (
+        id INTEGER PRIMARY KEY,
+        ts INTEGER NOT NULL
+    )""")
+    conn.execute(f"CREATE INDEX IF NOT EXISTS {alias}.idx_{table_name}_ts ON {table_name} (ts)")
+    readings.create_readings_tables(conn, f"{alias}.{table_name}")
+
+
+def period_start(ts: int, period: str):
+    # Start of the period containing ts (epoch seconds, see db_functions.to_epoch); weeks start on Monday
+    day = ts // 86400
+    if period == "week":
+        return (day - (day + 3) % 7) * 86400  # 1970-01-01 was a Thursday
+    date = datetime.date(1970, 1, 1) + datetime.timedelta(days=day)
+    if period == "month":
+        return calendar.timegm((date.year, date.month, 1, 0, 0, 0))
+    if period == "year":
+        return calendar.timegm((date.year, 1, 1, 0, 0, 0))
+    raise ValueError(f"Unknown shard period: {period}")
+
+
+def period_end(start_ts: int, period: str):
+    if period == "week":
+        return start_ts + 7 * 86400
+    date = datetime.date(1970, 1, 1) + datetime.timedelta(days=start_ts // 86400)
+    if period == "month":
+        return calendar.timegm((date.year + date.month // 12, date.month % 12 + 1, 1, 0, 0, 0))
+    return calendar.timegm((date.year + 1, 1, 1, 0, 0, 0))
+
+
+def period_label(start_ts: int, period: str):
+    # 2024-W03, 2024-01 or 2024
+    date = datetime.date(1970, 1, 1) + datetime.timedelta(days=start_ts // 86400)
+    if period == "week":
+        year, week, _ = date.isocalendar()
+        return f"{year}-W{week:02d}"
+    if period == "month":
+        return f"{date.year}-{date.month:02d}"
+    return f"{date.year}"
+
+
+def shard_file(database_name: str, table_name: str, label: str):
+    # File name of a shard, stored without directory in the catalog: the shards move with the database
+    return f"{os.path.splitext(os.path.basename(database_name))[0]}.{table_name}.{label}.db"
+
+
+def shard_path(database_name: str, file_name: str):
+    return os.path.join(os.path.dirname(os.path.abspath(database_name)), file_name)
+
+
+def shard_uri(path: str, sealed: bool):
+    # Read-only URI for ATTACH; sealed files never change, so SQLite can skip locking them
+    return pathlib.Path(path).resolve().as_uri() + ("?mode=ro&immutable=1" if sealed else "?mode=ro")
+
+
+def list_shards(database_name: str, table_name: str):
+    # Shards of a table in time order, cached until forget_catalog()
+    key = (database_name, table_name)
+    with _catalogs_lock:
+        if key not in _catalogs:
+            try:
+                with db_manager.reader(database_name) as conn:
+                    rows = conn.execute(f"SELECT period, file, start_ts, end_ts, first_ts, last_ts, first_id, last_id, rows, sealed "
+                                        f"FROM {catalog_table(table_name)} ORDER BY start_ts").fetchall()
+            except sqlite3.OperationalError:
+                rows = []  # not migrated yet, so never sharded
+            _catalogs[key] = [Shard(row[0], shard_path(database_name, row[1]), *row[2:9], bool(row[9])) for row in rows]
+        return _catalogs[key]
+
+
+def forget_catalog(database_name: str, table_name: str):
+    with _catalogs_lock:
+        _catalogs.pop((database_name, table_name), None)
+
+
+def live_start(database_name: str, table_name: str):
+    # Where the periods moved to shards end, None for a table without shards
+    shards = list_shards(database_name, table_name)
+    return shards[-1].end_ts if shards else None
+
+
+def overlapping(database_name: str, table_name: str, start_ts=None, end_ts=None, first_id=None, last_id=None):
+    """
+    Shards that can hold rows with start_ts <= ts <= end_ts, or first_id <= id <= last_id.
+    Leave both bounds of a pair None for no limit. Shards still being filled have no id
+    bounds yet and match any id range.
+    """
+    selected = []
+    for shard in list_shards(database_name, table_name):
+        if start_ts is not None and shard.end_ts <= start_ts or end_ts is not None and shard.start_ts > end_ts:
+            continue
+        if shard.first_id is not None and (first_id is not None and shard.last_id < first_id
+                                           or last_id is not None and shard.first_id > last_id):
+            continue
+        selected.append(shard)
+    return selected
+
+
+def attach(conn, shards):
+    # Attach shards read-only as shard_0, shard_1, ...; returns the aliases
+    aliases = []
+    for position, shard in enumerate(shards):
+        alias = f"{ALIAS_PREFIX}{position}"
+        conn.execute("ATTACH DATABASE ? AS " + alias, (shard_uri(shard.path, shard.sealed),))
+        aliases.append(alias)
+    return aliases
+
+
+def detach_all(conn):
+    # Detach the router's shards, including any left behind by a cursor that was not read to the end
+    for _, name, _ in conn.execute("PRAGMA database_list").fetchall():
+        if name.startswith(ALIAS_PREFIX):
+            conn.execute(f"DETACH DATABASE {name}")
+
+
+def source(table_name: str, aliases, columns=SAMPLE_COLUMNS, live_from=None, live_until=None):
+    """
+    FROM clause item reading table_name from the attached shards and the live database as one
+    table. live_from/live_until limit the live rows to from <= ts < until (see RoutedCursor).
+    """
+    live = [f"ts >= {int(live_from)}"] if live_from is not None else []
+    live += [f"ts < {int(live_until)}"] if live_until is not None else []
+    parts = [f"SELECT {columns} FROM {alias}.{table_name}" for alias in aliases]
+    parts.append(f"SELECT {columns} FROM main.{table_name}" + (" WHERE " + " AND ".join(live) if live else ""))
+    return f"({' UNION ALL '.join(parts)}) AS {table_name}"
+
+
+class RoutedCursor:
+    """
+    A query run over more shards than fit on one connection: once per group of MAX_ATTACHED
+    shards, each with the live rows of the same stretch of time (rows recorded after their
+    period was sealed). Groups are read one after the other, so a time ordered query stays in
+    order. Provides the part of the cursor interface the callers use: description and fetch*().
+    """
+
+    def __init__(self, conn, table_name, groups, make_query, params, columns):
+        self.conn = conn
+        self.table_name = table_name
+        self.groups = list(groups)
+        self.make_query = make_query
+        self.params = params
+        self.columns = columns
+        self.cursor = None
+        self.description = None
+        self.next_group()
+
+    def next_group(self):
+        detach_all(self.conn)
+        if not self.groups:
+            self.cursor = None
+            return
+        shards, live_from, live_until = self.groups.pop(0)
+        aliases = attach(self.conn, shards)
+        self.cursor = self.conn.execute(self.make_query(source(self.table_name, aliases, self.columns, live_from, live_until)),
+                                        self.params)
+        self.description = self.description or self.cursor.description
+
+    def fetchmany(self, size=1000):
+        while self.cursor is not None:
+            rows = self.cursor.fetchmany(size)
+            if rows:
+                return rows
+            self.next_group()
+        return []
+
+    def fetchall(self):
+        rows = []
+        for batch in iter(lambda: self.fetchmany(10000), []):
+            rows += batch
+        return rows
+
+    def fetchone(self):
+        rows = self.fetchmany(1)
+        return rows[0] if rows else None
+
+    def close(self):
+        if self.cursor is not None:
+            self.cursor.close()
+        self.groups = []
+        self.cursor = None
+        detach_all(self.conn)
+
+
+def execute(conn, database_name: str, table_name: str, make_query, params=(), start_ts=None, end_ts=None,
+            first_id=None, last_id=None, source_table=None, columns=SAMPLE_COLUMNS):
+    """
+    Run a query on table_name wherever its rows are stored. make_query(source) returns the SQL
+    with source as the FROM item of the table (the table's own name as alias); the time or id
+    bounds select the shards (see overlapping). source_table/columns route a companion table
+    instead, e.g. the readings. Without matching shards this is conn.execute on the live table,
+    otherwise a cursor over the shards that may return one result row per group (sum counts).
+    """
+    source_table = source_table or table_name
+    shards = overlapping(database_name, table_name, start_ts, end_ts, first_id, last_id)
+    if not shards:
+        # Unqualified names resolve to main first, shards a cursor left attached do not matter
+        return conn.execute(make_query(source_table), params)
+    # Group i reads the live rows from the end of group i - 1 to the end of its own last shard
+    ends = [shards[i - 1].end_ts for i in range(MAX_ATTACHED, len(shards), MAX_ATTACHED)]
+    groups = [(shards[i:i + MAX_ATTACHED], live_from, live_until)
+              for i, live_from, live_until in zip(range(0, len(shards), MAX_ATTACHED), [None] + ends, ends + [None])]
+    return RoutedCursor(conn, source_table, groups, make_query, params, columns)
+
+
+def seal(path: str):
+    """
+    Compact a finished shard once and make it read-only. The file is rewritten by VACUUM, left
+    in rollback journal mode (no -wal/-shm files are needed to read it) and chmod'ed to 0444.
+    """
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute("PRAGMA busy_timeout = 5000")
+        conn.execute("PRAGMA journal_mode = DELETE")
+        conn.execute("VACUUM")
+    finally:
+        conn.close()
+    os.chmod(path, 0o444)
@@ -0,0 +1,475 @@
+import argparse
+import glob
+import os
+import struct
+import tempfile
+import threading
+import time
+import zlib
+import db_functions
+import db_manager
+
+# Append-only spool between acquisition and SQLite.
+#
+# The acquisition thread only appends small records to a file, which takes microseconds and
+# cannot be blocked by a locked database; an SD card stall delays one append, never the
+# database lock. A SpoolDrainer thread replays the records into SQLite in batches.
+#
+# Record: payload length and CRC32 (uint32 each, little endian), then the payload: sequence
+# number (uint64), ts (int64, epoch seconds as in db_functions.to_epoch), channel count
+# (uint16) and one float64 per channel, NaN for "no reading". A crash can only leave a torn
+# record at the end of the newest segment, which the length/CRC check detects and drops.
+#
+# Every batch is inserted together with the sequence number of its last record in schema_meta,
+# in one transaction. Replay skips records at or below that number, so records are neither
+# lost nor inserted twice whatever point a power cut interrupts. Segments whose records are
+# all committed are deleted.
+#
+# Each segment starts with a header naming the table its records belong to: the database_id
+# from schema_meta (see db_functions.database_id) and the table name. Sequence numbers only
+# mean something to that table, so segments of another one (the database file was replaced or
+# restored from a backup, the table was renamed) are moved to a subdirectory, never replayed.
+#
+# fsync: "sample" syncs every record before append returns, so a power cut loses none;
+# "batch" syncs once per drained batch, the same window a power cut can cost the database
+# commits anyway, at a fraction of the writes; "off" leaves it to the operating system.
+
+SEGMENT_MAGIC = b"TSSPOOL\x01"
+SEGMENT_HEADER = struct.Struct("<8sH")  # magic, length of the utf-8 identity that follows
+HEADER = struct.Struct("<II")
+PAYLOAD_HEADER = struct.Struct("<QqH")
+SEGMENT_SUFFIX = ".spool"
+SEGMENT_BYTES = 1024 * 1024  # start a new segment file after this size
+DRAIN_CHUNK = 1000  # records per transaction when catching up on a backlog
+FSYNC_MODES = ("sample", "batch", "off")
+FOREIGN_DIR = "foreign"  # segments of other databases/tables are moved here
+
+
+def fsync_mode(value):
+    # spool_fsync setting; true/false from older configs mean every sample/never
+    if value is True:
+        return "sample"
+    if value is False:
+        return "off"
+    if value not in FSYNC_MODES:
+        raise ValueError(f"Unknown spool_fsync mode: {value}")
+    return value
+
+
+def spool_identity(database_name, table_name):
+    return f"{db_functions.database_id(database_name)}:{table_name}"
+
+
+def encode_segment_header(identity):
+    encoded = identity.encode()
+    return SEGMENT_HEADER.pack(SEGMENT_MAGIC, len(encoded)) + encoded
+
+
+def read_segment_header(path):
+    """
+    (identity, header size) of a segment. The identity is None for a header cut short by a
+    crash while the segment was created, and "" for a file that is not a spool segment.
+    """
+    with open(path, "rb") as f:
+        data = f.read(SEGMENT_HEADER.size)
+        magic = data[:len(SEGMENT_MAGIC)]
+        if magic != SEGMENT_MAGIC[:len(magic)]:
+            return "", 0
+        if len(data) < SEGMENT_HEADER.size:
+            return None, 0
+        _, length = SEGMENT_HEADER.unpack(data)
+        identity = f.read(length)
+    if len(identity) < length:
+        return None, 0
+    return identity.decode(errors="replace"), SEGMENT_HEADER.size + length
+
+
+def encode_record(seq, ts, temps):
+    payload = PAYLOAD_HEADER.pack(seq, ts, len(temps)) + struct.pack(
+        f"<{len(temps)}d", *(float("nan") if t is None else t for t in temps))
+    return HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_segment(path, offset=0):
+    """
+    Yield (end offset, seq, ts, temps) of the complete records of a segment from offset on,
+    offset 0 being the start of the first record after the header.
+    Stops at the first incomplete or corrupt record, i.e. a torn write or one still in progress.
+    """
+    if offset == 0:
+        identity, offset = read_segment_header(path)
+        if not identity:
+            return
+    with open(path, "rb") as f:
+        f.seek(offset)
+        data = f.read()
+    position = 0
+    while position + HEADER.size <= len(data):
+        length, crc = HEADER.unpack_from(data, position)
+        start = position + HEADER.size
+        payload = data[start:start + length]
+        if length < PAYLOAD_HEADER.size or len(payload) < length or zlib.crc32(payload) != crc:
+            return
+        seq, ts, count = PAYLOAD_HEADER.unpack_from(payload)
+        values = struct.unpack_from(f"<{count}d", payload, PAYLOAD_HEADER.size)
+        position = start + length
+        yield offset + position, seq, ts, [None if v != v else v for v in values]
+
+
+def committed_seq(database_name, table_name):
+    # Sequence number of the last spooled record that is in the database
+    return int(db_functions.get_meta(database_name, f"{table_name}.spool_seq", 0))
+
+
+class Spool:
+    """
+    Segment files in a directory, named after the sequence number of their first record.
+    Only the newest segment is appended to. Thread-safe.
+    identity is spool_identity() of the table the records are for.
+    """
+
+    def __init__(self, directory, identity, first_seq=1, fsync="batch", segment_bytes=SEGMENT_BYTES):
+        self.directory = directory
+        self.identity = identity
+        self.fsync = fsync_mode(fsync)
+        self.segment_bytes = segment_bytes
+        self.lock = threading.Lock()
+        self.unsynced = False  # records appended since the last fsync
+        os.makedirs(directory, exist_ok=True)
+        self.set_aside_foreign()
+
+        # Continue after the last intact record, dropping a torn one left by a crash
+        self.next_seq = first_seq
+        segments = self.segments()
+        for path in segments:
+            _, end = read_segment_header(path)
+            for end, seq, _, _ in read_segment(path):
+                self.next_seq = max(self.next_seq, seq + 1)
+            if path == segments[-1] and end < os.path.getsize(path):
+                print(f"Dropping {os.path.getsize(path) - end} bytes of an incomplete record at the end of {path}")
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+        self.fd = None
+        self.path = None
+        self.open_segment(segments[-1] if segments else None)
+
+    def segments(self):
+        return sorted(glob.glob(os.path.join(self.directory, f"*{SEGMENT_SUFFIX}")))
+
+    def set_aside_foreign(self):
+        # Move segments written for another database or table to FOREIGN_DIR/<their identity>, from
+        # where they can be replayed into their own database (python spool.py <that directory> --db ...)
+        segments = self.segments()
+        for path in segments:
+            identity, _ = read_segment_header(path)
+            if identity == self.identity:
+                continue
+            if identity is None and path == segments[-1]:
+                # Created just before a crash, before its header was complete: holds no records
+                os.remove(path)
+                continue
+            target = os.path.join(self.directory, FOREIGN_DIR, (identity or "unknown").replace(":", "-"))
+            os.makedirs(target, exist_ok=True)
+            os.replace(path, os.path.join(target, os.path.basename(path)))
+            print(f"Moved spool segment {path} of another database ({identity or 'unknown'}) to {target}")
+
+    def open_segment(self, path=None):
+        if self.fd is not None:
+            self.sync_locked()
+            os.close(self.fd)
+        self.path = path or os.path.join(self.directory, f"{self.next_seq:020d}{SEGMENT_SUFFIX}")
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self.size = os.fstat(self.fd).st_size
+        if self.size == 0:
+            header = encode_segment_header(self.identity)
+            os.write(self.fd, header)
+            self.size = len(header)
+            self.unsynced = True
+
+    def append(self, ts, temps):
+        # Returns the sequence number of the record; with fsync "sample" it is on disk when this returns
+        with self.lock:
+            if self.size >= self.segment_bytes:
+                self.open_segment()
+            seq = self.next_seq
+            record = encode_record(seq, ts, temps)
+            os.write(self.fd, record)
+            self.unsynced = True
+            if self.fsync == "sample":
+                self.sync_locked()
+            self.size += len(record)
+            self.next_seq += 1
+            return seq
+
+    def sync(self):
+        # Make the records appended so far durable (fsync "batch": called once per drained batch)
+        with self.lock:
+            self.sync_locked()
+
+    def sync_locked(self):
+        if self.unsynced and self.fsync != "off" and self.fd is not None:
+            os.fsync(self.fd)
+        self.unsynced = False
+
+    def remove_committed(self, seq):
+        # Delete every closed segment whose records are all at or below seq
+        with self.lock:
+            segments = self.segments()
+            for path, following in zip(segments, segments[1:]):
+                if path != self.path and int(os.path.basename(following)[:-len(SEGMENT_SUFFIX)]) - 1 <= seq:
+                    os.remove(path)
+
+    def close(self):
+        with self.lock:
+            if self.fd is not None:
+                self.sync_locked()
+                os.close(self.fd)
+                self.fd = None
+
+
+class SpoolDrainer(threading.Thread):
+    """
+    Replays spooled records into the database: when batch_size records are waiting or the
+    oldest has waited flush_interval seconds, and on stop(). A failed insert (database locked,
+    storage stalled) is retried on the next round, the records stay in the spool meanwhile.
+    """
+
+    def __init__(self, spool, database_name, table_name, batch_size=30, flush_interval=10.0):
+        super().__init__(name="spool-drainer", daemon=True)
+        self.spool = spool
+        self.database_name = database_name
+        self.table_name = table_name
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+
+        self.committed = committed_seq(database_name, table_name)
+        self.position = (None, 0)  # (segment, offset) read up to
+        self.drain_lock = threading.Lock()
+        self.wake = threading.Event()
+        self.stop_event = threading.Event()
+        self.oldest = None  # monotonic time of the oldest undrained append
+        if spool.next_seq - 1 > self.committed:
+            # Left over from before a crash or stall: replay right away
+            self.oldest = time.monotonic() - flush_interval
+
+        # Counters, see stats()
+        self.rows_written = 0
+        self.commits = 0
+        self.failed_drains = 0
+        self.max_drain_seconds = 0.0
+
+    def notify(self, seq):
+        # Called after every append
+        if self.oldest is None:
+            self.oldest = time.monotonic()
+        if seq - self.committed >= self.batch_size:
+            self.wake.set()
+
+    def flush_soon(self):
+        # Drain on the next round, regardless of batch_size and flush_interval
+        if self.oldest is not None:
+            self.oldest = time.monotonic() - self.flush_interval
+            self.wake.set()
+
+    def run(self):
+        while not self.stop_event.is_set():
+            self.wake.wait(1.0)
+            self.wake.clear()
+            if self.oldest is not None and (time.monotonic() - self.oldest >= self.flush_interval
+                                            or self.spool.next_seq - 1 - self.committed >= self.batch_size):
+                self.drain()
+
+    def stop(self, timeout=5):
+        self.stop_event.set()
+        self.wake.set()
+        if self.is_alive():
+            self.join(timeout)
+        self.drain()
+
+    def pending_records(self):
+        # (segment, end offset, seq, ts, temps) of every record after the read position
+        segment, offset = self.position
+        for path in self.spool.segments():
+            if segment is not None and path < segment:
+                continue
+            for end, seq, ts, temps in read_segment(path, offset if path == segment else 0):
+                yield path, end, seq, ts, temps
+
+    def drain(self):
+        """Insert everything spooled so far. Returns the number of rows inserted."""
+        with self.drain_lock:
+            # The batch is on disk in the spool before it goes to the database, in case that fails
+            self.spool.sync()
+            # Appends from here on start a new flush_interval
+            self.oldest = None
+            inserted = 0
+            batch = []
+            for path, end, seq, ts, temps in self.pending_records():
+                if seq <= self.committed:
+                    self.position = (path, end)  # already in the database (replay after a crash)
+                    continue
+                batch.append((path, end, seq, ts, temps))
+                if len(batch) >= DRAIN_CHUNK:
+                    if not self.commit(batch):
+                        self.oldest = self.oldest or time.monotonic()
+                        return inserted
+                    inserted += len(batch)
+                    batch = []
+            if batch:
+                if not self.commit(batch):
+                    self.oldest = self.oldest or time.monotonic()
+                    return inserted
+                inserted += len(batch)
+            self.spool.remove_committed(self.committed)
+            return inserted
+
+    def commit(self, batch):
+        started = time.perf_counter()
+        last_seq = batch[-1][2]
+        try:
+            db_functions.insert_many_to_db(self.database_name, self.table_name, [(ts,) + tuple(temps) for _, _, _, ts, temps in batch],
+                                           meta={f"{self.table_name}.spool_seq": last_seq})
+        except Exception as e:
+            self.failed_drains += 1
+            print(f"Failed to write {len(batch)} spooled samples, will retry: {e}")
+            return False
+        elapsed = time.perf_counter() - started
+        self.committed = last_seq
+        self.position = batch[-1][:2]
+        self.rows_written += len(batch)
+        self.commits += 1
+        self.max_drain_seconds = max(self.max_drain_seconds, elapsed)
+        print(f"Flushed {len(batch)} samples to the database in {elapsed * 1000:.1f} ms")
+        return True
+
+    def stats(self):
+        return {
+            "rows_written": self.rows_written,
+            "commits": self.commits,
+            "max_flush_ms": self.max_drain_seconds * 1000,
+            "failed_flushes": self.failed_drains,
+            "pending": self.spool.next_seq - 1 - self.committed,
+        }
+
+
+def open_spool(directory, database_name, table_name, batch_size=30, flush_interval=10.0, fsync="batch"):
+    # Spool continuing after what the database already has, and a started drainer for it
+    spool = Spool(directory, spool_identity(database_name, table_name), committed_seq(database_name, table_name) + 1, fsync)
+    drainer = SpoolDrainer(spool, database_name, table_name, batch_size, flush_interval)
+    drainer.start()
+    return spool, drainer
+
+
+def crash_test(records=2000, crash_every=250):
+    """
+    Append records, "crash" repeatedly (abandon spool and drainer without stopping them,
+    tear the last record in half), reopen and replay. Returns (rows in the database, records appended).
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        db_path = os.path.join(tmp_dir, "spool.db")
+        spool_dir = os.path.join(tmp_dir, "spool")
+        db_functions.create_db(db_path, "temps")
+        appended = 0
+        while appended < records:
+            spool = Spool(spool_dir, spool_identity(db_path, "temps"), committed_seq(db_path, "temps") + 1, fsync="off")
+            drainer = SpoolDrainer(spool, db_path, "temps", batch_size=crash_every // 3)
+            for _ in range(crash_every):
+                drainer.notify(spool.append(1704067200 + appended, [20.0, 21.0, None]))
+                appended += 1
+                if appended % (crash_every // 3) == 0:
+                    drainer.drain()
+            # Power cut in the middle of writing one more record: it was never complete, so it is lost
+            record = encode_record(spool.next_seq, 0, [0.0])
+            os.write(spool.fd, record[:len(record) // 2])
+            spool.close()
+        spool, drainer = open_spool(spool_dir, db_path, "temps")
+        drainer.stop()
+        spool.close()
+        with db_manager.reader(db_path) as conn:
+            count, distinct = conn.execute("SELECT COUNT(*), COUNT(DISTINCT ts) FROM temps").fetchone()
+        db_functions.close_connections()
+    return count, distinct, appended
+
+
+def benchmark(rows=2000, batch_size=30):
+    """
+    Compare one commit per sample (insert_data_to_db) with the spool drained in batches of
+    batch_size, for each fsync mode, on scratch databases. Reports rows per second, commits
+    and bytes written to disk per row.
+    """
+    results = {}
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for name, mode in (("per-sample", None),) + tuple((f"fsync={mode}", mode) for mode in FSYNC_MODES):
+            db_path = os.path.join(tmp_dir, f"{len(results)}.db")
+            db_functions.create_db(db_path, "temps")
+            samples = [(1704067200 + i, [20.0, 21.0, 22.0]) for i in range(rows)]
+
+            io_before = _bytes_written()
+            started = time.perf_counter()
+            if mode is None:
+                for ts, temps in samples:
+                    db_functions.insert_data_to_db(db_path, "temps", ts, *temps, verbose=False)
+                commits = rows
+            else:
+                spool = Spool(os.path.join(tmp_dir, f"{len(results)}.spool"), spool_identity(db_path, "temps"), fsync=mode)
+                drainer = SpoolDrainer(spool, db_path, "temps", batch_size=batch_size)
+                for ts, temps in samples:
+                    if spool.append(ts, temps) % batch_size == 0:
+                        drainer.drain()
+                drainer.drain()
+                spool.close()
+                commits = drainer.commits
+            elapsed = time.perf_counter() - started
+            io_bytes = _bytes_written() - io_before if io_before is not None else None
+
+            results[name] = {"rows_per_second": rows / elapsed, "commits": commits,
+                             "bytes_written_per_row": io_bytes / rows if io_bytes is not None else None}
+            db_functions.close_connections()
+    return results
+
+
+def _bytes_written():
+    # Bytes this process caused to be written to storage (Linux only), None elsewhere
+    try:
+        with open("/proc/self/io", "r") as f:
+            for line in f:
+                if line.startswith("write_bytes:"):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Replay a spool directory into the database, run a crash/replay test "
+                                                 "or benchmark the fsync modes")
+    parser.add_argument("spool_dir", nargs="?")
+    parser.add_argument("--db", default="sensor_database.db")
+    parser.add_argument("--table", default="temps")
+    parser.add_argument("--crash-test", action="store_true")
+    parser.add_argument("--benchmark", action="store_true")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--batch-size", type=int, default=30)
+    args = parser.parse_args()
+
+    if args.benchmark:
+        for name, result in benchmark(args.rows, args.batch_size).items():
+            per_row = result["bytes_written_per_row"]
+            print(f"{name:>12}: {result['rows_per_second']:10.0f} rows/s, {result['commits']} commits, "
+                  f"{'n/a' if per_row is None else f'{per_row:.0f}'} bytes written per row")
+        return
+    if args.crash_test:
+        count, distinct, appended = crash_test()
+        print(f"Appended {appended} records with crashes in between: {count} rows in the database, {distinct} distinct")
+        return
+    spool = Spool(args.spool_dir, spool_identity(args.db, args.table), committed_seq(args.db, args.table) + 1)
+    drainer = SpoolDrainer(spool, args.db, args.table)
+    try:
+        print(f"Replayed {drainer.drain()} records into {args.db}")
+    finally:
+        spool.close()
+        db_functions.close_connections()
+
+
+if __name__ == "__main__":
+    main()
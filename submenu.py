@@ -2,6 +2,7 @@ import tkinter as tk
 from tkinter import messagebox
 from tkcalendar import DateEntry
 import db_functions
+import export_jobs
 from igraph import InteractiveTemperaturePlot
 import datetime
 from configuration import Config
@@ -12,7 +13,7 @@ class Submenu:
         # Create a new Toplevel window
         self.window = tk.Toplevel(parent)
         self.window.title(title)
-        self.window.geometry("400x400")  # Reduced size for a more compact layout
+        self.window.geometry("400x620")  # Tall enough for the comment search below the date filters
 
         self.config = Config(self.window)
         
@@ -84,6 +85,25 @@ class Submenu:
         # Second row of buttons
         tk.Button(button_row2, text="Graph last n records", command=self.generate_n_graph, width=20).pack(side="left", padx=5)
         tk.Button(button_row2, text="Exit", command=self.close_window, width=20).pack(side="right", padx=5)
+
+        # Comment search, double click a result to plot the time around it
+        search_frame = tk.LabelFrame(main_frame, text="Search Comments", padx=10, pady=10)
+        search_frame.pack(fill="both", expand=True, pady=10)
+        search_row = tk.Frame(search_frame)
+        search_row.pack(fill="x")
+        self.search_entry = tk.Entry(search_row)
+        self.search_entry.pack(side="left", fill="x", expand=True, padx=5)
+        self.search_entry.bind("<Return>", lambda event: self.search_comments())
+        tk.Button(search_row, text="Search", command=self.search_comments).pack(side="right", padx=5)
+        results_frame = tk.Frame(search_frame)
+        results_frame.pack(fill="both", expand=True, pady=5)
+        results_scrollbar = tk.Scrollbar(results_frame)
+        results_scrollbar.pack(side="right", fill="y")
+        self.search_listbox = tk.Listbox(results_frame, yscrollcommand=results_scrollbar.set)
+        self.search_listbox.pack(side="left", fill="both", expand=True)
+        results_scrollbar.config(command=self.search_listbox.yview)
+        self.search_listbox.bind("<Double-Button-1>", self.open_search_result)
+        self.search_results = []
         
         # Update the DateEntry widgets with the valid date range
         self.start_date_entry.set_date(self.min_date.date())
@@ -142,10 +162,14 @@ class Submenu:
             n = tk.simpledialog.askinteger("Input", "Enter the number of last records to plot:", parent=self.window, minvalue=1, maxvalue=100000)
             if n is None:
                 return
-            # Fetch dates from the database
-            start_date, end_date = db_functions.fetch_last_n_records(self.config.get("db_path"), self.config.get("table_name"),n)
+            # Fetch the id range and its dates from the database
+            id_range = db_functions.fetch_last_n_id_range(self.db_path, self.table_name, n)
+            start_date, end_date = db_functions.fetch_last_n_records(self.db_path, self.table_name, n, id_range)
+            if start_date is None:
+                messagebox.showwarning("No Data", "There are no records to plot.")
+                return
             print(f"Generating graph for last {n} records from {start_date} to {end_date}")
-            InteractiveTemperaturePlot(self.window, start_date, end_date)
+            InteractiveTemperaturePlot(self.window, start_date, end_date, id_range=id_range)
         else:
              # Fetch dates from UI
             start_date, end_date = self.get_date_and_time()
@@ -183,7 +207,30 @@ class Submenu:
         if isinstance(end_date, str):
             end_date = datetime.datetime.strptime(end_date, "%Y-%m-%d %H:%M:%S")
         default_path = self.config.get("export_path")
-        db_functions.records_by_time_csv(self.db_path, self.table_name , start_date, end_date, default_path)
+        export_jobs.export_in_background(self.window, self.db_path, self.table_name, default_path, start_date, end_date)
+
+    # Minutes of data plotted before and after a comment found by the search
+    SEARCH_CONTEXT = datetime.timedelta(minutes=30)
+
+    def search_comments(self):
+        self.search_results = db_functions.search_comments(self.db_path, self.table_name, self.search_entry.get())
+        self.search_listbox.delete(0, tk.END)
+        for sample_id, start_ts, end_ts, text in self.search_results:
+            when = db_functions.epoch_to_text(start_ts)
+            if start_ts != end_ts:
+                when += f" to {db_functions.epoch_to_text(end_ts)}"
+            self.search_listbox.insert(tk.END, f"{when}  {text}")
+        if not self.search_results:
+            self.search_listbox.insert(tk.END, "No matching comments")
+
+    def open_search_result(self, event=None):
+        selection = self.search_listbox.curselection()
+        if not selection or selection[0] >= len(self.search_results):
+            return
+        sample_id, start_ts, end_ts, _ = self.search_results[selection[0]]
+        start_date = self.parse_date(db_functions.epoch_to_text(start_ts)) - self.SEARCH_CONTEXT
+        end_date = self.parse_date(db_functions.epoch_to_text(end_ts)) + self.SEARCH_CONTEXT
+        InteractiveTemperaturePlot(self.window, start_date, end_date, focus_id=sample_id)
 
     def close_window(self):
         self.window.destroy()
\ No newline at end of file
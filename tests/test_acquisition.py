@@ -0,0 +1,149 @@
+import time
+import types
+
+import pytest
+
+import acquisition
+import db_functions
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+class FakeClock:
+    # Stands in for the time module: wait() advances the clock instead of sleeping
+    def __init__(self, wall=1000.0):
+        self.wall = wall
+        self.mono = 50.0
+
+    def time(self):
+        return self.wall
+
+    def monotonic(self):
+        return self.mono
+
+    def advance(self, seconds):
+        self.wall += seconds
+        self.mono += seconds
+
+    def wait(self, seconds):
+        self.advance(seconds)
+        return False  # the stop event was not set
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(acquisition, "time", types.SimpleNamespace(time=clock.time, monotonic=clock.monotonic))
+    return clock
+
+
+def test_skip_policy_drops_missed_deadlines(clock):
+    scheduler = acquisition.DeadlineScheduler(1000, "skip")
+    assert scheduler.wait_next(clock) == (1000.0, 0.0)
+
+    clock.advance(3.5)  # the cycle overran by two and a half intervals
+
+    scheduled, lateness = scheduler.wait_next(clock)
+    assert (scheduled, lateness) == (1003.0, pytest.approx(0.5))
+    assert scheduler.wait_next(clock) == (1004.0, 0.0)
+    assert (scheduler.skipped, scheduler.late_count, scheduler.cycles) == (2, 1, 3)
+
+
+def test_catch_up_policy_runs_missed_deadlines_back_to_back(clock):
+    scheduler = acquisition.DeadlineScheduler(1000, "catch_up")
+    scheduler.wait_next(clock)
+
+    clock.advance(3.5)
+
+    fired = [scheduler.wait_next(clock) for _ in range(4)]
+    assert [scheduled for scheduled, _ in fired] == [1001.0, 1002.0, 1003.0, 1004.0]
+    assert [round(lateness, 3) for _, lateness in fired] == [2.5, 1.5, 0.5, 0.0]
+    assert scheduler.skipped == 0
+
+
+def test_lateness_is_kept_in_a_histogram(clock):
+    scheduler = acquisition.DeadlineScheduler(1000, "skip")
+    for work in [0.0] * 98 + [1.003, 1.3]:
+        scheduler.wait_next(clock)
+        clock.advance(work)
+    scheduler.wait_next(clock)
+
+    stats = scheduler.stats()
+    assert stats["cycles"] == 101
+    # Lateness adds up across back to back overruns: 3 ms, then 303 ms
+    histogram = stats["lateness_histogram"]
+    assert (histogram["<=1 ms"], histogram["<=5 ms"], histogram["<=500 ms"]) == (99, 1, 1)
+    # Percentiles are the upper edges of their buckets
+    assert (stats["lateness_p50_ms"], stats["lateness_p99_ms"]) == (1.0, 5.0)
+    assert stats["max_lateness_ms"] == pytest.approx(303.0)
+
+
+@pytest.mark.parametrize("interval", [0, -5, None])
+def test_non_positive_interval_is_rejected(clock, interval):
+    scheduler = acquisition.DeadlineScheduler(1000)
+    with pytest.raises(ValueError):
+        scheduler.set_interval(interval)
+    assert scheduler.interval_ms == 1000
+
+
+def test_buffer_counts_samples_the_ui_did_not_drain():
+    buffer = acquisition.SampleBuffer(maxlen=3)
+    for i in range(5):
+        buffer.put(i)
+
+    assert buffer.drain() == [2, 3, 4]
+    assert buffer.dropped == 2
+    assert buffer.drain() == []
+
+
+def worker_config(tmp_path, **settings):
+    db_path = str(tmp_path / "worker.db")
+    db_functions.create_db(db_path, TABLE)
+    config = {"db_path": db_path, "table_name": TABLE, "spool_dir": str(tmp_path / "spool"), "batch_size": 30,
+              "flush_interval": 10.0, "spool_fsync": "off", "overrun_policy": "skip", "update_interval": 1000}
+    config.update(settings)
+    return config
+
+
+def test_worker_spools_only_while_recording(tmp_path):
+    readings = iter([[20.0, 21.0], [22.0, 23.0], RuntimeError("bus error")])
+
+    def read_sample():
+        reading = next(readings)
+        if isinstance(reading, Exception):
+            raise reading
+        return reading
+
+    config = worker_config(tmp_path)
+    buffer = acquisition.SampleBuffer()
+    worker = acquisition.AcquisitionWorker(config, read_sample, buffer)
+    try:
+        worker.acquire_once(START)
+        worker.recording.set()
+        worker.acquire_once(START + 1, lateness=0.25)
+        worker.acquire_once(START + 2)  # a failed read publishes nothing
+    finally:
+        worker.stop()
+        db_functions.close_connections()
+
+    samples = buffer.drain()
+    assert [(sample.ts, sample.temps, sample.lateness) for sample in samples] == \
+        [(START, [20.0, 21.0], 0.0), (START + 1, [22.0, 23.0], 0.25)]
+    columns = db_functions.fetch_columns(config["db_path"], TABLE, START, START + 2)
+    assert columns.ts.tolist() == [START + 1]
+    assert columns.temps.tolist() == [[22.0, 23.0]]
+
+
+def test_worker_thread_samples_until_stopped(tmp_path):
+    buffer = acquisition.SampleBuffer()
+    worker = acquisition.AcquisitionWorker(worker_config(tmp_path, update_interval=20), lambda: [20.0], buffer)
+    worker.start()
+    try:
+        time.sleep(0.3)
+    finally:
+        worker.stop()
+        db_functions.close_connections()
+
+    assert not worker.is_alive()
+    assert len(buffer.drain()) >= 5
@@ -0,0 +1,33 @@
+import pytest
+
+import binary_store
+import db_functions
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    binary_store.configure(True)
+    yield
+    binary_store.configure(False)
+    db_functions.close_connections()
+
+
+def test_out_of_order_rows_are_rebuilt_in_the_background(tmp_path):
+    db_path = str(tmp_path / "store.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + i, 20.0 + i, 21.0, 22.0) for i in range(10)])
+    store = binary_store.get_store(db_path, TABLE)
+    assert store.sync(db_path, TABLE)
+
+    # A late sample: reads go to SQLite until the rebuilt file is swapped in
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + 4, 30.0, 31.0, 32.0)])
+    assert not store.sync(db_path, TABLE)
+    store.rebuilder.join(10)
+
+    assert store.sync(db_path, TABLE)
+    records = store.time_range(START + 4, START + 5)
+    assert records["id"].tolist() == [5, 11, 6]
+    assert records["values"][1].tolist() == [30.0, 31.0, 32.0]
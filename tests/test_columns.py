@@ -0,0 +1,64 @@
+import numpy as np
+import pytest
+
+import db_functions
+import query_cache
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    query_cache.configure(0)
+    yield
+    db_functions.close_connections()
+
+
+def recorded_database(tmp_path):
+    # T3 never has a reading
+    db_path = str(tmp_path / "columns.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + i, 20.0 + i, None if i == 1 else 30.0, None) for i in range(4)])
+    return db_path
+
+
+def test_range_columns_are_typed_arrays(tmp_path):
+    db_path = recorded_database(tmp_path)
+    db_functions.add_comment(db_path, TABLE, 3, "door open")
+
+    columns = db_functions.fetch_columns(db_path, TABLE, START, START + 3)
+
+    assert (columns.id.dtype, columns.ts.dtype, columns.time.dtype, columns.temps.dtype) == \
+        (np.int64, np.int64, np.dtype("datetime64[s]"), np.float32)
+    assert columns.ts.tolist() == [START + i for i in range(4)]
+    assert columns.time.astype(np.int64).tolist() == [db_functions.local_datetime64(START + i).astype(np.int64)
+                                                      for i in range(4)]
+    # Channels without a single reading are left out
+    assert columns.names == ("T1", "T2")
+    np.testing.assert_array_equal(columns.temps, [[20.0, 30.0], [21.0, np.nan], [22.0, 30.0], [23.0, 30.0]])
+    np.testing.assert_allclose(columns.avg, [25.0, 21.0, 26.0, 26.5])
+    assert columns.comments == {2: "door open"}
+
+
+def test_row_api_matches_the_columns(tmp_path):
+    db_path = recorded_database(tmp_path)
+
+    rows = db_functions.fetch_filtered_data(db_path, TABLE, START, START + 3)
+
+    assert rows[1] == (2, START + 1, 21.0, None, 21.0, None)
+    assert [row[0] for row in rows] == [1, 2, 3, 4]
+
+
+def test_rows_after_the_last_plotted_id_keep_the_plot_channels(tmp_path):
+    db_path = recorded_database(tmp_path)
+    plotted = db_functions.fetch_columns(db_path, TABLE, START, START + 3)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + 4, 24.0, None, None), (START + 5, 25.0, None, 40.0)])
+
+    new = db_functions.fetch_columns_after_id(db_path, TABLE, int(plotted.id[-1]), START, plotted.names)
+
+    # T2 has no new reading but stays, T3 is not in the plot
+    assert new.names == plotted.names
+    assert new.id.tolist() == [5, 6]
+    np.testing.assert_array_equal(new.temps, [[24.0, np.nan], [25.0, np.nan]])
+    assert len(db_functions.fetch_columns_after_id(db_path, TABLE, 6, START, plotted.names).id) == 0
@@ -0,0 +1,87 @@
+import sqlite3
+
+import pytest
+
+import comments
+import db_functions
+import db_manager
+import migrations
+from test_query_plans import BASELINE_SCHEMA, TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    yield
+    db_functions.close_connections()
+
+
+def recorded_database(tmp_path):
+    db_path = str(tmp_path / "comments.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + i * 60, 20.0, 21.0, 22.0) for i in range(10)])
+    return db_path
+
+
+def sample_comments(db_path):
+    with db_manager.reader(db_path) as conn:
+        return dict(conn.execute(f"SELECT sample_id, text FROM {comments.comment_table(TABLE)} WHERE sample_id IS NOT NULL"))
+
+
+def test_sample_comment_is_set_replaced_and_removed(tmp_path):
+    db_path = recorded_database(tmp_path)
+
+    assert db_functions.add_comment(db_path, TABLE, 3, "heater on")
+    assert db_functions.add_comment(db_path, TABLE, 3, "heater off")
+    assert not db_functions.add_comment(db_path, TABLE, 99, "no such sample")
+    assert not db_functions.add_comment(db_path, TABLE, 4, "a" * 251)
+    assert sample_comments(db_path) == {3: "heater off"}
+
+    db_functions.add_comment(db_path, TABLE, 3, "")
+    assert sample_comments(db_path) == {}
+
+
+def test_span_comments_are_found_by_overlap(tmp_path):
+    db_path = recorded_database(tmp_path)
+    db_functions.add_comment(db_path, TABLE, 2, "sample note")
+    # Given backwards, stored in order
+    span_id = db_functions.add_span_comment(db_path, TABLE, START + 300, START + 120, "door open")
+
+    assert db_functions.fetch_comment_spans(db_path, TABLE, START + 240, START + 600) == \
+        [(span_id, START + 120, START + 300, "door open")]
+    assert db_functions.fetch_comment_spans(db_path, TABLE, START + 301, START + 600) == []
+
+    db_functions.delete_span_comment(db_path, TABLE, span_id)
+    assert db_functions.fetch_comment_spans(db_path, TABLE, START, START + 600) == []
+    assert [row[3] for row in db_functions.search_comments(db_path, TABLE, "note")] == ["sample note"]
+
+
+def test_search_matches_word_prefixes(tmp_path):
+    db_path = recorded_database(tmp_path)
+    db_functions.add_comment(db_path, TABLE, 1, "heater fluctuating")
+    db_functions.add_comment(db_path, TABLE, 2, "heater stable")
+    db_functions.add_span_comment(db_path, TABLE, START, START + 60, 'window "open"')
+
+    assert [row[0] for row in db_functions.search_comments(db_path, TABLE, "heat flu")] == [1]
+    assert sorted(row[0] for row in db_functions.search_comments(db_path, TABLE, "heater")) == [1, 2]
+    assert [row[3] for row in db_functions.search_comments(db_path, TABLE, '"open')] == ['window "open"']
+    assert db_functions.search_comments(db_path, TABLE, "  ") == []
+
+
+def test_removed_comment_stays_removed_when_old_comments_are_moved(tmp_path):
+    db_path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(f"INSERT INTO {TABLE} (data, T1, T2, T3, comment) VALUES (?, 20.0, 21.0, 22.0, ?)",
+                     [("2024-01-01 00:00:00", "calibrated"), ("2024-01-01 00:01:00", "moved probe")])
+    conn.commit()
+    conn.close()
+    db_functions.create_db(db_path, TABLE)
+
+    db_functions.add_comment(db_path, TABLE, 1, "")
+    migrations.run_migrations(db_path, TABLE)
+
+    assert sample_comments(db_path) == {2: "moved probe"}
+    with db_manager.reader(db_path) as conn:
+        assert conn.execute(f"SELECT comment FROM {TABLE} WHERE id = 1").fetchone()[0] is None
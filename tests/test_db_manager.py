@@ -0,0 +1,100 @@
+import sqlite3
+import threading
+
+import pytest
+
+import db_functions
+import db_manager
+
+
+@pytest.fixture
+def manager(tmp_path, monkeypatch):
+    monkeypatch.setattr(db_manager, "PRAGMAS", dict(db_manager.PRAGMAS))
+    manager = db_manager.get_manager(str(tmp_path / "managed.db"))
+    with manager.writer() as conn:
+        conn.execute("CREATE TABLE samples (id INTEGER PRIMARY KEY, value REAL)")
+    yield manager
+    db_manager.close_all()
+
+
+def count_samples(manager):
+    with manager.reader() as conn:
+        return conn.execute("SELECT COUNT(*) FROM samples").fetchone()[0]
+
+
+def test_writer_connection_is_reused_and_rolls_back_on_error(manager):
+    with manager.writer() as first:
+        first.execute("INSERT INTO samples (value) VALUES (1.0)")
+    with pytest.raises(ValueError):
+        with manager.writer() as second:
+            second.execute("INSERT INTO samples (value) VALUES (2.0)")
+            raise ValueError("failed half way")
+
+    assert second is first
+    with manager.reader() as conn:
+        assert conn.execute("SELECT value FROM samples").fetchall() == [(1.0,)]
+
+
+def test_readers_are_pooled_and_read_only(manager):
+    held = [manager.acquire_reader() for _ in range(db_manager.READER_POOL_SIZE)]
+    with pytest.raises(sqlite3.OperationalError):
+        held[0].execute("INSERT INTO samples (value) VALUES (1.0)")
+
+    # With every reader out, the next caller waits for one to come back
+    got = []
+    waiter = threading.Thread(target=lambda: got.append(manager.acquire_reader()))
+    waiter.start()
+    waiter.join(0.2)
+    assert waiter.is_alive()
+    manager.readers.put(held.pop())
+    waiter.join(5)
+
+    assert manager.readers_created == db_manager.READER_POOL_SIZE
+    assert len({id(conn) for conn in held + got}) == db_manager.READER_POOL_SIZE
+    for conn in held + got:
+        manager.readers.put(conn)
+
+
+def test_configure_reconnects_only_when_a_setting_changes(manager):
+    with manager.writer():
+        pass  # open the writer connection
+
+    db_manager.configure(cache_size_kb=-db_manager.PRAGMAS["cache_size"])
+    assert db_manager.get_manager(manager.db_path) is manager
+
+    db_manager.configure(cache_size_kb=1024)
+    reopened = db_manager.get_manager(manager.db_path)
+    assert manager.closed and reopened is not manager
+    with reopened.writer() as conn:
+        assert conn.execute("PRAGMA cache_size").fetchone()[0] == -1024
+
+
+def test_readers_see_the_last_commit_while_the_writer_is_busy(manager):
+    with manager.reader() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+
+    with manager.writer() as writer:
+        writer.execute("INSERT INTO samples (value) VALUES (1.0)")
+        # A reader on another thread neither waits for the open write transaction nor sees it
+        counts = []
+        reader = threading.Thread(target=lambda: counts.append(count_samples(manager)))
+        reader.start()
+        reader.join(2)
+        assert counts == [0]
+
+    assert count_samples(manager) == 1
+
+
+def test_storage_settings_are_applied_only_when_they_change(manager, monkeypatch):
+    applied = []
+    monkeypatch.setattr(db_manager, "configure", lambda **settings: applied.append(settings))
+    monkeypatch.setattr(db_functions, "_storage_settings", {})
+    config = {"db_synchronous": "NORMAL", "db_cache_size_kb": 8192, "db_mmap_size_mb": 64, "db_wal_autocheckpoint": 1000,
+              "query_cache_mb": 0, "binary_store": False}
+
+    for _ in range(3):  # every window constructs a Config
+        db_functions.configure_database(manager.db_path, config)
+    config["db_synchronous"] = "FULL"
+    db_functions.configure_database(manager.db_path, config)
+
+    assert [settings["synchronous"] for settings in applied] == ["NORMAL", "FULL"]
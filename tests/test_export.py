@@ -0,0 +1,86 @@
+import csv
+import gzip
+import threading
+
+import pytest
+
+import db_functions
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    yield
+    db_functions.close_connections()
+
+
+def recorded_database(tmp_path, rows=50):
+    # Several samples per second, so batches end in the middle of a second
+    db_path = str(tmp_path / "export.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + i // 4, float(i), None if i % 5 == 0 else 1.0, 2.0)
+                                                    for i in range(rows)])
+    return db_path
+
+
+def read_csv(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", newline="", encoding="utf-8") as f:
+        return list(csv.reader(f))
+
+
+@pytest.mark.parametrize("file_name", ["export.csv", "export.csv.gz"])
+def test_whole_table_export_writes_every_row(tmp_path, file_name):
+    db_path = recorded_database(tmp_path)
+    output = str(tmp_path / file_name)
+    reports = []
+
+    rows, _ = db_functions.export_file(db_path, TABLE, output, progress=lambda *report: reports.append(report))
+
+    lines = read_csv(output)
+    assert lines[0] == ["id", "data", "T1", "T2", "T3", "comment"]
+    assert rows == len(lines) - 1 == 50
+    assert [int(line[0]) for line in lines[1:]] == list(range(1, 51))
+    assert lines[1][3] == ""  # a missing reading is an empty field
+    assert reports[-1][:2] == (50, 50)
+
+
+def test_range_batches_cover_every_row_once(tmp_path):
+    db_path = recorded_database(tmp_path)
+
+    total, batches = db_functions.export_batches(db_path, TABLE, START + 2, START + 9, batch_size=3)
+    batches = list(batches)
+
+    ids = [sample_id for columns in batches for sample_id in columns.id.tolist()]
+    assert ids == list(range(9, 41)) and total == len(ids)
+    assert max(len(columns.id) for columns in batches) == 3
+
+
+def test_cancelled_export_stops_between_batches(tmp_path):
+    db_path = recorded_database(tmp_path)
+    cancel_event = threading.Event()
+    cancel_event.set()
+
+    with pytest.raises(db_functions.ExportCancelled):
+        db_functions.export_file(db_path, TABLE, str(tmp_path / "cancelled.csv"), cancel_event=cancel_event)
+
+
+@pytest.mark.parametrize("file_name", ["export.parquet", "export.feather"])
+def test_columnar_export_keeps_types_nulls_and_comments(tmp_path, file_name):
+    columnar_export = pytest.importorskip("columnar_export")
+    db_path = recorded_database(tmp_path)
+    db_functions.add_comment(db_path, TABLE, 2, "probe moved")
+    output = str(tmp_path / file_name)
+
+    rows, _ = columnar_export.export_columnar(db_path, TABLE, output, chunk_rows=16, progress=lambda *report: None)
+
+    frame = columnar_export.load_columnar(output)
+    assert rows == len(frame) == 50
+    assert frame["id"].tolist() == list(range(1, 51))
+    assert [str(frame[name].dtype) for name in ("T1", "T2", "T3")] == ["float32"] * 3
+    assert [time.timestamp() for time in frame["time"][:5]] == [START] * 4 + [START + 1]
+    assert frame["T2"].isna().tolist() == [i % 5 == 0 for i in range(50)]
+    assert frame["comment"].isna().tolist()[:3] == [True, False, True]
+    assert frame["comment"][1] == "probe moved"
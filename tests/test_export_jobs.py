@@ -0,0 +1,67 @@
+import os
+
+import pytest
+
+import db_functions
+import export_jobs
+from test_export import recorded_database
+from test_query_plans import TABLE
+
+
+@pytest.fixture
+def runner():
+    runner = export_jobs.ExportRunner()
+    runner.start()
+    yield runner
+    runner.stop()
+    db_functions.close_connections()
+
+
+def run_queue(runner):
+    # stop() cancels what is still queued; end the thread after the last job instead
+    runner.jobs.put(None)
+    runner.join(10)
+
+
+def test_jobs_run_in_order_and_cancelled_ones_are_skipped(tmp_path, runner):
+    db_path = recorded_database(tmp_path)
+    paths = [str(tmp_path / name) for name in ("first.csv", "skipped.csv", "third.csv.gz")]
+    jobs = [export_jobs.ExportJob(db_path, TABLE, path) for path in paths]
+    jobs[1].cancel()
+
+    for job in jobs:
+        runner.submit(job)
+    run_queue(runner)
+
+    assert [job.state for job in jobs] == [export_jobs.DONE, export_jobs.CANCELLED, export_jobs.DONE]
+    assert [os.path.exists(path) for path in paths] == [True, False, True]
+    assert (jobs[0].rows, jobs[0].total, jobs[0].fraction()) == (50, 50, 1.0)
+    assert not runner.pending()
+
+
+def test_cancelling_a_running_job_removes_its_partial_file(tmp_path, runner, monkeypatch):
+    db_path = recorded_database(tmp_path)
+    job = export_jobs.ExportJob(db_path, TABLE, str(tmp_path / "cancelled.csv"))
+    csv_rows = db_functions.csv_rows
+
+    def cancel_after_first_batch(batches, with_id):
+        for rows in csv_rows(batches, with_id):
+            job.cancel()  # the user presses Cancel while the first batch is on its way
+            yield rows
+
+    monkeypatch.setattr(db_functions, "csv_rows", cancel_after_first_batch)
+
+    runner.submit(job)
+    run_queue(runner)
+
+    assert job.state == export_jobs.CANCELLED
+    assert not os.path.exists(job.output_name)
+
+
+def test_failed_job_keeps_its_error(tmp_path, runner):
+    db_path = recorded_database(tmp_path)
+    job = runner.submit(export_jobs.ExportJob(db_path, TABLE, str(tmp_path / "missing" / "out.csv")))
+    run_queue(runner)
+
+    assert job.state == export_jobs.FAILED
+    assert "out.csv" in job.error
@@ -0,0 +1,76 @@
+import pytest
+
+import db_functions
+import query_cache
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def cache():
+    cache = query_cache.get_cache()
+    query_cache.configure(8)
+    cache.clear()
+    cache.hits = cache.misses = 0
+    yield cache
+    cache.clear()
+    query_cache.configure(query_cache.DEFAULT_BUDGET_MB)
+    db_functions.close_connections()
+
+
+def recorded_database(tmp_path):
+    db_path = str(tmp_path / "cached.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + i, 20.0, 21.0, 22.0) for i in range(10)])
+    return db_path
+
+
+def test_rows_after_a_range_keep_it_cached(tmp_path, cache):
+    db_path = recorded_database(tmp_path)
+    first = db_functions.fetch_columns(db_path, TABLE, START, START + 5)
+
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + 20, 30.0, 31.0, 32.0)])
+
+    assert db_functions.fetch_columns(db_path, TABLE, START, START + 5) is first
+    assert (cache.hits, cache.misses) == (1, 1)
+    assert not first.temps.flags.writeable
+
+
+def test_late_row_inside_a_range_invalidates_it(tmp_path, cache):
+    db_path = recorded_database(tmp_path)
+    first = db_functions.fetch_columns(db_path, TABLE, START, START + 5)
+
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + 3, 30.0, 31.0, 32.0)])
+
+    second = db_functions.fetch_columns(db_path, TABLE, START, START + 5)
+    assert second is not first
+    assert len(second.id) == len(first.id) + 1
+    assert cache.misses == 2
+
+
+def test_comment_invalidates_ranges_with_comments(tmp_path, cache):
+    db_path = recorded_database(tmp_path)
+    by_time = db_functions.fetch_columns(db_path, TABLE, START, START + 5)
+    by_id = db_functions.fetch_columns_by_id(db_path, TABLE, 1, 5)
+
+    db_functions.add_comment(db_path, TABLE, 2, "fan on")
+
+    assert db_functions.fetch_columns(db_path, TABLE, START, START + 5).comments == {1: "fan on"}
+    assert db_functions.fetch_columns_by_id(db_path, TABLE, 1, 5).comments == {1: "fan on"}
+    assert by_time.comments == by_id.comments == {}
+    assert cache.misses == 4
+
+
+def test_least_recently_used_entries_are_evicted_by_size():
+    cache = query_cache.RangeCache(max_bytes=250)
+    entry = lambda name, nbytes: query_cache.CacheEntry(name, 0, None, None, False, nbytes)
+    cache.put("a", entry("a", 100))
+    cache.put("b", entry("b", 100))
+    cache.get("a")
+
+    cache.put("c", entry("c", 100))
+    cache.put("huge", entry("huge", 1000))  # never fits, evicts nothing
+
+    assert list(cache.entries) == ["a", "c"]
+    assert (cache.bytes, cache.evictions) == (200, 1)
@@ -0,0 +1,51 @@
+import sqlite3
+
+import pytest
+
+import db_functions
+import migrations
+
+TABLE = "temps"
+
+# The table as the app created it before epoch timestamps, rollups, comments and readings existed
+BASELINE_SCHEMA = f"""
+CREATE TABLE {TABLE} (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    data DATETIME DEFAULT CURRENT_TIMESTAMP,
+    T1 FLOAT(10,2),
+    T2 FLOAT(10,2),
+    T3 FLOAT(10,2),
+    comment VARCHAR(250) DEFAULT ''
+);
+"""
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    yield
+    db_functions.close_connections()
+
+
+def test_fresh_database_has_no_full_scans(tmp_path):
+    db_path = str(tmp_path / "fresh.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [("2024-01-01 00:00:00", 20.0, 21.0, 22.0)])
+
+    assert db_functions.check_query_plans(db_path, TABLE) == []
+
+
+def test_migrated_baseline_database_has_no_full_scans(tmp_path):
+    db_path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(f"INSERT INTO {TABLE} (data, T1, T2, T3, comment) VALUES (?, ?, ?, ?, ?)",
+                     [(f"2024-01-01 00:{minute:02d}:00", 20.0, 21.0, 22.0, "probe moved" if minute == 3 else "")
+                      for minute in range(60)])
+    conn.commit()
+    conn.close()
+
+    db_functions.create_db(db_path, TABLE)
+    migrations.run_migrations(db_path, TABLE)
+
+    assert not migrations.pending_migrations(db_path, TABLE)
+    assert db_functions.check_query_plans(db_path, TABLE) == []
@@ -0,0 +1,71 @@
+import sqlite3
+
+import numpy as np
+import pytest
+
+import db_functions
+import db_manager
+import migrations
+import query_cache
+from test_query_plans import BASELINE_SCHEMA, TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    query_cache.configure(0)
+    yield
+    db_functions.close_connections()
+
+
+def test_columns_have_every_channel_and_same_second_samples(tmp_path):
+    db_path = str(tmp_path / "channels.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START, 20.0, None, 22.0, 30.0), (START, 21.0, 23.0, None, 31.0),
+                                                    (START + 1, 19.0, 20.0, 21.0, 22.0)])
+
+    columns = db_functions.fetch_columns(db_path, TABLE, START, START + 1)
+
+    assert columns.names == ("T1", "T2", "T3", "T4")
+    assert columns.id.tolist() == [1, 2, 3]
+    np.testing.assert_array_equal(columns.temps[:2], [[20.0, np.nan, 22.0, 30.0], [21.0, 23.0, np.nan, 31.0]])
+    # Missing readings do not count towards the average
+    np.testing.assert_allclose(columns.avg, [24.0, 25.0, 20.5])
+
+
+def test_migrated_baseline_database_reads_the_same_values(tmp_path):
+    db_path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.executemany(f"INSERT INTO {TABLE} (data, T1, T2, T3) VALUES (?, ?, ?, ?)",
+                     [(f"2024-01-01 00:{minute:02d}:00", 20.0 + minute, 21.0, None if minute % 2 else 22.0)
+                      for minute in range(60)])
+    conn.commit()
+    conn.close()
+
+    db_functions.create_db(db_path, TABLE)
+    start, end = db_functions.get_date_range(db_path, TABLE)
+    before = db_functions.fetch_columns(db_path, TABLE, start, end)
+    migrations.run_migrations(db_path, TABLE)
+    after = db_functions.fetch_columns(db_path, TABLE, start, end)
+
+    assert after.names == before.names == ("T1", "T2", "T3")
+    np.testing.assert_array_equal(after.temps, before.temps)
+    _, hourly = db_functions.fetch_plot_columns(db_path, TABLE, start, end, max_points=1)
+    np.testing.assert_allclose(hourly.temps[0], [np.nanmean(after.temps[:, 0]), 21.0, 22.0])
+
+
+def test_batch_readings_are_keyed_to_their_samples_after_an_id_gap(tmp_path):
+    db_path = str(tmp_path / "gap.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + i, 10.0 + i, 0.0, 0.0) for i in range(3)])
+    # AUTOINCREMENT does not reuse the id of the deleted newest sample
+    with db_manager.writer(db_path) as conn:
+        conn.execute(f"DELETE FROM {TABLE} WHERE id = 3")
+
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + 10 + i, 20.0 + i, 1.0, 2.0) for i in range(3)])
+
+    columns = db_functions.fetch_columns(db_path, TABLE, START + 10, START + 12)
+    assert columns.id.tolist() == [4, 5, 6]
+    np.testing.assert_array_equal(columns.temps, [[20.0, 1.0, 2.0], [21.0, 1.0, 2.0], [22.0, 1.0, 2.0]])
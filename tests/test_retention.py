@@ -0,0 +1,45 @@
+import pytest
+
+import db_functions
+import db_manager
+import retention
+import rollups
+from test_query_plans import TABLE
+from test_shards import sharded_database
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+DAY = 86400
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    yield
+    db_functions.close_connections()
+
+
+def day_rollups(db_path):
+    with db_manager.reader(db_path) as conn:
+        return conn.execute(f"SELECT * FROM {rollups.rollup_table(TABLE, 'day')} ORDER BY bucket, sensor_id").fetchall()
+
+
+def test_late_sample_keeps_aged_day_summary(tmp_path):
+    db_path = str(tmp_path / "aged.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + hour * 3600, 20.0, 21.0, 22.0) for hour in range(10 * 24)])
+    retention.apply_retention(db_path, TABLE, raw_days=30, rollup_months=1, now=START + 120 * DAY, pause=0, verbose=False)
+    kept = day_rollups(db_path)
+    assert len(kept) == 10 * 3
+
+    # A spool replayed long after the fact
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + 4 * DAY + 3600, 100.0, 100.0, 100.0)])
+
+    assert day_rollups(db_path) == kept
+
+
+def test_plan_lists_partly_aged_shards(tmp_path):
+    db_path = sharded_database(tmp_path)
+
+    steps = retention.plan(db_path, TABLE, raw_days=1, rollup_months=0, now=START + 10 * DAY)
+
+    assert [(step.kind, step.target) for step in steps if step.kind in ("shard", "kept")] == \
+        [("shard", "2024-W01"), ("kept", "2024-W02")]
@@ -0,0 +1,63 @@
+import numpy as np
+import pytest
+
+import db_functions
+import db_manager
+import query_cache
+import readings
+import rollups
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+STEP = 317  # seconds between samples, not aligned to any bucket
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    query_cache.configure(0)
+    yield
+    db_functions.close_connections()
+
+
+def recorded_database(tmp_path):
+    # Two days of samples written in batches, one of them late and out of order, with gaps in T2
+    db_path = str(tmp_path / "rollups.db")
+    db_functions.create_db(db_path, TABLE)
+    rng = np.random.default_rng(0)
+    rows = [(START + i * STEP, float(rng.normal(20, 2)), None if i % 7 == 0 else float(rng.normal(30, 2)), 25.0)
+            for i in range(2 * 86400 // STEP)]
+    late = rows[100:140]
+    batches = rows[:100], rows[140:300], late, rows[300:]
+    for batch in batches:
+        db_functions.insert_many_to_db(db_path, TABLE, batch)
+    return db_path
+
+
+@pytest.mark.parametrize("resolution, bucket_seconds", rollups.RESOLUTIONS)
+@pytest.mark.filterwarnings("ignore:Mean of empty slice")  # minutes with only a missing T2
+def test_rollup_means_match_the_raw_samples(tmp_path, resolution, bucket_seconds):
+    db_path = recorded_database(tmp_path)
+    end = START + 2 * 86400
+    raw = db_functions.fetch_columns(db_path, TABLE, START, end)
+
+    columns = db_functions.load_rollup_columns(db_path, TABLE, resolution, START, end)
+
+    raw_buckets = raw.ts // bucket_seconds * bucket_seconds
+    assert columns.ts.tolist() == np.unique(raw_buckets).tolist()
+    expected = [np.nanmean(raw.temps[raw_buckets == bucket], axis=0) for bucket in columns.ts]
+    np.testing.assert_allclose(columns.temps, expected, rtol=1e-5)
+
+
+def test_rollup_extremes_and_counts_match_the_raw_samples(tmp_path):
+    db_path = recorded_database(tmp_path)
+    raw = db_functions.fetch_columns(db_path, TABLE, START, START + 2 * 86400)
+
+    with db_manager.reader(db_path) as conn:
+        days = conn.execute(f"SELECT bucket, readings, minimum, maximum FROM {rollups.rollup_table(TABLE, 'day')} "
+                            f"WHERE sensor_id = (SELECT MIN(sensor_id) FROM {readings.sensors_table(TABLE)} WHERE name = 'T2') "
+                            f"ORDER BY bucket").fetchall()
+
+    for bucket, count, minimum, maximum in days:
+        values = raw.temps[raw.ts // 86400 * 86400 == bucket, 1]
+        values = values[~np.isnan(values)]
+        assert (count, minimum, maximum) == (len(values), pytest.approx(values.min()), pytest.approx(values.max()))
@@ -0,0 +1,56 @@
+import shutil
+
+import pytest
+
+import wire_reader
+from sensor_registry import SensorRegistry
+from test_wire_reader import fake_bus
+from w1_simulator import w1_slave_text
+
+
+@pytest.fixture(autouse=True)
+def shutdown_executor():
+    yield
+    wire_reader.shutdown_executor()
+
+
+def registry(tmp_path, base_dir):
+    return SensorRegistry(base_dir, str(tmp_path / "channels.json"), rescan_interval=3600)
+
+
+def test_channels_survive_unplug_hot_plug_and_restart(tmp_path):
+    base_dir, sensors = fake_bus(tmp_path, [20.0, 21.0, 22.0])
+    sensor_registry = registry(tmp_path, base_dir)
+    assert sensor_registry.read().temps == [20.0, 21.0, 22.0]
+
+    shutil.rmtree(sensors[1])
+    # sysfs fails reads on the open handles of a removed device, a deleted regular file does not
+    sensor_registry.close()
+    sample = sensor_registry.read(fallback="null")
+    assert sample.temps == [20.0, None, 22.0]
+    assert sample.flags[1] == wire_reader.FLAG_MISSING
+    assert sensor_registry.rescan_requested
+
+    # A new sensor takes the next free channel, the unplugged one keeps T2 for when it returns
+    (tmp_path / "devices" / "28-00000000000a").mkdir()
+    (tmp_path / "devices" / "28-00000000000a" / "w1_slave").write_text(w1_slave_text(30.0))
+    assert sensor_registry.read().temps == [20.0, None, 22.0, 30.0]
+    sensor_registry.close()
+
+    restarted = registry(tmp_path, base_dir)
+    sample = restarted.read()
+    assert sample.sensors == ["28-000000000000", None, "28-000000000002", "28-00000000000a"]
+    restarted.close()
+
+
+def test_stale_read_waits_for_the_periodic_rescan(tmp_path):
+    base_dir, sensors = fake_bus(tmp_path, [20.0])
+    sensor_registry = registry(tmp_path, base_dir)
+    sensor_registry.read()
+    (tmp_path / "devices" / "28-000000000000" / "w1_slave").write_text(w1_slave_text(20.0, crc_ok=False))
+
+    sample = sensor_registry.read(retries=0)
+
+    assert sample.flags == [wire_reader.FLAG_STALE]
+    assert not sensor_registry.rescan_requested
+    sensor_registry.close()
@@ -0,0 +1,47 @@
+import os
+
+import pytest
+
+import binary_store
+import db_functions
+import migrations
+import shards
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC, a Monday
+WEEK = 7 * 86400
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    yield
+    db_functions.close_connections()
+
+
+def sharded_database(tmp_path, weeks=3, live_rows=2):
+    # Hourly samples for some weeks moved to weekly shards, then a few live ones
+    db_path = str(tmp_path / "sharded.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + hour * 3600, 20.0, 21.0, 22.0) for hour in range(weeks * 7 * 24)])
+    migrations.rotate_shards(db_path, TABLE, "week", now=START + weeks * WEEK + 2 * 86400, pause=0, verbose=False)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START + weeks * WEEK + i, 20.0, 21.0, 22.0) for i in range(live_rows)])
+    return db_path
+
+
+def test_last_n_id_range_spans_several_shards(tmp_path):
+    db_path = sharded_database(tmp_path)
+    assert len(shards.list_shards(db_path, TABLE)) == 3
+    last_id = 3 * 7 * 24 + 2
+
+    assert db_functions.fetch_last_n_id_range(db_path, TABLE, 2) == (last_id - 1, last_id)
+    # More than the live rows and the newest shard hold
+    assert db_functions.fetch_last_n_id_range(db_path, TABLE, 7 * 24 + 100) == (last_id - 7 * 24 - 99, last_id)
+    assert db_functions.fetch_last_n_id_range(db_path, TABLE, 10 ** 6) == (1, last_id)
+
+
+def test_discarding_a_disabled_store_creates_no_file(tmp_path):
+    db_path = sharded_database(tmp_path, weeks=1)
+
+    assert not os.path.exists(binary_store.store_path(db_path, TABLE))
+    binary_store.discard(db_path, TABLE)
+    assert not os.path.exists(binary_store.store_path(db_path, TABLE))
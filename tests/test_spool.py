@@ -0,0 +1,44 @@
+import os
+
+import pytest
+
+import db_functions
+import db_manager
+import spool
+from test_query_plans import TABLE
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def close_connections():
+    yield
+    db_functions.close_connections()
+
+
+def row_count(db_path):
+    with db_manager.reader(db_path) as conn:
+        return conn.execute(f"SELECT COUNT(*) FROM {TABLE}").fetchone()[0]
+
+
+def test_spool_of_another_database_is_set_aside(tmp_path):
+    spool_dir = str(tmp_path / "spool")
+    old_db, new_db = str(tmp_path / "old.db"), str(tmp_path / "new.db")
+    for db_path in (old_db, new_db):
+        db_functions.create_db(db_path, TABLE)
+    # Records for the old database that never reached it
+    old_spool = spool.Spool(spool_dir, spool.spool_identity(old_db, TABLE))
+    for i in range(5):
+        old_spool.append(START + i, [20.0, 21.0, 22.0])
+    old_spool.close()
+
+    new_spool, drainer = spool.open_spool(spool_dir, new_db, TABLE)
+    drainer.stop()
+    new_spool.close()
+
+    assert row_count(new_db) == 0
+    foreign = os.path.join(spool_dir, spool.FOREIGN_DIR, spool.spool_identity(old_db, TABLE).replace(":", "-"))
+    old_spool, drainer = spool.open_spool(foreign, old_db, TABLE)
+    drainer.stop()
+    old_spool.close()
+    assert row_count(old_db) == 5
@@ -0,0 +1,71 @@
+import sqlite3
+import time
+
+import pytest
+
+import db_functions
+import db_manager
+import migrations
+from test_query_plans import TABLE, BASELINE_SCHEMA
+
+START = 1704067200  # 2024-01-01 00:00:00 UTC
+
+
+@pytest.fixture(autouse=True)
+def local_timezone(monkeypatch):
+    # A zone away from UTC, so that a UTC value cannot pass for local time
+    monkeypatch.setenv("TZ", "Europe/Berlin")
+    time.tzset()
+    yield
+    db_functions.close_connections()
+    monkeypatch.undo()
+    time.tzset()
+
+
+def table_columns(db_path):
+    with db_manager.reader(db_path) as conn:
+        return [row[1] for row in conn.execute(f"PRAGMA table_xinfo({TABLE})")]
+
+
+def test_new_table_keeps_time_only_in_ts(tmp_path):
+    db_path = str(tmp_path / "fresh.db")
+    db_functions.create_db(db_path, TABLE)
+    db_functions.insert_many_to_db(db_path, TABLE, [(START, 20.0, 21.0, 22.0)])
+
+    assert table_columns(db_path) == ["id", "ts"]
+    assert db_functions.fetch_last_n_records(db_path, TABLE, 1) == ("2024-01-01 01:00:00",) * 2
+
+
+def test_migrated_table_gets_local_time_text(tmp_path):
+    db_path = str(tmp_path / "baseline.db")
+    conn = sqlite3.connect(db_path)
+    conn.executescript(BASELINE_SCHEMA)
+    conn.execute(f"INSERT INTO {TABLE} (data, T1, T2, T3) VALUES ('2024-01-01 00:30:00', 20.0, 21.0, 22.0)")
+    conn.commit()
+    conn.close()
+    db_functions.create_db(db_path, TABLE)
+    migrations.run_migrations(db_path, TABLE)
+
+    db_functions.insert_many_to_db(db_path, TABLE, [(START, 20.0, 21.0, 22.0)])
+
+    with db_manager.reader(db_path) as conn:
+        rows = conn.execute(f"SELECT data, ts FROM {TABLE} ORDER BY id").fetchall()
+    # The old row's text was local time; the new one is written the same way
+    assert [text for text, _ in rows] == ["2024-01-01 00:30:00", "2024-01-01 01:00:00"]
+    assert [db_functions.epoch_to_text(ts) for _, ts in rows] == [text for text, _ in rows]
+
+
+@pytest.mark.skipif(sqlite3.sqlite_version_info < (3, 35, 0), reason="DROP COLUMN needs SQLite 3.35")
+def test_generated_utc_text_column_is_dropped(tmp_path):
+    db_path = str(tmp_path / "generated.db")
+    conn = sqlite3.connect(db_path)
+    conn.execute(f"CREATE TABLE {TABLE} (id INTEGER PRIMARY KEY AUTOINCREMENT, ts INTEGER NOT NULL, "
+                 f"data TEXT GENERATED ALWAYS AS (datetime(ts, 'unixepoch')) VIRTUAL)")
+    conn.execute(f"INSERT INTO {TABLE} (ts) VALUES (?)", (START,))
+    conn.commit()
+    conn.close()
+
+    db_functions.create_db(db_path, TABLE)
+
+    assert table_columns(db_path) == ["id", "ts"]
+    assert db_functions.table_layout(db_path, TABLE)["ts_complete"]
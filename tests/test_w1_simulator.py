@@ -0,0 +1,58 @@
+import time
+
+import pytest
+
+import wire_reader
+from sensor_registry import SensorRegistry
+from w1_simulator import W1Simulator, crc8, w1_slave_text
+
+
+@pytest.fixture(autouse=True)
+def shutdown_executor():
+    yield
+    wire_reader.shutdown_executor()
+
+
+@pytest.mark.parametrize("temp", [25.5, -10.25, 0.0, 85.0])
+def test_w1_slave_text_parses_like_the_driver_output(temp):
+    text = w1_slave_text(temp)
+    scratchpad = [int(byte, 16) for byte in text.split(":")[0].split()]
+
+    assert crc8(scratchpad[:8]) == scratchpad[8]
+    assert wire_reader.read_1wire_sensor("28-x", read_raw=lambda _: text.splitlines(True)) == temp
+
+
+def test_same_seed_gives_the_same_bus():
+    first, second = W1Simulator(sensors=3, seed=7), W1Simulator(sensors=3, seed=7)
+
+    assert [sensor.rom_id for sensor in first.sensors] == [sensor.rom_id for sensor in second.sensors]
+    assert [[sensor.convert() for _ in range(5)] for sensor in first.sensors] == \
+        [[sensor.convert() for _ in range(5)] for sensor in second.sensors]
+
+
+def test_registry_reads_a_blocking_bus_in_one_conversion(tmp_path):
+    with W1Simulator(sensors=6, root_dir=str(tmp_path / "w1"), conversion_delay=0.1, bulk_read=False) as simulator:
+        sensor_registry = SensorRegistry(simulator.base_dir, str(tmp_path / "channels.json"))
+        started = time.monotonic()
+        sample = sensor_registry.read()
+        elapsed = time.monotonic() - started
+        sensor_registry.close()
+
+    assert sample.flags == [wire_reader.FLAG_OK] * 6
+    assert sorted(sample.sensors) == sorted(sensor.rom_id for sensor in simulator.sensors)
+    # Six conversions one after the other would take 0.6 s
+    assert elapsed < 0.4
+
+
+def test_registry_bulk_read_reads_the_converted_values(tmp_path):
+    with W1Simulator(sensors=3, root_dir=str(tmp_path / "w1"), conversion_delay=0.1) as simulator:
+        sensor_registry = SensorRegistry(simulator.base_dir, str(tmp_path / "channels.json"))
+        sample = sensor_registry.read("bulk")
+        sensor_registry.close()
+        with open(simulator.bulk_attribute) as f:
+            status = f.read()
+
+    assert status == "1\n"  # the conversion the read triggered has finished
+    assert sample.flags == [wire_reader.FLAG_OK] * 3
+    expected = {sensor.rom_id: sensor.temp for sensor in simulator.sensors}
+    assert dict(zip(sample.sensors, sample.temps)) == pytest.approx(expected, abs=0.01)
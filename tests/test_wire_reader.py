@@ -0,0 +1,169 @@
+import threading
+import time
+
+import pytest
+
+import wire_reader
+from w1_simulator import w1_slave_text
+
+
+@pytest.fixture(autouse=True)
+def shutdown_executor():
+    yield
+    wire_reader.shutdown_executor()
+
+
+def fake_bus(tmp_path, temps, bulk_read=True, temperature_files=True):
+    # A /sys/bus/w1/devices tree: one bus master and a 28-* directory per sensor
+    base_dir = tmp_path / "devices"
+    master = base_dir / "w1_bus_master1"
+    master.mkdir(parents=True)
+    if bulk_read:
+        (master / "therm_bulk_read").write_text("0\n")
+    sensors = []
+    for number, temp in enumerate(temps):
+        sensor = base_dir / f"28-00000000000{number}"
+        sensor.mkdir()
+        # w1_slave and temperature disagree, so the tests can tell which one was read
+        (sensor / "w1_slave").write_text(w1_slave_text(temp))
+        if temperature_files:
+            (sensor / "temperature").write_text(f"{int((temp + 10) * 1000)}\n")
+        sensors.append(str(sensor))
+    return str(base_dir) + "/", sensors
+
+
+def test_bulk_read_triggers_one_conversion_and_reads_stored_values(tmp_path):
+    base_dir, sensors = fake_bus(tmp_path, [20.5, 21.0])
+    attributes = wire_reader.find_bulk_read_attributes(base_dir)
+    assert attributes == [base_dir + "w1_bus_master1/therm_bulk_read"]
+
+    sample = wire_reader.read_1wire_sensors_bulk(base_dir=base_dir, conversion_time=0.01)
+
+    with open(attributes[0]) as f:
+        assert f.read() == "trigger\n"
+    assert sample.sensors == sensors
+    assert sample.temps == [30.5, 31.0]
+    assert sample.flags == [wire_reader.FLAG_OK] * 2
+
+
+def test_wait_bulk_conversion_gives_up_while_a_bus_is_converting(tmp_path):
+    base_dir, _ = fake_bus(tmp_path, [20.0])
+    attributes = wire_reader.find_bulk_read_attributes(base_dir)
+    with open(attributes[0], "w") as f:
+        f.write("-1\n")
+
+    assert not wire_reader.wait_bulk_conversion(attributes, conversion_time=0.01)
+    with open(attributes[0], "w") as f:
+        f.write("1\n")
+    assert wire_reader.wait_bulk_conversion(attributes, conversion_time=0.01)
+
+
+@pytest.mark.parametrize("bus", [{"bulk_read": False}, {"temperature_files": False}])
+def test_bulk_read_falls_back_to_w1_slave(tmp_path, bus):
+    base_dir, sensors = fake_bus(tmp_path, [20.5, 21.0], **bus)
+
+    sample = wire_reader.read_1wire_sensors_bulk(base_dir=base_dir, conversion_time=0.01)
+
+    assert sample.temps == [20.5, 21.0]
+    assert sample.flags == [wire_reader.FLAG_OK] * 2
+
+
+def test_hung_read_is_reported_at_the_cycle_deadline(tmp_path):
+    _, sensors = fake_bus(tmp_path, [20.0, 21.0, 22.0])
+    hung = sensors[1] + "/w1_slave"
+    hang, release = threading.Event(), threading.Event()
+
+    def read_raw(device_file):
+        if device_file == hung and hang.is_set():
+            release.wait(10)
+        return wire_reader.read_temp_raw(device_file)
+
+    try:
+        wire_reader.read_1wire_sensors_parallel(sensors, read_raw=read_raw, timeout=0.2)
+        hang.set()
+        started = time.monotonic()
+        stale = wire_reader.read_1wire_sensors_parallel(sensors, read_raw=read_raw, timeout=0.2)
+        assert time.monotonic() - started < 0.2 + wire_reader.RETRY_DELAY + 0.2
+        missing = wire_reader.read_1wire_sensors_parallel(sensors, read_raw=read_raw, timeout=0.2, fallback="null")
+    finally:
+        release.set()
+
+    assert stale.flags == [wire_reader.FLAG_OK, wire_reader.FLAG_STALE, wire_reader.FLAG_OK]
+    assert stale.temps == [20.0, 21.0, 22.0]
+    assert missing.flags[1] == wire_reader.FLAG_MISSING and missing.temps[1] is None
+
+
+def test_capped_pool_does_not_stretch_the_cycle(tmp_path):
+    _, sensors = fake_bus(tmp_path, [20.0] * 6)
+
+    def read_raw(device_file):
+        time.sleep(0.3)
+        return wire_reader.read_temp_raw(device_file)
+
+    started = time.monotonic()
+    sample = wire_reader.read_1wire_sensors_parallel(sensors, max_workers=2, read_raw=read_raw, timeout=0.2,
+                                                     fallback="null")
+
+    # Two workers get through two reads before the deadline, the queued ones are given up
+    assert time.monotonic() - started < 0.2 + wire_reader.RETRY_DELAY + 0.2
+    assert sample.flags.count(wire_reader.FLAG_OK) == 2
+    assert sample.flags.count(wire_reader.FLAG_MISSING) == 4
+
+
+def test_crc_failures_use_up_the_retry_budget(tmp_path):
+    _, sensors = fake_bus(tmp_path, [20.0])
+    with open(sensors[0] + "/w1_slave", "w") as f:
+        f.write(w1_slave_text(20.0, crc_ok=False))
+
+    sample = wire_reader.read_1wire_sensors_parallel(sensors, retries=1, timeout=1.0, fallback="null")
+
+    assert sample.flags == [wire_reader.FLAG_MISSING]
+    stats = wire_reader.get_sensor_stats()[sensors[0]]
+    assert (stats["crc_failures"], stats["retries"], stats["timeouts"]) == (2, 1, 1)
+
+
+@pytest.mark.parametrize("max_workers, expected", [(wire_reader.MAX_READ_WORKERS, 32), (8, 8), (0, 100), (None, 100)])
+def test_pool_size_is_capped_unless_opted_out(max_workers, expected):
+    assert wire_reader.pool_size(100, max_workers) == expected
+    assert wire_reader.pool_size(3, max_workers) == 3
+
+
+def test_sensors_are_read_concurrently(tmp_path):
+    _, sensors = fake_bus(tmp_path, [20.0 + number for number in range(6)])
+
+    def read_raw(device_file):
+        time.sleep(0.1)
+        return wire_reader.read_temp_raw(device_file)
+
+    started = time.monotonic()
+    sample = wire_reader.read_1wire_sensors_parallel(sensors, read_raw=read_raw)
+
+    # Six sequential reads would take 0.6 s
+    assert time.monotonic() - started < 0.3
+    assert sample.temps == [20.0 + number for number in range(6)]
+
+
+def test_late_read_refreshes_the_last_good_value(tmp_path):
+    _, sensors = fake_bus(tmp_path, [20.0])
+    hang, release = threading.Event(), threading.Event()
+
+    def read_raw(device_file):
+        if hang.is_set():
+            release.wait(10)
+        return wire_reader.read_temp_raw(device_file)
+
+    try:
+        wire_reader.read_1wire_sensors_parallel(sensors, read_raw=read_raw, timeout=0.2)
+        hang.set()
+        with open(sensors[0] + "/w1_slave", "w") as f:
+            f.write(w1_slave_text(25.0))
+        assert wire_reader.read_1wire_sensors_parallel(sensors, read_raw=read_raw, timeout=0.2).temps == [20.0]
+    finally:
+        release.set()
+    wire_reader._pending[sensors[0]].result(10)
+
+    wire_reader.collect_late_reads()
+
+    stats = wire_reader.get_sensor_stats()[sensors[0]]
+    assert (stats["late_reads"], stats["last_good"]) == (1, 25.0)
+    assert not wire_reader._pending
@@ -0,0 +1,286 @@
+import argparse
+import math
+import os
+import random
+import shutil
+import tempfile
+import threading
+import time
+
+# Simulated 1-Wire bus for debugging and load testing without hardware.
+#
+# Builds a fake /sys/bus/w1/devices tree with any number of 28-* devices that the real
+# wire_reader / SensorRegistry code can read. In blocking mode every w1_slave is a named
+# pipe: opening it blocks for the conversion time like the real driver does. The bus
+# master exposes therm_bulk_read. Readings, CRC failures and hot-unplugs are drawn from
+# per-sensor generators seeded from one seed, so runs are reproducible.
+
+DS18B20_RESOLUTION = 0.0625  # 12-bit, degrees per LSB
+
+
+def crc8(data):
+    # Dallas/Maxim CRC-8 (polynomial x^8 + x^5 + x^4 + 1) as used by the DS18B20 scratchpad
+    crc = 0
+    for byte in data:
+        for _ in range(8):
+            mix = (crc ^ byte) & 0x01
+            crc >>= 1
+            if mix:
+                crc ^= 0x8C
+            byte >>= 1
+    return crc
+
+
+def w1_slave_text(temp, crc_ok=True):
+    # Format a reading the way the w1_therm driver prints w1_slave
+    raw = int(round(temp / DS18B20_RESOLUTION)) & 0xFFFF
+    scratchpad = [raw & 0xFF, raw >> 8, 0x4B, 0x46, 0x7F, 0xFF, 0x0C, 0x10]
+    crc = crc8(scratchpad)
+    if not crc_ok:
+        crc ^= 0x5A  # corrupt the transfer
+    hex_bytes = ' '.join(f'{b:02x}' for b in scratchpad + [crc])
+    return (f"{hex_bytes} : crc={crc:02x} {'YES' if crc_ok else 'NO'}\n"
+            f"{hex_bytes} t={int(round(temp / DS18B20_RESOLUTION) * DS18B20_RESOLUTION * 1000)}\n")
+
+
+class SimulatedSensor:
+    """One DS18B20 with mean-reverting thermal drift around a slowly moving setpoint."""
+
+    def __init__(self, rom_id, seed, base_temp=26.0, crc_failure_rate=0.0, unplug_rate=0.0):
+        self.rom_id = rom_id
+        self.rng = random.Random(f"{seed}-{rom_id}")
+        self.base_temp = base_temp + self.rng.uniform(-1.0, 1.0)
+        self.temp = self.base_temp
+        self.phase = self.rng.uniform(0, 2 * math.pi)
+        self.crc_failure_rate = crc_failure_rate
+        self.unplug_rate = unplug_rate
+        self.conversions = 0
+        self.unplugged = False
+
+    def convert(self):
+        # Advance the thermal model by one conversion, returns (temperature, crc_ok)
+        self.conversions += 1
+        setpoint = self.base_temp + 1.5 * math.sin(self.phase + self.conversions / 600.0)
+        self.temp += 0.05 * (setpoint - self.temp) + self.rng.gauss(0, 0.03)
+        crc_ok = self.rng.random() >= self.crc_failure_rate
+        return self.temp, crc_ok
+
+    def should_unplug(self):
+        return self.rng.random() < self.unplug_rate
+
+
+class W1Simulator:
+    """
+    Fake 1-Wire bus. Use base_dir as the base_dir of SensorRegistry or the wire_reader functions.
+
+    conversion_delay is how long a w1_slave read (or a bulk conversion) takes, crc_failure_rate
+    the probability that a reading fails its CRC check, unplug_rate the probability per
+    conversion that a sensor drops off the bus for unplug_duration seconds.
+    """
+
+    def __init__(self, sensors=3, seed=0, root_dir=None, conversion_delay=0.75, crc_failure_rate=0.0,
+                 unplug_rate=0.0, unplug_duration=5.0, blocking=True, bulk_read=True):
+        self.seed = seed
+        self.conversion_delay = conversion_delay
+        self.unplug_duration = unplug_duration
+        self.blocking = blocking
+        self.bulk_read = bulk_read
+
+        self.own_root = root_dir is None
+        self.root_dir = root_dir or tempfile.mkdtemp(prefix="w1sim-")
+        self.base_dir = os.path.join(self.root_dir, 'devices') + os.sep
+        self.bulk_attribute = os.path.join(self.base_dir, 'w1_bus_master1', 'therm_bulk_read')
+
+        rng = random.Random(seed)
+        self.sensors = [SimulatedSensor(f"28-{rng.getrandbits(48):012x}", seed,
+                                        crc_failure_rate=crc_failure_rate, unplug_rate=unplug_rate)
+                        for _ in range(sensors)]
+
+        self.lock = threading.Lock()
+        self.stop_event = threading.Event()
+        self.threads = []
+
+    def device_dir(self, sensor):
+        return os.path.join(self.base_dir, sensor.rom_id)
+
+    def start(self):
+        os.makedirs(os.path.dirname(self.bulk_attribute), exist_ok=True)
+        for sensor in self.sensors:
+            self.plug(sensor)
+        if self.bulk_read:
+            with open(self.bulk_attribute, 'w') as f:
+                f.write('0\n')
+            self.spawn(self.serve_bulk_read)
+        if not self.blocking:
+            self.spawn(self.update_files)
+        return self
+
+    def stop(self):
+        self.stop_event.set()
+        for sensor in self.sensors:
+            self.release_writer(sensor)
+        for thread in self.threads:
+            thread.join(timeout=2)
+        if self.blocking:
+            for sensor in self.sensors:
+                self.release_reader(sensor)
+        if self.own_root:
+            shutil.rmtree(self.root_dir, ignore_errors=True)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def spawn(self, target, *args):
+        thread = threading.Thread(target=target, args=args, daemon=True)
+        thread.start()
+        self.threads.append(thread)
+
+    def plug(self, sensor):
+        device_dir = self.device_dir(sensor)
+        os.makedirs(device_dir, exist_ok=True)
+        temp = sensor.temp
+        self.write_file(os.path.join(device_dir, 'temperature'), f"{int(temp * 1000)}\n")
+        sensor.unplugged = False
+        if self.blocking:
+            os.mkfifo(os.path.join(device_dir, 'w1_slave'))
+            self.spawn(self.serve_w1_slave, sensor)
+        else:
+            self.write_file(os.path.join(device_dir, 'w1_slave'), w1_slave_text(temp))
+
+    def unplug(self, sensor):
+        # Remove the device directory like the kernel does when a probe disappears
+        sensor.unplugged = True
+        shutil.rmtree(self.device_dir(sensor), ignore_errors=True)
+        timer = threading.Timer(self.unplug_duration, self.replug, args=(sensor,))
+        timer.daemon = True
+        timer.start()
+
+    def replug(self, sensor):
+        if not self.stop_event.is_set():
+            self.plug(sensor)
+
+    def write_file(self, path, text):
+        # Write to a temporary name and rename, so readers never see half a file
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(text)
+        os.replace(tmp_path, path)
+
+    def release_writer(self, sensor):
+        # Unblock a writer waiting in open() by briefly opening the pipe for reading
+        fifo = os.path.join(self.device_dir(sensor), 'w1_slave')
+        try:
+            fd = os.open(fifo, os.O_RDONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            pass
+
+    def release_reader(self, sensor):
+        # After stop() nobody serves the pipe any more: hand a waiting reader EOF and remove the pipe
+        fifo = os.path.join(self.device_dir(sensor), 'w1_slave')
+        try:
+            fd = os.open(fifo, os.O_WRONLY | os.O_NONBLOCK)
+            os.close(fd)
+        except OSError:
+            pass
+        try:
+            os.remove(fifo)
+        except OSError:
+            pass
+
+    def serve_w1_slave(self, sensor):
+        # One thread per sensor: every reader that opens w1_slave waits one conversion for its data
+        fifo = os.path.join(self.device_dir(sensor), 'w1_slave')
+        while not self.stop_event.is_set() and not sensor.unplugged:
+            try:
+                with open(fifo, 'w') as f:
+                    if self.stop_event.is_set():
+                        return
+                    time.sleep(self.conversion_delay)
+                    with self.lock:
+                        temp, crc_ok = sensor.convert()
+                    f.write(w1_slave_text(temp, crc_ok))
+            except (BrokenPipeError, FileNotFoundError):
+                pass
+            # Let the reader close its end first, otherwise the next open() pairs with it
+            time.sleep(0.005)
+            if sensor.should_unplug():
+                self.unplug(sensor)
+
+    def update_files(self):
+        # Non-blocking mode: refresh every w1_slave file once per conversion period
+        while not self.stop_event.wait(self.conversion_delay):
+            for sensor in self.sensors:
+                if sensor.unplugged:
+                    continue
+                with self.lock:
+                    temp, crc_ok = sensor.convert()
+                try:
+                    self.write_file(os.path.join(self.device_dir(sensor), 'w1_slave'), w1_slave_text(temp, crc_ok))
+                except FileNotFoundError:
+                    continue
+                if sensor.should_unplug():
+                    self.unplug(sensor)
+
+    def serve_bulk_read(self):
+        # Emulate therm_bulk_read: "trigger" starts one conversion on every sensor
+        while not self.stop_event.wait(0.01):
+            try:
+                with open(self.bulk_attribute, 'r') as f:
+                    command = f.read().strip()
+            except FileNotFoundError:
+                continue
+            if command != 'trigger':
+                continue
+            self.write_file(self.bulk_attribute, '-1\n')
+            time.sleep(self.conversion_delay)
+            for sensor in self.sensors:
+                if sensor.unplugged:
+                    continue
+                with self.lock:
+                    temp, _ = sensor.convert()
+                try:
+                    self.write_file(os.path.join(self.device_dir(sensor), 'temperature'), f"{int(temp * 1000)}\n")
+                except FileNotFoundError:
+                    pass
+            self.write_file(self.bulk_attribute, '1\n')
+
+
+def main():
+    # Headless load test: read a simulated bus through the real SensorRegistry path
+    import wire_reader
+    from sensor_registry import SensorRegistry
+
+    parser = argparse.ArgumentParser(description="Load-test the 1-Wire reader against a simulated bus")
+    parser.add_argument("--sensors", type=int, default=100)
+    parser.add_argument("--cycles", type=int, default=5)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--conversion-delay", type=float, default=0.75)
+    parser.add_argument("--crc-failure-rate", type=float, default=0.0)
+    parser.add_argument("--unplug-rate", type=float, default=0.0)
+    parser.add_argument("--mode", choices=["parallel", "bulk"], default="parallel")
+    parser.add_argument("--workers", type=int, default=wire_reader.MAX_READ_WORKERS, help="0 gives every sensor its own worker")
+    parser.add_argument("--timeout", type=float, default=wire_reader.READ_TIMEOUT)
+    args = parser.parse_args()
+
+    simulator = W1Simulator(args.sensors, args.seed, conversion_delay=args.conversion_delay,
+                            crc_failure_rate=args.crc_failure_rate, unplug_rate=args.unplug_rate)
+    with simulator:
+        registry = SensorRegistry(simulator.base_dir, os.path.join(simulator.root_dir, 'channels.json'))
+        for cycle in range(args.cycles):
+            sample = registry.read(args.mode, args.workers, args.timeout)
+            ok = sum(1 for flag in sample.flags if flag == wire_reader.FLAG_OK)
+            print(f"Cycle {cycle + 1}: {ok}/{len(sample.flags)} sensors ok in {sample.cycle_time:.3f} s")
+        registry.close()
+        wire_reader.shutdown_executor()
+
+    failures = sum(stats["crc_failures"] for stats in wire_reader.get_sensor_stats().values())
+    timeouts = sum(stats["timeouts"] for stats in wire_reader.get_sensor_stats().values())
+    print(f"CRC failures: {failures}, timeouts: {timeouts}")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,29 +1,284 @@
 import glob
+import os
+import threading
 import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor, wait
 
-# Old read functions
+BASE_DIR = '/sys/bus/w1/devices/'
 
-# TODO: optimise this function
+# Upper bound on concurrent w1_slave reads, each one blocks for a full conversion (~750 ms).
+# Up to this many sensors convert at once; 0 or None opts out of the cap and gives every
+# sensor its own worker, which means hundreds of threads on a large bus.
+MAX_READ_WORKERS = 32
 
-def find_temp_sensors():
-    base_dir = '/sys/bus/w1/devices/'
-    return glob.glob(base_dir + '28*')
+# Worst-case DS18B20 conversion time at 12-bit resolution
+BULK_CONVERSION_TIME = 0.75
+
+# Default read budget per sensor: give up after READ_TIMEOUT seconds or READ_RETRIES failed CRC checks
+READ_TIMEOUT = 1.5
+READ_RETRIES = 3
+RETRY_DELAY = 0.2
+
+# Reading quality flags reported next to every temperature
+FLAG_OK = "ok"            # fresh reading
+FLAG_STALE = "stale"      # read failed, last known good value returned
+FLAG_MISSING = "missing"  # read failed and there is no usable value (None)
+
+# One aligned set of readings taken in a single acquisition cycle
+SampleSet = namedtuple("SampleSet", ["timestamp", "sensors", "temps", "read_times", "cycle_time", "flags"])
+
+class SensorReadTimeout(Exception):
+    pass
+
+_executor = None
+_executor_workers = 0
+
+# Reads still running from an earlier cycle, sensor -> future (never submit a second read for them)
+_pending = {}
+
+# Per sensor counters and last known good value
+_stats = {}
+_stats_lock = threading.Lock()
+
+def _sensor_stats(sensor):
+    # Caller must hold _stats_lock
+    if sensor not in _stats:
+        _stats[sensor] = {"reads": 0, "crc_failures": 0, "retries": 0, "timeouts": 0, "late_reads": 0,
+                          "last_good": None, "last_good_time": None}
+    return _stats[sensor]
+
+def count_stat(sensor, key):
+    with _stats_lock:
+        _sensor_stats(sensor)[key] += 1
+
+def get_sensor_stats():
+    # Copy of the counters of every sensor read so far
+    with _stats_lock:
+        return {sensor: dict(stats) for sensor, stats in _stats.items()}
+
+def apply_fallback(sensor, temp, fallback="last_good"):
+    """
+    Turn a raw result into (temperature, flag). A successful reading becomes the new last known
+    good value; a failed one (None) is replaced by the last known good value when fallback is
+    "last_good", otherwise it stays None.
+    """
+    with _stats_lock:
+        stats = _sensor_stats(sensor)
+        if temp is not None:
+            stats["reads"] += 1
+            stats["last_good"] = temp
+            stats["last_good_time"] = time.time()
+            return temp, FLAG_OK
+        if fallback == "last_good" and stats["last_good"] is not None:
+            return stats["last_good"], FLAG_STALE
+        return None, FLAG_MISSING
+
+def find_temp_sensors(base_dir=BASE_DIR):
+    return sorted(glob.glob(base_dir + '28*'))
 
 def read_temp_raw(device_file):
     with open(device_file, 'r') as f:
         return f.readlines()
 
-def read_1wire_sensor(sensor):
+def read_1wire_sensor(sensor, read_raw=read_temp_raw, timeout=READ_TIMEOUT, retries=READ_RETRIES):
+    # Retry until the CRC line says YES, raise SensorReadTimeout once the deadline or retry budget is spent
+    deadline = time.monotonic() + timeout
+    attempts = 0
     while True:
-        lines = read_temp_raw(sensor + '/w1_slave')
+        lines = read_raw(sensor + '/w1_slave')
         if lines[0].strip()[-3:] == 'YES':
             equals_pos = lines[1].find('t=')
             if equals_pos != -1:
                 temp_string = lines[1][equals_pos + 2:]
                 return round(float(temp_string) / 1000.0, 2)
-        time.sleep(0.2)
+        count_stat(sensor, "crc_failures")
+        attempts += 1
+        if attempts > retries or time.monotonic() + RETRY_DELAY > deadline:
+            raise SensorReadTimeout(f"no valid reading after {attempts} attempts")
+        count_stat(sensor, "retries")
+        time.sleep(RETRY_DELAY)
+
+def read_1wire_sensor_timed(sensor, read_raw=read_temp_raw, timeout=READ_TIMEOUT, retries=READ_RETRIES):
+    # Read a single sensor and measure how long the read (conversion included) took, None if it failed
+    start = time.perf_counter()
+    try:
+        temp = read_1wire_sensor(sensor, read_raw, timeout, retries)
+    except SensorReadTimeout as e:
+        count_stat(sensor, "timeouts")
+        print(f"Timed out reading sensor {sensor}: {e}")
+        temp = None
+    except (OSError, IndexError, ValueError) as e:
+        print(f"Failed to read sensor {sensor}: {e}")
+        temp = None
+    return temp, time.perf_counter() - start
+
+def pool_size(sensor_count, max_workers=MAX_READ_WORKERS):
+    # One worker per sensor plus one for every read still stuck in an earlier cycle, capped by
+    # max_workers unless that is 0/None
+    stuck = sum(1 for future in _pending.values() if not future.done())
+    workers = max(1, sensor_count + stuck)
+    return min(workers, max_workers) if max_workers and max_workers > 0 else workers
+
+def get_executor(max_workers):
+    # Shared worker pool, recreated only when it has to grow (idle threads cost nothing, they are started lazily)
+    global _executor, _executor_workers
+    if _executor is None or _executor_workers < max_workers:
+        if _executor is not None:
+            _executor.shutdown(wait=False)
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="w1-read")
+        _executor_workers = max_workers
+    return _executor
+
+def shutdown_executor():
+    global _executor, _executor_workers
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        _executor_workers = 0
+    _pending.clear()
+
+def collect_late_reads():
+    # Take the results of reads that finished after their cycle gave up on them, so they refresh the last known good value
+    for sensor, future in list(_pending.items()):
+        if not future.done():
+            continue
+        del _pending[sensor]
+        if future.cancelled() or future.exception() is not None:
+            continue
+        temp, _ = future.result()
+        if temp is not None:
+            count_stat(sensor, "late_reads")
+            apply_fallback(sensor, temp)
+
+def read_on_pool(sensors, read_one, max_workers, budget, fallback):
+    """
+    Run read_one(sensor) -> (temperature or None, seconds) for every sensor on the worker pool
+    and return a SampleSet. The whole cycle gets one deadline, budget seconds from its start:
+    reads still queued then are cancelled, reads still running are left in the background
+    (their result is picked up by the next cycle, see collect_late_reads), and both are
+    reported through the fallback. A capped pool therefore never stretches a cycle.
+    """
+    timestamp = time.time()
+    start = time.perf_counter()
+    deadline = time.monotonic() + budget
+    if not sensors:
+        return SampleSet(timestamp, [], [], [], 0.0, [])
+
+    collect_late_reads()
+    executor = get_executor(pool_size(len(sensors), max_workers))
+    futures = {}
+    for sensor in sensors:
+        if sensor in _pending:
+            continue  # still stuck in an earlier cycle
+        futures[sensor] = _pending[sensor] = executor.submit(read_one, sensor)
+    wait(list(futures.values()), timeout=max(0.0, deadline - time.monotonic()))
+
+    temps = []
+    read_times = []
+    flags = []
+    for sensor in sensors:
+        future = futures.get(sensor)
+        if future is not None and (future.done() or future.cancel()):
+            del _pending[sensor]
+        if future is not None and future.done() and not future.cancelled() and future.exception() is None:
+            temp, elapsed = future.result()
+        else:
+            count_stat(sensor, "timeouts")
+            temp, elapsed = None, None
+        temp, flag = apply_fallback(sensor, temp, fallback)
+        temps.append(temp)
+        read_times.append(elapsed)
+        flags.append(flag)
+    return SampleSet(timestamp, list(sensors), temps, read_times, time.perf_counter() - start, flags)
+
+def read_1wire_sensors_parallel(sensors=None, max_workers=MAX_READ_WORKERS, read_raw=read_temp_raw,
+                                timeout=READ_TIMEOUT, retries=READ_RETRIES, fallback="last_good"):
+    """
+    Read every sensor concurrently on a worker pool of up to max_workers threads.
+
+    All conversions run at the same time, so a cycle takes roughly one conversion time.
+    Returns a SampleSet with one timestamp for the whole cycle, the read time and a quality
+    flag for each sensor.
+
+    No cycle takes more than timeout plus one retry delay: a read that hangs in the driver,
+    or waits behind others on a full pool, is reported through the fallback (see read_on_pool).
+    """
+    if sensors is None:
+        sensors = find_temp_sensors()
+    return read_on_pool(sensors, lambda sensor: read_1wire_sensor_timed(sensor, read_raw, timeout, retries),
+                        max_workers, timeout + RETRY_DELAY, fallback)
+
+def find_bulk_read_attributes(base_dir=BASE_DIR):
+    # therm_bulk_read lives on each bus master, only newer w1_therm drivers provide it
+    return sorted(glob.glob(os.path.join(base_dir, 'w1_bus_master*', 'therm_bulk_read')))
+
+def trigger_bulk_conversion(attributes):
+    for attribute in attributes:
+        with open(attribute, 'w') as f:
+            f.write('trigger\n')
+
+def wait_bulk_conversion(attributes, conversion_time=BULK_CONVERSION_TIME):
+    # Sleep through one conversion, then poll until no bus reports "-1" (conversion in progress)
+    time.sleep(conversion_time)
+    deadline = time.monotonic() + conversion_time
+    pending = list(attributes)
+    while pending and time.monotonic() < deadline:
+        still_pending = []
+        for attribute in pending:
+            with open(attribute, 'r') as f:
+                if f.read().strip() == '-1':
+                    still_pending.append(attribute)
+        pending = still_pending
+        if pending:
+            time.sleep(0.05)
+    return not pending
+
+def read_converted_temp(sensor, read_raw=read_temp_raw):
+    # After a bulk conversion the driver returns the stored value without converting again.
+    # Returns (temperature or None, seconds) like read_1wire_sensor_timed
+    start = time.perf_counter()
+    try:
+        temp = round(int(read_raw(os.path.join(sensor, 'temperature'))[0].strip()) / 1000.0, 2)
+    except (OSError, IndexError, ValueError) as e:
+        print(f"Failed to read sensor {sensor}: {e}")
+        temp = None
+    return temp, time.perf_counter() - start
+
+def read_1wire_sensors_bulk(sensors=None, base_dir=BASE_DIR, conversion_time=BULK_CONVERSION_TIME, max_workers=MAX_READ_WORKERS,
+                            read_raw=read_temp_raw, timeout=READ_TIMEOUT, retries=READ_RETRIES, fallback="last_good",
+                            attributes=None):
+    """
+    Start one simultaneous conversion on every sensor through therm_bulk_read, wait once,
+    then collect all readings on the worker pool, under the same cycle deadline as
+    read_1wire_sensors_parallel. The cycle takes about one conversion time for the whole bus.
+
+    attributes are the therm_bulk_read files (see find_bulk_read_attributes), looked up in
+    base_dir if None. Falls back to read_1wire_sensors_parallel for the whole cycle when no
+    bus master exposes therm_bulk_read or the driver has no temperature attribute.
+    """
+    if attributes is None:
+        attributes = find_bulk_read_attributes(base_dir)
+    if sensors is None:
+        sensors = find_temp_sensors(base_dir)
+    if not attributes or not any(os.path.exists(os.path.join(sensor, 'temperature')) for sensor in sensors):
+        return read_1wire_sensors_parallel(sensors, max_workers, read_raw, timeout, retries, fallback)
+
+    timestamp = time.time()
+    conversion_start = time.perf_counter()
+    trigger_bulk_conversion(attributes)
+    if not wait_bulk_conversion(attributes, conversion_time):
+        print("Bulk conversion did not finish in time, reading stored values anyway")
+    sample = read_on_pool(sensors, lambda sensor: read_converted_temp(sensor, read_raw), max_workers,
+                          timeout + RETRY_DELAY, fallback)
+    return sample._replace(timestamp=timestamp, cycle_time=time.perf_counter() - conversion_start)
+
+def read_sensors(mode="parallel", max_workers=MAX_READ_WORKERS, timeout=READ_TIMEOUT, retries=READ_RETRIES, fallback="last_good"):
+    # Registry-less entry point, mode is the "acquisition_mode" config value
+    if mode == "bulk":
+        return read_1wire_sensors_bulk(max_workers=max_workers, timeout=timeout, retries=retries, fallback=fallback)
+    return read_1wire_sensors_parallel(max_workers=max_workers, timeout=timeout, retries=retries, fallback=fallback)
 
 def read_1wire_sensors():
-    temp_sensors = find_temp_sensors()
-    temps = [read_1wire_sensor(sensor) for sensor in temp_sensors]
-    return temps if temps else 'No temperature sensors found' # Return message if no sensors found for debugging
\ No newline at end of file
+    temps = read_1wire_sensors_parallel().temps
+    return temps if temps else 'No temperature sensors found' # Return message if no sensors found for debugging
@@ -4,13 +4,21 @@ from collections import deque
 import tkinter as tk
 import debug_functions as debugf
 import db_functions
-import datetime
 from submenu import Submenu
 from configuration import Config
 import sys
-
-# Old reader implementation
-from wire_reader import read_1wire_sensors
+import os
+import threading
+
+import wire_reader
+from sensor_registry import SensorRegistry
+from acquisition import AcquisitionWorker, SampleBuffer
+from w1_simulator import W1Simulator
+import migrations
+import retention
+import export_jobs
+import readings
+from igraph import CHANNEL_COLORS, channel_label
 
 class WireReaderApp:
     def __init__(self):
@@ -32,11 +40,17 @@ class WireReaderApp:
         self.db_path = self.config.get("db_path")
         self.table_name = self.config.get("table_name")
 
-        # Data Variables
+        # Data Variables: the latest reading of each channel, T1 first
         self.data_time = ""
-        self.data_temp1 = 0.0
-        self.data_temp2 = 0.0
-        self.data_temp3 = 0.0
+        self.data_temps = []
+
+        # Cached sensor discovery with a stable ROM ID -> channel mapping, created on first real read
+        self.sensor_registry = None
+        self.simulator = None
+        # channel -> ROM ID last written to the sensors table of the database
+        self.registered_roms = {}
+        # channel -> reading quality flag last reported on the console
+        self.channel_flags = {}
 
         # Bool for stopping the update loop
         self.inserting_data = False
@@ -44,15 +58,13 @@ class WireReaderApp:
         # Store historical data for the graph
         self.max_points = self.config.get("graph_points")
         
-        self.temps1 = deque(maxlen=self.max_points)
-        self.temps2 = deque(maxlen=self.max_points)
-        self.temps3 = deque(maxlen=self.max_points)
+        # One deque, graph line and label per channel, added as channels show up (see add_channels)
+        self.temp_history = []
+        self.lines = []
+        self.temp_vars = []
 
         # Label Variables for UI
         self.time_now = tk.StringVar()
-        self.temp1 = tk.StringVar()
-        self.temp2 = tk.StringVar()
-        self.temp3 = tk.StringVar()
         
         # Create status indicators
         self.create_status_indicators()
@@ -63,10 +75,21 @@ class WireReaderApp:
         # Check database connection
         self.check_db_connection()
 
+        # Databases from before epoch timestamps are converted in the background while recording
+        self.migration_stop = threading.Event()
+        self.migration = migrations.start_background_migration(self.db_path, self.table_name, self.migration_stop)
+        # Ended periods are moved to their own shard files (shard_period), checked every hour
+        self.rotation = migrations.start_shard_rotation(self.db_path, self.table_name, self.config.get("shard_period"),
+                                                        self.migration_stop)
+        # Data older than the retention settings is deleted in small steps, checked every hour
+        self.retention = retention.start_background_retention(self.db_path, self.table_name, self.config.get("retention_raw_days"),
+                                                              self.config.get("retention_rollup_months"), self.migration_stop)
+
         # Live Graph
         self.create_live_graph()
 
-        # Start updating the GUI
+        # Start sampling in the background and updating the GUI
+        self.start_acquisition()
         self.update_all()
 
     def create_ui_elements(self):
@@ -80,13 +103,9 @@ class WireReaderApp:
         tk.Label(time_frame, text="Date:", font=('Arial', '12', 'bold')).pack(side=tk.LEFT, padx=5)
         tk.Label(time_frame, textvariable=self.time_now, font=('Arial', '12')).pack(side=tk.RIGHT, padx=5)
 
-        # Temperature labels
-        temp_frame = tk.Frame(data_frame, relief=tk.SUNKEN, borderwidth=1)
-        temp_frame.pack(fill=tk.X, padx=5, pady=5)
-
-        for i, temp_var in enumerate([self.temp1, self.temp2, self.temp3], start=1):
-            tk.Label(temp_frame, text=f"Temp {i}:", font=('Arial', '12', 'bold')).pack(side=tk.LEFT, padx=5)
-            tk.Label(temp_frame, textvariable=temp_var, font=('Arial', '12')).pack(side=tk.LEFT, padx=5)
+        # Temperature labels, filled in by add_channels
+        self.temp_frame = tk.Frame(data_frame, relief=tk.SUNKEN, borderwidth=1)
+        self.temp_frame.pack(fill=tk.X, padx=5, pady=5)
             
         # Add average temperature label
         self.avg_temp = tk.StringVar()
@@ -131,12 +150,8 @@ class WireReaderApp:
     
     def create_live_graph(self):
         self.fig, self.ax = plt.subplots(figsize=(6, 4))
-        self.line, = self.ax.plot([], [], label="Temp1")
-        self.line2, = self.ax.plot([], [], label="Temp2", color='r')
-        self.line3, = self.ax.plot([], [], label="Temp3", color='g')
         temp_range = self.config.get("temperature_range")
         self.ax.set_ylim(temp_range[0], temp_range[1])
-        self.ax.legend()
         self.ax.set_title("Live Temperature Plot")
         self.ax.set_xlabel(f"Last {self.max_points} records")
         self.ax.set_ylabel("Temperature (°C)")
@@ -146,53 +161,124 @@ class WireReaderApp:
         self.canvas_widget = self.canvas.get_tk_widget()
         self.canvas_widget.pack(padx=10, pady=10)
 
-    def update_all(self):
-        self.update_variables()
-        if self.inserting_data:
-            db_functions.insert_data_to_db(self.db_path, self.table_name, self.data_time, self.data_temp1, self.data_temp2, self.data_temp3)
-        self.update_labels()
-        self.update_graph()
-        self.update_job = self.root.after(self.config.get("update_interval"), self.update_all)
-
-    def update_variables(self):
-        self.data_time = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-
+    # Channel labels per row of the label frame
+    LABELS_PER_ROW = 6
+
+    def add_channels(self, count):
+        # A label, graph line and history for every channel up to count; a new channel's history
+        # starts as a gap as long as the others
+        for channel in range(len(self.temp_history), count):
+            name = readings.channel_name(channel + 1)
+            row, column = divmod(channel, self.LABELS_PER_ROW)
+            temp_var = tk.StringVar()
+            tk.Label(self.temp_frame, text=f"{channel_label(name)}:", font=('Arial', '12', 'bold')).grid(row=row, column=2 * column, padx=5)
+            tk.Label(self.temp_frame, textvariable=temp_var, font=('Arial', '12')).grid(row=row, column=2 * column + 1, padx=5)
+            self.temp_vars.append(temp_var)
+            length = len(self.temp_history[0]) if self.temp_history else 0
+            self.temp_history.append(deque([float('nan')] * length, maxlen=self.max_points))
+            self.lines.append(self.ax.plot([], [], label=channel_label(name), color=CHANNEL_COLORS[channel % len(CHANNEL_COLORS)])[0])
+            self.ax.legend()
+
+    def read_sample(self):
+        # Called on the acquisition thread, returns the temperatures of one cycle
+        if self.config.get("debug_mode") and not self.config.get("simulator_sensors"):
+            return [debugf.random_temp(), debugf.random_temp(), debugf.random_temp()]
+
+        if self.sensor_registry is None:
+            if self.config.get("debug_mode"):
+                # Simulated bus: runs the real read path, with conversion delays, without hardware
+                self.simulator = W1Simulator(self.config.get("simulator_sensors")).start()
+                self.sensor_registry = SensorRegistry(self.simulator.base_dir, os.path.join(self.simulator.root_dir, "channels.json"))
+            else:
+                self.sensor_registry = SensorRegistry(mapping_file=self.config.get("sensor_map_path"),
+                                                      rescan_interval=self.config.get("sensor_rescan_interval"))
+        sample = self.sensor_registry.read(self.config.get("acquisition_mode"), self.config.get("max_read_workers"),
+                                           self.config.get("read_timeout") / 1000.0, self.config.get("read_retries"),
+                                           self.config.get("read_fallback"))
         if self.config.get("debug_mode"):
-            self.data_temp1 = debugf.random_temp()
-            self.data_temp2 = debugf.random_temp()
-            self.data_temp3 = debugf.random_temp()
-        else:
-            temps = read_1wire_sensors()
-            self.data_temp1 = temps[0]
-            self.data_temp2 = temps[1]
-            self.data_temp3 = temps[2]
-        
-        self.temps1.append(self.data_temp1)
-        self.temps2.append(self.data_temp2)
-        self.temps3.append(self.data_temp3)
+            print(f"Read {len(sample.sensors)} channels in {sample.cycle_time:.3f} s "
+                  f"(per sensor: {', '.join('-' if t is None else f'{t:.3f}' for t in sample.read_times)})")
+        # Report a channel only when its reading quality changes, not on every cycle
+        for channel, flag in enumerate(sample.flags, start=1):
+            if self.channel_flags.get(channel, wire_reader.FLAG_OK) != flag:
+                print(f"T{channel}: {flag} reading")
+            self.channel_flags[channel] = flag
+        self.register_sensors(sample.sensors)
+        # Channels without a usable reading stay None and are stored as NULL
+        return sample.temps
+
+    def register_sensors(self, rom_ids):
+        # Record which probe feeds which channel in the database, only when a binding changes
+        for channel, rom_id in enumerate(rom_ids, start=1):
+            if rom_id is not None and self.registered_roms.get(channel) != rom_id:
+                try:
+                    db_functions.register_sensor(self.db_path, self.table_name, readings.channel_name(channel), rom_id)
+                    self.registered_roms[channel] = rom_id
+                except Exception as e:
+                    print(f"Could not register sensor {rom_id}: {e}")
+
+    def start_acquisition(self):
+        # Sensor I/O and database inserts run on their own thread, the Tk loop only renders
+        self.sample_buffer = SampleBuffer()
+        self.acquisition = AcquisitionWorker(self.config, self.read_sample, self.sample_buffer)
+        self.acquisition.start()
+
+    def stop_acquisition(self):
+        if hasattr(self, 'acquisition'):
+            self.acquisition.stop()
+
+    def stop_migration(self):
+        # Migrations, the shard rotation and retention stop between chunks and resume on the next start
+        self.migration_stop.set()
+        for thread in (self.migration, self.rotation, self.retention):
+            if thread is not None:
+                thread.join(timeout=5)
+
+    def update_all(self):
+        # Drain whatever the worker produced since the last frame and redraw once
+        samples = self.sample_buffer.drain()
+        if samples:
+            self.update_variables(samples)
+            self.update_labels()
+            self.update_graph()
+        self.update_job = self.root.after(self.config.get("render_interval"), self.update_all)
+
+    def update_variables(self, samples):
+        self.add_channels(max(len(sample.temps) for sample in samples))
+        for sample in samples:
+            # NaN leaves a gap in the live graph for missing readings, and for channels the sample does not have
+            for channel, history in enumerate(self.temp_history):
+                temp = sample.temps[channel] if channel < len(sample.temps) else None
+                history.append(float('nan') if temp is None else temp)
+
+        latest = samples[-1]
+        self.data_time = latest.data_time
+        self.data_temps = list(latest.temps) + [None] * (len(self.temp_vars) - len(latest.temps))
         
     def update_labels(self):
         # Update label variables with data values
         self.time_now.set(f"{self.data_time}")
-        self.temp1.set(f"{self.data_temp1}")
-        self.temp2.set(f"{self.data_temp2}")
-        self.temp3.set(f"{self.data_temp3}")
+        for temp_var, temp in zip(self.temp_vars, self.data_temps):
+            temp_var.set(f"{temp}")
         
-        # Calculate and update average temperature
-        avg_temp = (self.data_temp1 + self.data_temp2 + self.data_temp3) / 3
-        self.avg_temp.set(f"{avg_temp:.2f} °C")
+        # Calculate and update average temperature of the sensors that answered
+        temps = [t for t in self.data_temps if t is not None]
+        if temps:
+            self.avg_temp.set(f"{sum(temps) / len(temps):.2f} °C")
+        else:
+            self.avg_temp.set("-")
 
     def update_graph(self):
         # Plot temperature data vs index (just using len() for index)
-        indices = list(range(len(self.temps1)))  # Create a simple index list for x-axis this is 'time'
+        count = len(self.temp_history[0]) if self.temp_history else 0
+        indices = list(range(count))  # Create a simple index list for x-axis this is 'time'
 
-        # Set data for each plot
-        self.line.set_data(indices, self.temps1)  # Temp1 plot
-        self.line2.set_data(indices, self.temps2)  # Temp2 plot
-        self.line3.set_data(indices, self.temps3)  # Temp3 plot
+        # Set data for each plot, one line per channel
+        for line, history in zip(self.lines, self.temp_history):
+            line.set_data(indices, history)
 
         # Adjust the x-axis to display a limited number of recent data points
-        self.ax.set_xlim(0, len(self.temps1) + 1)  # Show all available data points, +1 is for slight lead in graph
+        self.ax.set_xlim(0, count + 1)  # Show all available data points, +1 is for slight lead in graph
 
         # Update x-axis ticks and labels (using the index as labels)
         self.ax.xaxis.set_major_locator(plt.MultipleLocator(10))  # Major ticks every 10 data points
@@ -203,7 +289,8 @@ class WireReaderApp:
 
     def export_db(self):
         print("Export DataBase to csv file")
-        db_functions.export_to_csv(self.db_path, self.table_name, self.config.get("export_path"))
+        # Runs on the export thread, the live graph and recording carry on meanwhile
+        export_jobs.export_in_background(self.root, self.db_path, self.table_name, self.config.get("export_path"))
 
         
     def open_submenu(self):
@@ -215,10 +302,12 @@ class WireReaderApp:
     def toggle_insertion(self):
         self.inserting_data = not self.inserting_data
         if self.inserting_data:
+            self.acquisition.recording.set()
             self.toggle_insertion_button.config(text="Stop Recording Data")
             self.data_status.config(text="Data: Recording", bg="green")
             print("Data insertion started")
         else:
+            self.acquisition.recording.clear()
             self.toggle_insertion_button.config(text="Start Recording Data")
             self.data_status.config(text="Data: Not Recording", bg="red")
             print("Data insertion stopped")
@@ -231,6 +320,20 @@ class WireReaderApp:
             print(f"Database connection error: {e}")
             self.db_status.config(text="DB: Error", bg="red")
 
+    def shutdown(self):
+        # Stop every background worker and release the sensors and database connections, shared by both exit paths
+        self.stop_acquisition()
+        self.stop_migration()
+        export_jobs.shutdown_runner()
+        wire_reader.shutdown_executor()
+        if self.sensor_registry is not None:
+            self.sensor_registry.close()
+            self.sensor_registry = None
+        if self.simulator is not None:
+            self.simulator.stop()
+            self.simulator = None
+        db_functions.close_connections()
+
     def exit_click(self):
         if hasattr(self, '_exiting'):
             return  # Prevent multiple calls to exit_click
@@ -242,6 +345,8 @@ class WireReaderApp:
         
         # Save configuration before closing
         self.config.save_config()
+
+        self.shutdown()
         
         self.root.quit()
         self.root.destroy()
@@ -258,6 +363,8 @@ class WireReaderApp:
             if isinstance(window, tk.Toplevel):
                 window.destroy()
 
+        self.shutdown()
+
         # Close the matplotlib figure
         plt.close(self.fig)
 